@@ -0,0 +1,105 @@
+"""
+Bytes on the wire of copy-paste ping-pong: three clients take turns copying
+from a small set of 1MB payloads (random bytes, so compression does not
+blur the numbers), recent ones more often. Every client talks to the server
+through a counting proxy. Compares hash-first announces against sending
+every payload in full (clients offering no features), and prints the
+server blob store stats.
+
+    python benchmarks/bench_blob_cache.py [--copies 40]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import logging
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_compression import ThrottlingProxy, free_port  # noqa: E402
+
+from sync_clip.stuff.sync_signal import *  # noqa: E402
+from sync_clip.remote.protocol import *  # noqa: E402
+from sync_clip.remote.client import Client  # noqa: E402
+from sync_clip.remote.aio_server import AioServer  # noqa: E402
+
+CLIENTS = 3
+PAYLOADS = 6
+SIZE = 1024 * 1024
+
+
+def workload(copies: int, seed=0) -> list:
+    """
+    (client, payload index) of every copy, a client never copies what it
+    has in its clipboard already
+    """
+    rnd = random.Random(seed)
+    history, steps, current = [], [], 0
+    for _ in range(copies):
+        client = rnd.randrange(CLIENTS)
+        if history and rnd.random() < 0.6:
+            index = rnd.choice(history[-3:])
+        else:
+            index = rnd.randrange(PAYLOADS)
+        if index == current:
+            index = (index + 1) % PAYLOADS
+        steps.append((client, index))
+        history.append(index)
+        current = index
+    return steps
+
+
+def bench(features, steps, payloads):
+    port = free_port()
+    server = AioServer(host="127.0.0.1", port=port)
+    threading.Thread(target=server.start, daemon=True).start()
+    time.sleep(0.3)
+    proxies = [ThrottlingProxy(port) for _ in range(CLIENTS)]
+    clients = [Client("127.0.0.1", proxy.port, features=features)
+               for proxy in proxies]
+    for client in clients:
+        client.start()
+    time.sleep(0.5)
+    start = time.perf_counter()
+    for sender, index in steps:
+        clients[sender].send_sync_data(SyncData(payloads[index]))
+        for i, client in enumerate(clients):
+            if i != sender:
+                assert client.recv_sync_sig.get(timeout=30).data \
+                       == payloads[index]
+    seconds = time.perf_counter() - start
+    wire = sum(proxy.upstream_bytes + proxy.downstream_bytes
+               for proxy in proxies)
+    stats = server.blob_stats()
+    for client in clients:
+        client.close()
+    server.close()
+    return wire, seconds, stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--copies", default=40, type=int)
+    args = parser.parse_args()
+    logging.getLogger("sync_clip").setLevel(logging.ERROR)
+
+    payloads = [os.urandom(SIZE) for _ in range(PAYLOADS)]
+    steps = workload(args.copies)
+    for name, features in (("full", ()), ("announce", SUPPORTED_FEATURES)):
+        wire, seconds, stats = bench(features, steps, payloads)
+        print(f"{name:>9}: {wire / 1024 / 1024:7.1f} MB on the wire, "
+              f"{seconds:.2f} s for {len(steps)} copies")
+        if features:
+            print(f"{'':>9}  server store: hit rate {stats['hit_rate']:.2f}"
+                  f" ({stats['hits']}/{stats['hits'] + stats['misses']}), "
+                  f"saved {stats['bytes_saved'] / 1024 / 1024:.1f} MB, "
+                  f"{stats['entries']} entries, "
+                  f"{stats['bytes'] / 1024 / 1024:.1f} MB")
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
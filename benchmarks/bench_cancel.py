@@ -0,0 +1,136 @@
+"""
+Time to the latest clipboard when a large payload is followed by a small
+one. A client copies a 20MB image and, once 1MB of it crossed the link, some
+text; the link is 10MB/s (--rate) on the sending side, then on the
+receiving side. Reports the time from the text being copied to the other
+client holding it, the stale clipboards it got before and after, and the
+bytes through the link, for:
+
+* whole messages: sent in order, every received one delivered (as before
+  priorities)
+* priority: the text overtakes the image, which is still sent whole
+* latest wins: the image is cancelled mid-stream, the receiver keeps the
+  newest clipboard only
+
+    python benchmarks/bench_cancel.py [--rate 10] [--size-mb 20]
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+import threading
+import subprocess
+from queue import Queue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_compression import free_port, ThrottlingProxy  # noqa: E402
+from bench_priority import FifoClient, FifoServer, LINK_BUFFER  # noqa: E402
+
+from sync_clip.stuff.sync_signal import *  # noqa: E402
+from sync_clip.remote.protocol import *  # noqa: E402
+from sync_clip.remote.client import Client  # noqa: E402
+from sync_clip.remote.aio_server import AioServer  # noqa: E402
+
+MODES = ("whole messages", "priority", "latest wins")
+# of the image through the link before the text is copied
+STARTED_BYTES = 1024 * 1024
+
+
+class InOrderServer(AioServer):
+    """
+    Forwards every message whole, as before latest-wins
+    """
+
+    @staticmethod
+    def _is_superseded(peer) -> bool:
+        return False
+
+
+class WholeServer(FifoServer, InOrderServer):
+    ...
+
+
+def serve(port: int, mode: str):
+    logging.getLogger("sync_clip").setLevel(logging.ERROR)
+    cls = {"whole messages": WholeServer, "priority": InOrderServer,
+           "latest wins": AioServer}[mode]
+    cls(host="127.0.0.1", port=port, history_size=0).start()
+
+
+def bench(server_port: int, mode: str, rate: float, size: int,
+          upload: bool) -> dict:
+    cls = FifoClient if mode == "whole messages" else Client
+    # no announces nor deltas, the image goes in full
+    features = (FEATURE_CANCEL,) if mode == "latest wins" else ()
+    proxy = ThrottlingProxy(server_port, rate=rate if upload else None,
+                            downstream_rate=None if upload else rate,
+                            buffer_size=LINK_BUFFER)
+    sender = cls("127.0.0.1", proxy.port if upload else server_port,
+                 features=features)
+    receiver = cls("127.0.0.1", server_port if upload else proxy.port,
+                   features=features)
+    if mode != "latest wins":
+        receiver.recv_sync_sig = Queue()
+    sender.start()
+    receiver.start()
+    time.sleep(0.5)
+    image, text = os.urandom(size), "latest clipboard"
+    threading.Thread(target=sender.send_sync_data, args=(SyncData(image),),
+                     daemon=True).start()
+    while (proxy.upstream_bytes if upload
+           else proxy.downstream_bytes) < STARTED_BYTES:
+        time.sleep(0.005)
+    start = time.monotonic()
+    sender.send_sync_data(SyncData(text))
+    stale = 0
+    while True:
+        sig = receiver.recv_sync_sig.get(timeout=120)
+        if sig.data == text and receiver.recv_sync_sig.empty():
+            break
+        stale += 1
+    seconds = time.monotonic() - start
+    # a stale clipboard arriving later would overwrite the text
+    time.sleep(size / rate + 1)
+    late = receiver.recv_sync_sig.qsize()
+    sender.close()
+    receiver.close()
+    return {"seconds": seconds, "stale": stale, "late": late,
+            "link_bytes": proxy.upstream_bytes if upload
+            else proxy.downstream_bytes}
+
+
+def main():
+    if sys.argv[1:2] == ["--serve"]:
+        serve(int(sys.argv[2]), sys.argv[3])
+        return
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", default=10, type=float,
+                        help="link rate in MB/s")
+    parser.add_argument("--size-mb", default=20, type=int)
+    args = parser.parse_args()
+    logging.getLogger("sync_clip").setLevel(logging.ERROR)
+
+    for mode in MODES:
+        port = free_port()
+        server = subprocess.Popen([sys.executable, __file__, "--serve",
+                                   str(port), mode])
+        time.sleep(1)
+        for upload in (True, False):
+            result = bench(port, mode, args.rate * 1024 * 1024,
+                           args.size_mb * 1024 * 1024, upload)
+            print(f"{mode:>14}, {args.size_mb}MB image then text, "
+                  f"{'sender' if upload else 'receiver'} at "
+                  f"{args.rate:.0f}MB/s: text held after "
+                  f"{result['seconds'] * 1000:6.0f} ms, "
+                  f"{result['stale']} stale before, {result['late']} after, "
+                  f"{result['link_bytes'] / 1024 / 1024:5.1f}MB on the link")
+        server.kill()
+        server.wait()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Cost of one idle poll (clipboard unchanged) across clipboard sizes, with and
+without the `change_token` short-circuit, on the in memory `FakeClipboard`.
+Without a token the poll reads and fingerprints the whole content.
+
+    python benchmarks/bench_change_token.py
+"""
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sync_clip.stuff.clipboards import FakeClipboard  # noqa: E402
+from sync_clip.utils.util_hash import Fingerprint  # noqa: E402
+
+SIZES = [1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024]
+
+
+class Poller(object):
+    """
+    The decision part of `ClipboardMonitor._monitor_this_clip`
+    """
+
+    def __init__(self, clip, use_token):
+        self.clip = clip
+        self.use_token = use_token
+        self.last_token = None
+        self.last_fingerprint = None
+
+    def poll(self):
+        token = self.clip.change_token() if self.use_token else None
+        if token is not None and token == self.last_token:
+            return False
+        data = self.clip.read_clip()
+        self.last_token = token
+        fingerprint = Fingerprint(data)
+        if fingerprint == self.last_fingerprint:
+            return False
+        fingerprint.digest()
+        self.last_fingerprint = fingerprint
+        return True
+
+
+def per_poll_us(poller, size):
+    poller.poll()
+    number = max(3, min(10000, (64 * 1024 * 1024) // size))
+    return min(timeit.repeat(poller.poll, number=number,
+                             repeat=3)) / number * 1e6
+
+
+def main():
+    print(f"{'size':>10} {'read+fp':>12} {'token':>12}   (us per idle poll)")
+    for size in SIZES:
+        clip = FakeClipboard(os.urandom(size))
+        print(f"{size:>10} {per_poll_us(Poller(clip, False), size):>12.1f} "
+              f"{per_poll_us(Poller(clip, True), size):>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
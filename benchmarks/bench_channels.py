@@ -0,0 +1,189 @@
+"""
+Broadcast fan-out with 1000 connections: every connection joins one of 50
+channels (or all of them the default channel, as before channels), one
+connection per channel sends 1KB text updates, the same 50 connections
+without channels. Reports the frames delivered, the wall time until they
+arrived (and the share not dropped from full send queues) and the server
+cpu time per update, and the cost of joining and leaving a channel of 1000
+members.
+
+The connections are raw sockets negotiating the binary protocol, one thread
+drains them all, the server runs in its own process.
+
+    python benchmarks/bench_channels.py [--connections 1000] [--channels 50]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import logging
+import selectors
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_compression import free_port  # noqa: E402
+
+from sync_clip.stuff.sync_signal import *  # noqa: E402
+from sync_clip.remote.protocol import *  # noqa: E402
+from sync_clip.remote.server import Server, Peer  # noqa: E402
+from sync_clip.remote.aio_server import AioServer  # noqa: E402
+
+UPDATES_PER_CHANNEL = 20
+SIZE = 1024
+
+
+def serve(port: int):
+    logging.getLogger("sync_clip").setLevel(logging.ERROR)
+    # the connections send no heartbeats
+    AioServer(host="127.0.0.1", port=port, history_size=0,
+              liveness_timeout=0).start()
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as fp:
+        fields = fp.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def connect(port: int, channel: str) -> socket.socket:
+    conn = socket.create_connection(("127.0.0.1", port))
+    conn.sendall(encode_legacy(ConCheck(protocols=SUPPORTED_PROTOCOLS,
+                                        channel=channel)))
+    reader = SignalReader(conn)
+    while not isinstance(reader.read_signal(), ConCheck):
+        pass
+    conn.setblocking(False)
+    return conn
+
+
+class Drainer(object):
+    """
+    Reads every connection on one thread, counting the bytes received
+    """
+
+    def __init__(self, conns: List[socket.socket]):
+        self.received = 0
+        self.is_closed = False
+        self.selector = selectors.DefaultSelector()
+        for conn in conns:
+            self.selector.register(conn, selectors.EVENT_READ)
+        threading.Thread(target=self._drain, daemon=True).start()
+
+    def _drain(self):
+        while not self.is_closed:
+            for key, _ in self.selector.select(timeout=0.1):
+                try:
+                    self.received += len(key.fileobj.recv(256 * 1024))
+                except BlockingIOError:
+                    continue
+
+    def wait(self, total: int, idle=10.0) -> float:
+        """
+        Wait for `total` bytes, or until nothing arrived for `idle` seconds
+        (slow peers' queues dropped the rest)
+
+        :return: when the last byte arrived
+        """
+        received, last = self.received, time.perf_counter()
+        while self.received < total and time.perf_counter() - last < idle:
+            time.sleep(0.01)
+            if self.received != received:
+                received, last = self.received, time.perf_counter()
+        return last
+
+
+def bench(connections: int, channels: int, senders: int) -> dict:
+    port = free_port()
+    server = subprocess.Popen([sys.executable, __file__, "--serve",
+                               str(port)])
+    time.sleep(1)
+    cpu = cpu_seconds(server.pid)
+    start = time.perf_counter()
+    conns = [connect(port, f"team-{i % channels}" if channels > 1
+                     else DEFAULT_CHANNEL) for i in range(connections)]
+    join_seconds = time.perf_counter() - start
+    join_cpu = cpu_seconds(server.pid) - cpu
+    drainer = Drainer(conns)
+
+    senders = conns[:senders]
+    frames = [b"".join(encode_signal(SyncData(f"{i:04d}".ljust(SIZE, "x")),
+                                     stream_id=i + 1))
+              for i in range(UPDATES_PER_CHANNEL)]
+    updates = UPDATES_PER_CHANNEL * len(senders)
+    members = connections // channels
+    deliveries = updates * (members - 1)
+    cpu = cpu_seconds(server.pid)
+    start = time.perf_counter()
+    for frame in frames:
+        for sender in senders:
+            sender.setblocking(True)
+            sender.sendall(frame)
+            sender.setblocking(False)
+    expected = deliveries * len(frames[0])
+    seconds = drainer.wait(expected) - start
+    arrived = drainer.received / expected
+    send_cpu = cpu_seconds(server.pid) - cpu
+    drainer.is_closed = True
+    for conn in conns:
+        conn.close()
+    server.kill()
+    server.wait()
+    return {"members": members, "updates": updates,
+            "deliveries": deliveries, "arrived": arrived,
+            "seconds": seconds, "cpu": send_cpu,
+            "join_seconds": join_seconds, "join_cpu": join_cpu}
+
+
+def membership_us(members: int, rounds=20000) -> float:
+    """
+    Cost of a peer leaving and joining again a channel of `members` peers
+    """
+    server = Server(host="127.0.0.1", port=0, history_size=0)
+    peers = [Peer(None, ("127.0.0.1", i), None) for i in range(members)]
+    for peer in peers:
+        server._join(peer, "team")
+    start = time.perf_counter()
+    for i in range(rounds):
+        peer = peers[i % members]
+        server._leave(peer)
+        server._join(peer, "team")
+    seconds = time.perf_counter() - start
+    server.tcp_socket.close()
+    return seconds / rounds * 1e6
+
+
+def main():
+    if sys.argv[1:2] == ["--serve"]:
+        serve(int(sys.argv[2]))
+        return
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", default=1000, type=int)
+    parser.add_argument("--channels", default=50, type=int)
+    args = parser.parse_args()
+
+    print(f"{args.connections} connections, {UPDATES_PER_CHANNEL} updates "
+          f"of {SIZE} bytes per sender")
+    for channels in (1, args.channels):
+        result = bench(args.connections, channels, args.channels)
+        name = ("1 channel" if channels == 1
+                else f"{channels} channels")
+        print(f"{name:>12}: {result['updates']} updates from "
+              f"{args.channels} senders, "
+              f"{result['members']} members each, "
+              f"{result['deliveries']} deliveries in "
+              f"{result['seconds']:.2f} s ({result['arrived']:.0%} arrived), "
+              f"server cpu {result['cpu'] / result['updates'] * 1e3:.2f} ms "
+              f"per update; joining took {result['join_seconds']:.2f} s, "
+              f"server cpu {result['join_cpu'] / args.connections * 1e3:.2f}"
+              f" ms per connection")
+    print(f"leave + join a channel of {args.connections} members: "
+          f"{membership_us(args.connections):.1f} us")
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
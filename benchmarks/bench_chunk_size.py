@@ -0,0 +1,84 @@
+"""
+End to end throughput through the server on loopback for fixed chunk sizes
+and for the adaptive `ChunkSizer`.
+
+    python benchmarks/bench_chunk_size.py [--size-mb 64]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sync_clip.stuff.sync_signal import *  # noqa: E402
+from sync_clip.remote.client import Client  # noqa: E402
+from sync_clip.remote.chunking import ChunkSizer  # noqa: E402
+
+SERVER_CODE = """
+import sys
+from sync_clip.remote.aio_server import AioServer
+AioServer(host="127.0.0.1", port=int(sys.argv[1])).start()
+"""
+CHUNK_SIZES = [4 * 1024, 25 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024,
+               4 * 1024 * 1024]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def transfer(sender, receiver, payload, chunk_size):
+    if chunk_size:
+        sender.chunk_sizer = ChunkSizer(chunk_size=chunk_size,
+                                        max_chunk_size=chunk_size,
+                                        min_chunk_size=chunk_size)
+    else:
+        sender.chunk_sizer = ChunkSizer(chunk_size=Client.MAX_MESSAGE_SIZE)
+    start = time.perf_counter()
+    sender.send_sync_data(SyncData(payload))
+    sig = receiver.recv_sync_sig.get(timeout=120)
+    cost = time.perf_counter() - start
+    assert len(sig.data) == len(payload)
+    return cost
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, "-c", SERVER_CODE, str(port)],
+                            cwd=ROOT)
+    time.sleep(1)
+    # the same payload every round, send it in full every time
+    sender = Client("127.0.0.1", port, features=())
+    receiver = Client("127.0.0.1", port)
+    sender.start()
+    receiver.start()
+    try:
+        payload = os.urandom(args.size_mb * 1024 * 1024)
+        print(f"{'chunk':>10}{'MB/s':>10}")
+        for chunk_size in CHUNK_SIZES + [None]:
+            costs = [transfer(sender, receiver, payload, chunk_size)
+                     for _ in range(args.rounds)]
+            # adaptive: each round starts again from the 25KB default
+            name = (f"{chunk_size // 1024}KB" if chunk_size else
+                    f"adaptive, ended at "
+                    f"{sender.chunk_sizer.chunk_size() // 1024}KB")
+            print(f"{name:>10}{args.size_mb / min(costs):>10.1f}")
+    finally:
+        sender.close()
+        receiver.close()
+        proc.kill()
+        os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Transport compression over a slow link: a client sends text clipboards
+through a throttling proxy (token bucket, --mbit) to the server, another
+client receives them. Reports the bytes the proxy forwarded upstream and
+the time from send to receive, per codec and without compression. The
+corpus is text: generated logs and JSON, and stdlib python source.
+
+    python benchmarks/bench_compression.py [--mbit 20]
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import logging
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sync_clip.stuff.sync_signal import *  # noqa: E402
+from sync_clip.remote.compression import *  # noqa: E402
+from sync_clip.remote.client import Client  # noqa: E402
+from sync_clip.remote.aio_server import AioServer  # noqa: E402
+
+SIZE = 1024 * 1024
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def corpus() -> dict:
+    rnd = random.Random(0)
+    logs = "".join(
+        f"2026-10-18 12:{i // 600 % 60:02d}:{i // 10 % 60:02d}.{i % 1000:03d}"
+        f" {rnd.choice(['INFO', 'INFO', 'DEBUG', 'WARNING'])} "
+        f"[worker-{rnd.randrange(8)}] request {rnd.getrandbits(32):08x} "
+        f"{rnd.choice(['GET', 'POST'])} /api/v1/items/{rnd.randrange(10000)}"
+        f" took {rnd.randrange(400)} ms\n" for i in range(20000))
+    records = json.dumps([
+        {"id": i, "name": f"item-{rnd.randrange(100000)}",
+         "price": round(rnd.random() * 100, 2),
+         "tags": rnd.sample(["red", "green", "blue", "new", "sale"], 2),
+         "in_stock": rnd.random() > 0.3} for i in range(12000)], indent=2)
+    source = []
+    for name in sorted(os.listdir(os.path.dirname(json.__path__[0]))):
+        if name.endswith(".py"):
+            with open(os.path.join(os.path.dirname(json.__path__[0]), name),
+                      encoding="utf-8", errors="replace") as fp:
+                source.append(fp.read())
+        if sum(map(len, source)) > SIZE:
+            break
+    return {"logs": logs[:SIZE], "json": records[:SIZE],
+            "source": "".join(source)[:SIZE]}
+
+
+class ThrottlingProxy(object):
+    """
+    Forwards one connection to the server, counting the bytes of both
+    directions, the upstream one limited to `rate` bytes per second (if
+    given) by a token bucket of `BURST` bytes, the downstream one to
+    `downstream_rate`. `buffer_size` bounds the socket buffers, the queue
+    of a link's bottleneck, instead of the kernel's autotuning.
+    """
+    BURST = 16 * 1024
+
+    def __init__(self, server_port: int, rate: float = None,
+                 downstream_rate: float = None, buffer_size: int = None):
+        self.server_port = server_port
+        self.rate = rate
+        self.downstream_rate = downstream_rate
+        self.buffer_size = buffer_size
+        self.upstream_bytes = 0
+        self.downstream_bytes = 0
+        self.listener = self._socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _socket(self) -> socket.socket:
+        sock = socket.socket()
+        if self.buffer_size:
+            for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+                sock.setsockopt(socket.SOL_SOCKET, option, self.buffer_size)
+        return sock
+
+    def _accept(self):
+        conn, _ = self.listener.accept()
+        upstream = self._socket()
+        upstream.connect(("127.0.0.1", self.server_port))
+        threading.Thread(target=self._pipe, args=(conn, upstream, True),
+                         daemon=True).start()
+        threading.Thread(target=self._pipe, args=(upstream, conn, False),
+                         daemon=True).start()
+
+    def _pipe(self, src: socket.socket, dst: socket.socket, upstream: bool):
+        rate = self.rate if upstream else self.downstream_rate
+        tokens, last = 0.0, time.monotonic()
+        try:
+            while True:
+                data = src.recv(self.BURST)
+                if not data:
+                    break
+                if not upstream:
+                    self.downstream_bytes += len(data)
+                else:
+                    self.upstream_bytes += len(data)
+                if rate:
+                    now = time.monotonic()
+                    tokens = min(self.BURST, tokens + (now - last) * rate)
+                    last = now
+                    tokens -= len(data)
+                    if tokens < 0:
+                        time.sleep(-tokens / rate)
+                dst.sendall(data)
+        except OSError:
+            pass
+        finally:
+            dst.close()
+
+
+def bench(server_port, rate, codecs, payloads, rounds=3) -> dict:
+    proxy = ThrottlingProxy(server_port, rate)
+    # no deltas nor announces of the repeated payloads
+    sender = Client("127.0.0.1", proxy.port, codecs=codecs, features=())
+    receiver = Client("127.0.0.1", server_port)
+    receiver.start()
+    time.sleep(0.5)
+    results = {}
+    for name, payload in payloads.items():
+        timings = []
+        for _ in range(rounds):
+            wire_start = proxy.upstream_bytes
+            start = time.perf_counter()
+            sender.send_sync_data(SyncData(payload))
+            sig = receiver.recv_sync_sig.get(timeout=120)
+            timings.append(time.perf_counter() - start)
+            assert sig.data == payload
+        results[name] = (proxy.upstream_bytes - wire_start, min(timings))
+    sender.close()
+    receiver.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mbit", default=20, type=float)
+    args = parser.parse_args()
+    logging.getLogger("sync_clip").setLevel(logging.ERROR)
+
+    port = free_port()
+    server = AioServer(host="127.0.0.1", port=port)
+    threading.Thread(target=server.start, daemon=True).start()
+    time.sleep(0.5)
+    payloads = corpus()
+    rate = args.mbit * 1000 * 1000 / 8
+    print(f"link: {args.mbit} Mbit/s, payloads: "
+          + ", ".join(f"{name} {len(payload) // 1024} KB"
+                      for name, payload in payloads.items()))
+    print(f"{'codec':>6} {'payload':>8} {'wire KB':>8} {'ratio':>6} "
+          f"{'ms':>7}")
+    for codec_id in (CODEC_NONE,) + SUPPORTED_CODECS:
+        codecs = () if codec_id == CODEC_NONE else (codec_id,)
+        name = CODECS[codec_id].name if codec_id else "none"
+        results = bench(port, rate, codecs, payloads)
+        for payload_name, (wire, seconds) in results.items():
+            print(f"{name:>6} {payload_name:>8} {wire // 1024:>8} "
+                  f"{wire / len(payloads[payload_name]):>6.2f} "
+                  f"{seconds * 1000:>7.0f}")
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Bytes on the wire and cpu time of sending an edited 2MB log again: the
+full payload vs a delta against the previous copy, both compressed the way
+`Client` sends them. Edits of growing size: trimming lines at both ends,
+deleting a block in the middle, rewriting lines spread over the log.
+
+    python benchmarks/bench_delta.py
+"""
+import os
+import sys
+import time
+import random
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sync_clip.remote.compression import *  # noqa: E402
+from sync_clip.remote.delta import *  # noqa: E402
+
+LINES = 26000
+EDIT_LINES = [1, 10, 100, 1000, 5000]
+
+
+def log_lines(count, seed=0):
+    rnd = random.Random(seed)
+    return [f"2026-10-18 12:{i // 600 % 60:02d}:{i // 10 % 60:02d} "
+            f"{rnd.choice(['INFO', 'DEBUG', 'WARNING'])} [worker-"
+            f"{rnd.randrange(8)}] request {rnd.getrandbits(32):08x} took "
+            f"{rnd.randrange(400)} ms\n".encode() for i in range(count)]
+
+
+def edits(lines, count):
+    rnd = random.Random(count)
+    middle = len(lines) // 2
+    spread = set(rnd.sample(range(len(lines)), count))
+    yield "trim", lines[count:-count]
+    yield "cut middle", lines[:middle] + lines[middle + count:]
+    yield "rewrite", [line.upper() if i in spread else line
+                      for i, line in enumerate(lines)]
+
+
+def cpu_ms(func, *args, **kwargs):
+    start = time.process_time()
+    result = func(*args, **kwargs)
+    return result, (time.process_time() - start) * 1000
+
+
+def main():
+    lines = log_lines(LINES)
+    base = b"".join(lines)
+    full_wire, _ = compress_payload(base, SUPPORTED_CODECS)
+    print(f"base: {len(base) // 1024} KB, full payload on the wire: "
+          f"{len(full_wire) // 1024} KB ({CODECS[SUPPORTED_CODECS[0]].name})")
+    print(f"{'edit':>10} {'lines':>6} {'full KB':>8} {'full ms':>8} "
+          f"{'delta B':>9} {'encode ms':>10} {'apply ms':>9}")
+    for count in EDIT_LINES:
+        for name, edited in edits(lines, count):
+            target = b"".join(edited)
+            (full, _), full_ms = cpu_ms(compress_payload, target,
+                                        SUPPORTED_CODECS)
+            delta, encode_ms = cpu_ms(
+                encode_delta, base, target,
+                max_size=int(len(target) * MAX_DELTA_RATIO))
+            if delta is None:
+                print(f"{name:>10} {count:>6} {len(full) // 1024:>8} "
+                      f"{full_ms:>8.1f} {'full':>9} {encode_ms:>10.1f}")
+                continue
+            wire, _ = compress_payload(delta, SUPPORTED_CODECS)
+            rebuilt, apply_ms = cpu_ms(apply_delta, base, delta)
+            assert rebuilt == target
+            print(f"{name:>10} {count:>6} {len(full) // 1024:>8} "
+                  f"{full_ms:>8.1f} {len(wire):>9} {encode_ms:>10.1f} "
+                  f"{apply_ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Echoes and lost copies with three monitors on in-memory clipboards sharing
+a server. A and B copy in turns, each as soon as it holds the other's last
+copy (a user copying right after pasting), C only watches; then A and B
+copy at the same moment, a number of times. Reports the clipboards the
+monitors sent that were not copied on their clipboard (echoes), the copies
+in turn that did not reach both other clients, and the concurrent copies
+after which the three clipboards did not end up the same.
+
+Runs with a clipboard keeping what it is given and with one re-encoding
+what the monitor writes into it, with no change token (the "same image,
+different bytes" case). Pass --tree to run another checkout (e.g. a
+``git worktree`` of an older commit) for a before/after comparison.
+
+    python benchmarks/bench_echo.py [--copies 40] [--rounds 20]
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ECHO_CODE = """
+import os, sys, time, socket, logging, threading
+sys.path.insert(0, sys.argv[1])
+from sync_clip.stuff.clipboards import Clipboard, FakeClipboard
+
+REENCODING = sys.argv[2] == "reencoding"
+COPIES, ROUNDS = int(sys.argv[3]), int(sys.argv[4])
+TIMEOUT = 3.0
+
+
+class UserClipboard(FakeClipboard):
+    # `copy` is the user copying, `write_clip` the monitor writing
+    def __init__(self):
+        super().__init__()
+        self.copied = set()
+        self.echoes = 0
+
+    def copy(self, data):
+        self.copied.add(data)
+        FakeClipboard.write_clip(self, data)
+
+    def write_clip(self, data):
+        if REENCODING:
+            data = bytes(data) + b"-reencoded"
+        FakeClipboard.write_clip(self, data)
+
+    def change_token(self):
+        return None if REENCODING else super().change_token()
+
+    def holds(self, data) -> bool:
+        return bytes(self._data).replace(b"-reencoded", b"") == data
+
+
+clips = []
+
+
+def get_clipboard(cls, backend="auto"):
+    clips.append(UserClipboard())
+    return clips[-1]
+
+
+Clipboard.get_clipboard = classmethod(get_clipboard)
+
+from sync_clip.remote.aio_server import AioServer
+from sync_clip.monitor import ClipboardMonitor
+from sync_clip.stuff.sync_signal import SyncData
+
+
+def count_echoes(monitor: ClipboardMonitor):
+    send_sync_data, clip = monitor.rclip.send_sync_data, monitor.tclip
+
+    def send(signal, *args, **kwargs):
+        # sent, but not copied on this clipboard
+        if isinstance(signal, SyncData) and signal.data not in clip.copied:
+            clip.echoes += 1
+        return send_sync_data(signal, *args, **kwargs)
+
+    monitor.rclip.send_sync_data = send
+
+
+def wait(condition) -> bool:
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def image(name: str) -> bytes:
+    return b"\\x89PNG\\r\\n\\x1a\\n" + name.encode()
+
+
+logging.getLogger("sync_clip").setLevel(logging.ERROR)
+with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+server = AioServer(host="127.0.0.1", port=port, history_size=0)
+threading.Thread(target=server.start, daemon=True).start()
+time.sleep(0.5)
+monitors = [ClipboardMonitor("127.0.0.1", port, poll_max_interval=0.1)
+            for _ in range(3)]
+for monitor in monitors:
+    count_echoes(monitor)
+    monitor.start()
+time.sleep(2)
+a, b, c = clips
+
+lost = 0
+for index in range(COPIES):
+    copier, other = (a, b) if index % 2 == 0 else (b, a)
+    data = image(f"copy {index}")
+    copier.copy(data)
+    if not wait(lambda: other.holds(data) and c.holds(data)):
+        lost += 1
+time.sleep(1)
+
+diverged = 0
+for index in range(ROUNDS):
+    a.copy(image(f"a {index}"))
+    b.copy(image(f"b {index}"))
+    if not wait(lambda: a.holds(bytes(b._data).replace(b"-reencoded", b""))
+                and c.holds(bytes(b._data).replace(b"-reencoded", b""))):
+        diverged += 1
+time.sleep(1)
+echoes = sum(clip.echoes for clip in clips)
+print(f"result: {echoes} {lost} {diverged}", flush=True)
+for monitor in monitors:
+    monitor.close()
+os._exit(0)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tree", default=ROOT)
+    parser.add_argument("--copies", default=40, type=int)
+    parser.add_argument("--rounds", default=20, type=int)
+    args = parser.parse_args()
+
+    for mode in ("plain", "reencoding"):
+        proc = subprocess.Popen(
+            [sys.executable, "-c", ECHO_CODE, args.tree, mode,
+             str(args.copies), str(args.rounds)],
+            stdout=subprocess.PIPE, text=True)
+        for line in proc.stdout:
+            if line.startswith("result: "):
+                _, echoes, lost, diverged = line.split()
+                break
+        proc.wait(timeout=10)
+        print(f"{mode:>10} clipboard: {echoes} echoes, {lost}/{args.copies} "
+              f"copies in turn lost, {diverged}/{args.rounds} concurrent "
+              f"copies left the clipboards different")
+
+
+if __name__ == "__main__":
+    main()
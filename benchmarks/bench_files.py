@@ -0,0 +1,177 @@
+"""
+Files copied in a file manager, synced through a server on loopback: a
+client sends one file of random bytes, another receives it. Reports the
+throughput from the copy to the file being received, and the peak memory
+of the sending and receiving processes, per file size, for the file sent
+from disk (sendfile, the receiver writing it into its cache) with and
+without hashing, and for the same bytes read and sent as an in-memory
+clipboard (only up to the 1GB a stream may carry). Linux only.
+
+    python benchmarks/bench_files.py [--sizes-mb 10,100,1024,2048]
+"""
+import os
+import sys
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER_CODE = """
+import sys, logging
+sys.path.insert(0, sys.argv[1])
+from sync_clip.remote.aio_server import AioServer
+from sync_clip.remote.server import Server
+logging.getLogger("sync_clip").setLevel(logging.ERROR)
+server = (AioServer if sys.argv[3] == "aio" else Server)(
+    host="127.0.0.1", port=int(sys.argv[2]), history_size=0,
+    blob_cache_size=0)
+print("ready", flush=True)
+server.start()
+"""
+
+# argv: tree, port, role (send/receive), mode (files/nohash/memory), path
+CLIENT_CODE = """
+import os, sys, time, logging
+sys.path.insert(0, sys.argv[1])
+from sync_clip.remote.client import Client
+from sync_clip.stuff.sync_signal import SyncData, FilesSignal
+logging.getLogger("sync_clip").setLevel(logging.ERROR)
+port, role = int(sys.argv[2]), sys.argv[3]
+mode, path = sys.argv[4], sys.argv[5]
+client = Client(host="127.0.0.1", port=port, max_files_size=1 << 40,
+                hash_files=mode != "nohash", files_dir=path)
+client.start()
+time.sleep(1.5)
+print("ready", flush=True)
+if role == "send":
+    sys.stdin.readline()
+    started = time.time()
+    if mode == "memory":
+        with open(path, "rb") as file:
+            client.send_sync_data(SyncData(file.read()))
+    else:
+        client.send_files([path])
+    print(f"started {started}", flush=True)
+else:
+    while True:
+        sig = client.recv_sync_sig.get()
+        if isinstance(sig, (SyncData, FilesSignal)):
+            break
+    size = (len(sig.data) if isinstance(sig, SyncData)
+            else os.path.getsize(sig.paths[0]))
+    print(f"received {time.time()} {size}", flush=True)
+# ru_maxrss would count the peak of the parent before exec
+with open("/proc/self/status") as status:
+    peak = next(line.split()[1] for line in status
+                if line.startswith("VmHWM"))
+print(f"rss {peak}", flush=True)
+sys.stdin.readline()
+os._exit(0)
+"""
+
+MODES = (("sendfile", "files"), ("sendfile, no hash", "nohash"),
+         ("in memory", "memory"))
+MAX_MEMORY_SIZE = 1024 * 1024 * 1024
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def write_random(path: str, size: int):
+    block = 64 * 1024 * 1024
+    with open(path, "wb") as file:
+        while size > 0:
+            file.write(os.urandom(min(block, size)))
+            size -= block
+
+
+def read_line(proc: subprocess.Popen, prefix: str) -> str:
+    for line in proc.stdout:
+        if line.startswith(prefix):
+            return line[len(prefix):].strip()
+    raise RuntimeError(f"{prefix!r} never printed")
+
+
+def run(tree: str, port: int, mode: str, path: str, cache: str,
+        timeout: float) -> tuple:
+    procs = [subprocess.Popen(
+        [sys.executable, "-c", CLIENT_CODE, tree, str(port), role, mode,
+         target], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        for role, target in (("receive", cache), ("send", path))]
+    receiver, sender = procs
+    # a transfer lost (e.g. a peer dropped) fails the run, not the benchmark
+    deadline = threading.Timer(timeout, lambda: [proc.kill()
+                                                 for proc in procs])
+    deadline.start()
+    try:
+        for proc in procs:
+            read_line(proc, "ready")
+        sender.stdin.write("\n")
+        sender.stdin.flush()
+        started = float(read_line(sender, "started"))
+        received, size = read_line(receiver, "received").split()
+        rss = [int(read_line(proc, "rss")) for proc in (sender, receiver)]
+        return float(received) - started, int(size), rss
+    finally:
+        deadline.cancel()
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tree", default=ROOT)
+    parser.add_argument("--server", default="aio", choices=("aio", "thread"))
+    parser.add_argument("--sizes-mb", default="10,100,1024,2048")
+    parser.add_argument("--timeout", default=300, type=float,
+                        help="seconds a file may take to arrive")
+    parser.add_argument("--dir", default=None,
+                        help="where the files are written, default: a "
+                             "temporary directory")
+    args = parser.parse_args()
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-c", SERVER_CODE, args.tree, str(port),
+         args.server], stdout=subprocess.PIPE, text=True)
+    read_line(server, "ready")
+    work = tempfile.mkdtemp(prefix="bench_files-", dir=args.dir)
+    try:
+        for size_mb in map(int, args.sizes_mb.split(",")):
+            size = size_mb * 1024 * 1024
+            path = os.path.join(work, f"{size_mb}MB.bin")
+            write_random(path, size)
+            for name, mode in MODES:
+                if mode == "memory" and size > MAX_MEMORY_SIZE:
+                    print(f"{size_mb:>5}MB {name:>17}: over the stream limit")
+                    continue
+                cache = tempfile.mkdtemp(dir=work)
+                try:
+                    seconds, received, (send_rss, recv_rss) = run(
+                        args.tree, port, mode, path, cache, args.timeout)
+                except RuntimeError:
+                    print(f"{size_mb:>5}MB {name:>17}: not received")
+                    continue
+                finally:
+                    shutil.rmtree(cache, ignore_errors=True)
+                assert received == size, (received, size)
+                print(f"{size_mb:>5}MB {name:>17}: "
+                      f"{size / seconds / 1024 / 1024:7.1f} MB/s, peak rss "
+                      f"sender {send_rss // 1024}MB receiver "
+                      f"{recv_rss // 1024}MB", flush=True)
+            os.remove(path)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+        server.kill()
+
+
+if __name__ == "__main__":
+    main()
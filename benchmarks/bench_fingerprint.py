@@ -0,0 +1,51 @@
+"""
+Cost of deciding whether the clipboard changed, per poll, across payload
+sizes: the old full md5 hexdigest vs a full blake2b vs `Fingerprint` on
+unchanged content (the common case) and on changed content.
+
+    python benchmarks/bench_fingerprint.py
+"""
+import os
+import sys
+import timeit
+from hashlib import md5
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sync_clip.utils.util_hash import Fingerprint, hash_data  # noqa: E402
+
+SIZES = [1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024]
+
+
+def per_call_us(func, size):
+    number = max(3, min(10000, (64 * 1024 * 1024) // size))
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    print(f"{'size':>10} {'md5 hex':>12} {'blake2b':>12} "
+          f"{'fp same':>12} {'fp changed':>12}   (us per poll)")
+    for size in SIZES:
+        data = os.urandom(size)
+        changed = data[:-1] + b"x"
+        last = Fingerprint(data)
+        last.digest()
+
+        def unchanged():
+            return Fingerprint(data) == last
+
+        def modified():
+            fingerprint = Fingerprint(changed)
+            if fingerprint != last:
+                fingerprint.digest()
+
+        print(f"{size:>10} "
+              f"{per_call_us(lambda: md5(data).hexdigest(), size):>12.1f} "
+              f"{per_call_us(lambda: hash_data(data), size):>12.1f} "
+              f"{per_call_us(unchanged, size):>12.1f} "
+              f"{per_call_us(modified, size):>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Server memory with a full clipboard history, and catch-up latency of newly
+connected clients. A server process keeps a 1GB history (--history-mb) that
+a client fills with 1MB random payloads, going round the ring once more
+than it holds. Reports the server RSS split in anonymous memory (the Python
+heap) and file pages (the history map), with the blob store at its default
+size and disabled, and without history. Then times clients connecting
+until they have the latest entry: fresh ones fetching it, ones having it
+already (announce hit), and ones offering no features (sent in full), and
+paging through the history.
+
+    python benchmarks/bench_history.py [--history-mb 1024]
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_compression import free_port  # noqa: E402
+
+from sync_clip.stuff.sync_signal import *  # noqa: E402
+from sync_clip.remote.protocol import *  # noqa: E402
+from sync_clip.remote.client import Client  # noqa: E402
+from sync_clip.remote.aio_server import AioServer  # noqa: E402
+from sync_clip.utils.util_hash import hash_data  # noqa: E402
+from sync_clip.utils.util_path import get_cache_data_filepath  # noqa: E402
+
+SIZE = 1024 * 1024
+ROUNDS = 5
+
+
+def serve(port: int, history_mb: int, blob_cache_mb: int):
+    logging.getLogger("sync_clip").setLevel(logging.ERROR)
+    AioServer(host="127.0.0.1", port=port,
+              blob_cache_size=blob_cache_mb * 1024 * 1024,
+              history_size=history_mb * 1024 * 1024).start()
+
+
+def rss(pid: int) -> dict:
+    with open(f"/proc/{pid}/status") as fp:
+        fields = dict(line.split(":", 1) for line in fp)
+    return {name: int(fields[name].split()[0]) // 1024
+            for name in ("VmRSS", "RssAnon", "RssFile")}
+
+
+def fill(port: int, count: int) -> bytes:
+    """
+    Send `count` payloads, waiting until the server has them all (has them
+    in its history, or a second after without history)
+
+    :return: the last payload
+    """
+    sender = Client("127.0.0.1", port, features=())
+    probe = Client("127.0.0.1", port)
+    probe.start()
+    payload = b""
+    for _ in range(count):
+        payload = os.urandom(SIZE)
+        sender.send_sync_data(SyncData(payload))
+    while True:
+        page = probe.history(limit=1)
+        if page is None:
+            time.sleep(1)
+            break
+        if page and page[0][1] == hash_data(payload):
+            break
+        time.sleep(0.2)
+    sender.close()
+    probe.close()
+    return payload
+
+
+def catch_up_ms(port: int, latest: bytes, features=SUPPORTED_FEATURES,
+                has_latest=False) -> float:
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        client = Client("127.0.0.1", port, features=features)
+        if has_latest:
+            client.blobs.put(hash_data(latest), latest)
+        client.start()
+        assert client.recv_sync_sig.get(timeout=30).data == latest
+        timings.append(time.perf_counter() - start)
+        client.close()
+    return statistics.median(timings) * 1000
+
+
+def page_ms(port: int) -> Tuple[float, int]:
+    client = Client("127.0.0.1", port)
+    client.start()
+    start = time.perf_counter()
+    before, entries = 0, 0
+    while True:
+        page = client.history(before, limit=100)
+        if not page:
+            break
+        entries += len(page)
+        before = page[-1][0]
+    seconds = time.perf_counter() - start
+    client.close()
+    return seconds * 1000, entries
+
+
+def run(history_mb: int, blob_cache_mb: int, measure_latency: bool):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, __file__, "--serve", str(port),
+                               str(history_mb), str(blob_cache_mb)])
+    time.sleep(1)
+    idle = rss(server.pid)
+    count = (history_mb or 1024) + 64
+    start = time.perf_counter()
+    latest = fill(port, count)
+    seconds = time.perf_counter() - start
+    full = rss(server.pid)
+    print(f"history {history_mb:>5} MB, blob cache {blob_cache_mb:>4} MB: "
+          f"{count} MB in {seconds:.1f} s, RSS idle {idle['VmRSS']} MB, "
+          f"full {full['VmRSS']} MB (anon {full['RssAnon']} MB, file "
+          f"{full['RssFile']} MB)")
+    if measure_latency:
+        for name, options in (("fetch", {}),
+                              ("announce hit", {"has_latest": True}),
+                              ("no features", {"features": ()})):
+            print(f"  catch-up {name:>12}: "
+                  f"{catch_up_ms(port, latest, **options):6.1f} ms")
+        milliseconds, entries = page_ms(port)
+        print(f"  paging {entries} entries: {milliseconds:.1f} ms")
+    server.kill()
+    server.wait()
+    if history_mb:
+        os.remove(get_cache_data_filepath("server", f"history-{port}.ring"))
+
+
+def main():
+    if sys.argv[1:2] == ["--serve"]:
+        serve(*map(int, sys.argv[2:5]))
+        return
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history-mb", default=1024, type=int)
+    args = parser.parse_args()
+    logging.getLogger("sync_clip").setLevel(logging.ERROR)
+
+    run(args.history_mb, 256, measure_latency=True)
+    run(args.history_mb, 0, measure_latency=False)
+    run(0, 256, measure_latency=False)
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
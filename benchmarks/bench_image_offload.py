@@ -0,0 +1,91 @@
+"""
+Remote-apply latency while a large screenshot is being reduced: a client's
+clipboard (`FakeClipboard`) holds a big PNG, and right after its monitor
+picked it up another client sends a text. Measures how long until the text
+lands in the clipboard, and checks that it is not overwritten afterwards by
+the reduced screenshot. Pass --tree to run another checkout (e.g. a
+``git worktree`` of an older commit) for a before/after comparison.
+
+    python benchmarks/bench_image_offload.py [--width 5120 --height 2880]
+"""
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_image_reduce import screenshot  # noqa: E402
+
+MONITOR_CODE = """
+import os, sys, time, socket, logging, threading
+sys.path.insert(0, sys.argv[1])
+from sync_clip.stuff.clipboards import Clipboard, FakeClipboard
+
+with open(sys.argv[2], "rb") as fp:
+    clip = FakeClipboard(fp.read())
+Clipboard.get_clipboard = classmethod(lambda cls, backend="auto": clip)
+
+from sync_clip.stuff.sync_signal import SyncData
+from sync_clip.remote.client import Client
+from sync_clip.remote.aio_server import AioServer
+from sync_clip.monitor import ClipboardMonitor
+
+logging.getLogger("sync_clip").setLevel(logging.ERROR)
+with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+server = AioServer(host="127.0.0.1", port=port)
+threading.Thread(target=server.start, daemon=True).start()
+time.sleep(0.5)
+monitor = ClipboardMonitor("127.0.0.1", port)
+sender = Client(host="127.0.0.1", port=port)
+sender.start()
+time.sleep(2)
+
+monitor.start()
+# the first poll picks up the screenshot
+time.sleep(0.2)
+text = b"remote text"
+start = time.perf_counter()
+sender.send_sync_data(SyncData(text))
+while clip._data != text and time.perf_counter() - start < 30:
+    time.sleep(0.001)
+latency = time.perf_counter() - start
+# let a pending reduction finish
+time.sleep(5)
+print(f"result: {latency * 1000:.1f} {clip._data == text}", flush=True)
+monitor.close()
+sender.close()
+os._exit(0)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tree", default=ROOT)
+    parser.add_argument("--width", default=5120, type=int)
+    parser.add_argument("--height", default=2880, type=int)
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix=".png") as fp:
+        fp.write(screenshot(args.width, args.height))
+        fp.flush()
+        proc = subprocess.Popen(
+            [sys.executable, "-c", MONITOR_CODE, args.tree, fp.name],
+            stdout=subprocess.PIPE, text=True)
+        # image worker processes may outlive the monitor for a moment and
+        # hold stdout open, read up to the result line only
+        for line in proc.stdout:
+            if line.startswith("result: "):
+                _, latency, kept = line.split()
+                break
+        proc.wait(timeout=10)
+    print(f"screenshot {args.width}x{args.height}: remote text applied "
+          f"after {latency} ms, still in the clipboard afterwards: {kept}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Time and encode count of shrinking screenshots under the 1MB clipboard
+limit: the previous binary search over scales vs `ImageReducer`. The corpus
+is synthetic (windows with text, a photo-like area), generated per size.
+
+    python benchmarks/bench_image_reduce.py
+"""
+import os
+import sys
+import time
+import random
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from sync_clip.utils.utiil_image import ImageReducer  # noqa: E402
+
+SIZES = [(2560, 1440), (2880, 1800), (3840, 2160), (5120, 2880)]
+LIMIT_SIZE = 1024 * 1024
+
+
+def screenshot(width, height, seed=0) -> bytes:
+    rnd = random.Random(seed)
+    im = Image.new("RGB", (width, height), (240, 240, 240))
+    draw = ImageDraw.Draw(im)
+    for _ in range(8):
+        x0, y0 = rnd.randrange(width // 2), rnd.randrange(height // 2)
+        x1 = x0 + rnd.randrange(width // 4, width // 2)
+        y1 = y0 + rnd.randrange(height // 4, height // 2)
+        draw.rectangle([x0, y0, x1, y1], fill=(255, 255, 255),
+                       outline=(120, 120, 120))
+        draw.rectangle([x0, y0, x1, y0 + 24], fill=(rnd.randrange(256), 90,
+                                                    160))
+        for y in range(y0 + 32, y1 - 12, 14):
+            words = " ".join(
+                "".join(rnd.choice("abcdefghijklmnopqrstuvwxyz")
+                        for _ in range(rnd.randint(2, 9)))
+                for _ in range(rnd.randint(3, 20)))
+            draw.text((x0 + 8, y), words, fill=(rnd.randrange(80),) * 3)
+    # a photo: noise over a gradient
+    pw, ph = width // 2, height // 2
+    photo = Image.blend(Image.effect_noise((pw, ph), 30).convert("RGB"),
+                        Image.linear_gradient("L").resize((pw, ph))
+                        .convert("RGB"), 0.6)
+    im.paste(photo, (width - pw - 40, height - ph - 40))
+    output = BytesIO()
+    im.save(output, "png")
+    return output.getvalue()
+
+
+def old_reduce(byte_datas, limit_size=LIMIT_SIZE):
+    """
+    The previous `reduce_image_size`, counting encodes
+    """
+    if len(byte_datas) <= limit_size:
+        return byte_datas, 0
+    im = Image.open(BytesIO(byte_datas))
+    asa, sa, encodes = 0.5, 0.5, 0
+    width, height = im.size
+    while True:
+        output = BytesIO()
+        im.resize((int(width * sa), int(height * sa))).save(output, "png")
+        encodes += 1
+        diff = len(output.getvalue()) - limit_size
+        if -40000 < diff < 0:
+            return output.getvalue(), encodes
+        asa = asa / 2
+        sa = sa + asa if diff < -40000 else sa - asa
+
+
+def main():
+    print(f"{'screenshot':>11} {'input KB':>9} {'old ms':>8} {'old n':>6} "
+          f"{'new ms':>8} {'new n':>6} {'new KB':>7} {'memo ms':>8}")
+    for width, height in SIZES:
+        data = screenshot(width, height)
+        start = time.perf_counter()
+        _, old_encodes = old_reduce(data)
+        old_ms = (time.perf_counter() - start) * 1000
+
+        reducer = ImageReducer(LIMIT_SIZE)
+        start = time.perf_counter()
+        output, _ = reducer.reduce(data)
+        new_ms = (time.perf_counter() - start) * 1000
+        new_encodes = reducer.encodes
+        start = time.perf_counter()
+        reducer.reduce(data)
+        memo_ms = (time.perf_counter() - start) * 1000
+        print(f"{width:>5}x{height:<5} {len(data) // 1024:>9} "
+              f"{old_ms:>8.0f} {old_encodes:>6} {new_ms:>8.0f} "
+              f"{new_encodes:>6} {len(output) // 1024:>7} {memo_ms:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Bytes moved per copy in a simulated office workload: four monitors on
+in-memory clipboards share a server, each through a proxy counting the
+bytes of its link. Users copy short texts, rich text from a document (text
+and html), source files and screenshots, on a random machine; a copy is
+pasted on one other machine a third of the time, most are not pasted
+anywhere else. Reports the bytes on all links per copy, by kind, with every
+copy sent whole (a lazy threshold of 0) and with large copies offered by
+format and fetched on paste, then the median time a paste waits for a fetch.
+
+    python benchmarks/bench_lazy.py [--copies 60] [--threshold-kb 64]
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LAZY_CODE = """
+import os, sys, time, socket, random, logging, threading, statistics
+from io import BytesIO
+from PIL import Image, ImageDraw
+sys.path.insert(0, sys.argv[1])
+sys.path.insert(0, os.path.join(sys.argv[1], "benchmarks"))
+from sync_clip.stuff.clipboards import Clipboard, FakeClipboard
+
+THRESHOLD, COPIES = int(sys.argv[2]), int(sys.argv[3])
+MACHINES = 4
+TIMEOUT = 3.0
+
+clips = []
+
+
+def get_clipboard(cls, backend="auto"):
+    clips.append(FakeClipboard(lazy=True))
+    return clips[-1]
+
+
+Clipboard.get_clipboard = classmethod(get_clipboard)
+
+from bench_compression import ThrottlingProxy
+from sync_clip.remote.aio_server import AioServer
+from sync_clip.monitor import ClipboardMonitor
+from sync_clip.stuff.sync_signal import MIME_TEXT, MIME_HTML, MIME_PNG
+
+rand = random.Random(7)
+
+
+def words(count: int) -> str:
+    return " ".join(rand.choice(("the", "report", "quarter", "sales",
+                                 "meeting", "budget", "team", "review",
+                                 "draft", "numbers", "plan", "customer"))
+                    for _ in range(count))
+
+
+def screenshot(index: int) -> bytes:
+    im = Image.new("RGB", (1280, 720), (40, 44, 52))
+    draw = ImageDraw.Draw(im)
+    for line in range(40):
+        draw.text((20, 16 * line + 10), f"window {index} {words(6)}",
+                  fill=(220, 220, 220))
+    # a photo in the page, not compressible
+    im.paste(Image.frombytes("RGB", (240, 180), rand.randbytes(240 * 180 * 3)
+                             if hasattr(rand, "randbytes")
+                             else os.urandom(240 * 180 * 3)), (900, 400))
+    output = BytesIO()
+    im.save(output, format="png")
+    return output.getvalue()
+
+
+def copy(kind: str, index: int) -> dict:
+    if kind == "text":
+        return {MIME_TEXT: f"{index} {words(rand.randint(3, 60))}".encode()}
+    if kind == "document":
+        paragraphs = [words(rand.randint(40, 120)) for _ in range(12)]
+        html = "".join(f'<p style="font-family: Calibri; margin: 0 0 8pt">'
+                       f'<span lang="en-US">{p}</span></p>' * 10
+                       for p in paragraphs)
+        text = f"{index} " + "\\n".join(paragraphs)
+        return {MIME_TEXT: text.encode(), MIME_HTML: html.encode()}
+    if kind == "source":
+        return {MIME_TEXT: f"# {index}\\n".encode() + "".join(
+            f"    value_{line} = compute({words(4)!r}, {line})\\n"
+            for line in range(rand.randint(1500, 3000))).encode()}
+    return {MIME_PNG: screenshot(index)}
+
+
+def as_bytes(data) -> bytes:
+    return data.encode() if isinstance(data, str) else bytes(data or b"")
+
+
+def wait(condition) -> bool:
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def link_bytes() -> int:
+    return sum(proxy.upstream_bytes + proxy.downstream_bytes
+               for proxy in proxies)
+
+
+logging.getLogger("sync_clip").setLevel(logging.ERROR)
+with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+server = AioServer(host="127.0.0.1", port=port, history_size=0)
+threading.Thread(target=server.start, daemon=True).start()
+time.sleep(0.5)
+proxies = [ThrottlingProxy(port) for _ in range(MACHINES)]
+monitors = [ClipboardMonitor("127.0.0.1", proxy.port, poll_max_interval=0.1,
+                             lazy_threshold=THRESHOLD)
+            for proxy in proxies]
+for monitor in monitors:
+    monitor.start()
+time.sleep(2)
+
+kinds = rand.choices(("text", "document", "source", "screenshot"),
+                     weights=(55, 15, 10, 20), k=COPIES)
+moved, counts, pasted, good, waits = {}, {}, 0, 0, []
+for index, kind in enumerate(kinds):
+    formats = copy(kind, index)
+    source = rand.randrange(MACHINES)
+    others = [clip for clip in clips if clip is not clips[source]]
+    writes = [clip.writes for clip in others]
+    start = link_bytes()
+    clips[source].copy_formats(formats)
+    wait(lambda: all(clip.writes > count
+                     for clip, count in zip(others, writes)))
+    time.sleep(0.3)
+    if rand.random() < 1 / 3:
+        target = rand.choice(others)
+        pasted += len(formats)
+        for mime, data in formats.items():
+            fetched = target._offered is not None
+            started = time.perf_counter()
+            good += as_bytes(target.paste(mime)) == data
+            if fetched:
+                waits.append(time.perf_counter() - started)
+        time.sleep(0.2)
+    moved[kind] = moved.get(kind, 0) + link_bytes() - start
+    counts[kind] = counts.get(kind, 0) + 1
+
+for kind in counts:
+    print(f"kind: {kind} {counts[kind]} {moved[kind]}", flush=True)
+print(f"result: {sum(moved.values())} {pasted} {good} "
+      f"{statistics.median(waits) if waits else 0}", flush=True)
+for monitor in monitors:
+    monitor.close()
+os._exit(0)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tree", default=ROOT)
+    parser.add_argument("--copies", default=60, type=int)
+    parser.add_argument("--threshold-kb", default=64, type=int)
+    args = parser.parse_args()
+
+    for name, threshold in (("eager", 0), ("lazy", args.threshold_kb * 1024)):
+        proc = subprocess.Popen(
+            [sys.executable, "-c", LAZY_CODE, args.tree, str(threshold),
+             str(args.copies)], stdout=subprocess.PIPE, text=True)
+        kinds = []
+        for line in proc.stdout:
+            if line.startswith("kind: "):
+                _, kind, count, moved = line.split()
+                kinds.append(f"{kind} {int(moved) / int(count) / 1024:.0f}KB")
+            elif line.startswith("result: "):
+                _, moved, pasted, good, paste_wait = line.split()
+                break
+        proc.wait(timeout=10)
+        print(f"{name:>5}: {int(moved) / args.copies / 1024:.0f}KB per copy "
+              f"({', '.join(kinds)}), {good}/{pasted} formats pasted intact"
+              + (f", paste fetched in {float(paste_wait) * 1000:.1f} ms"
+                 if float(paste_wait) else ""))
+
+
+if __name__ == "__main__":
+    main()
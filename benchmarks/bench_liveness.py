@@ -0,0 +1,218 @@
+"""
+Liveness tracking at scale and eviction latency.
+
+First the cost of one heartbeat in `LivenessTracker` (touch, plus the
+evictions check) against the previous scan of every client per heartbeat,
+for 1k and 10k clients. Then a server process with 1k and 10k connections
+sending a heartbeat every 3 seconds: server cpu per heartbeat, and the
+latency of evicting 100 connections that fall silent (their socket stays
+open, like a suspended laptop), from their deadline to the server closing
+them.
+
+    python benchmarks/bench_liveness.py [--timeout 10]
+"""
+import os
+import sys
+import time
+import socket
+import random
+import argparse
+import functools
+import logging
+import threading
+import selectors
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_compression import free_port  # noqa: E402
+from bench_channels import cpu_seconds  # noqa: E402
+
+from sync_clip.stuff.sync_signal import *  # noqa: E402
+from sync_clip.remote.protocol import *  # noqa: E402
+from sync_clip.remote.liveness import *  # noqa: E402
+from sync_clip.remote.aio_server import AioServer  # noqa: E402
+
+HEARTBEAT_INTERVAL = 3.0
+SILENT = 100
+
+
+def serve(port: int, timeout: float):
+    logging.getLogger("sync_clip").setLevel(logging.ERROR)
+    AioServer(host="127.0.0.1", port=port, history_size=0,
+              liveness_timeout=timeout).start()
+
+
+def scan_update(clients: dict, addr, now: float):
+    """
+    The previous ``ClientSet.update_client``: every heartbeat rescans all
+    clients for expired ones
+    """
+    clients[addr] = now
+    expired = [addr for addr, last in clients.items() if now - last > 3]
+    for addr in expired:
+        clients.pop(addr)
+
+
+def per_heartbeat_us(clients: int, rounds: int, update) -> float:
+    """
+    Microseconds per `update(client, now)` over `rounds` heartbeat intervals
+    of `clients` clients, the first interval (filling) is not counted
+    """
+    order = list(range(clients))
+    step = HEARTBEAT_INTERVAL / clients
+    now, seconds = 0.0, 0.0
+    for interval in range(rounds + 1):
+        random.shuffle(order)
+        start = time.perf_counter()
+        for client in order:
+            now += step
+            update(client, now)
+        if interval:
+            seconds += time.perf_counter() - start
+    return seconds / (clients * rounds) * 1e6
+
+
+def tracker_us(clients: int) -> Tuple[float, float]:
+    """
+    Microseconds per heartbeat of the previous scan and of the tracker
+    """
+    scanned = {}
+    scan = per_heartbeat_us(clients, 1, functools.partial(scan_update,
+                                                          scanned))
+    clock = [0.0]
+    tracker = LivenessTracker(LIVENESS_TIMEOUT, clock=lambda: clock[0])
+
+    def touch(client, now):
+        clock[0] = now
+        tracker.touch(client)
+        tracker.expired()
+
+    return scan, per_heartbeat_us(clients, 10, touch)
+
+
+def connect_all(port: int, count: int,
+                heartbeat: bytes) -> List[socket.socket]:
+    """
+    Connecting thousands of sockets takes a while (the accept backlog
+    overflows), the connected ones beat every interval meanwhile
+    """
+    conns = []
+    last_beat = time.perf_counter()
+    for _ in range(count):
+        conn = socket.create_connection(("127.0.0.1", port))
+        conn.sendall(heartbeat)
+        conn.setblocking(False)
+        conns.append(conn)
+        if time.perf_counter() - last_beat > HEARTBEAT_INTERVAL:
+            last_beat = time.perf_counter()
+            for conn in conns:
+                conn.send(heartbeat)
+    return conns
+
+
+def send_heartbeats(conns: List[socket.socket], heartbeat: bytes,
+                    seconds: float) -> int:
+    """
+    Every connection sends a heartbeat per interval, spread over it
+
+    :return: heartbeats that could not be sent (the server closed the
+        connection)
+    """
+    step = HEARTBEAT_INTERVAL / len(conns)
+    start = time.perf_counter()
+    index = failed = 0
+    while time.perf_counter() - start < seconds:
+        try:
+            conns[index % len(conns)].send(heartbeat)
+        except OSError:
+            failed += 1
+        index += 1
+        delay = start + index * step - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    return failed
+
+
+def bench(count: int, timeout: float) -> dict:
+    port = free_port()
+    server = subprocess.Popen([sys.executable, __file__, "--serve",
+                               str(port), str(timeout)])
+    time.sleep(1)
+    heartbeat = encode_legacy(HeartbeatSignal())
+    conns = connect_all(port, count, heartbeat)
+    failed = send_heartbeats(conns, heartbeat, HEARTBEAT_INTERVAL)
+
+    # steady state
+    cpu = cpu_seconds(server.pid)
+    failed += send_heartbeats(conns, heartbeat, 2 * HEARTBEAT_INTERVAL)
+    cpu_per_heartbeat = (cpu_seconds(server.pid) - cpu) / (2 * count)
+
+    # the last SILENT connections stop sending, their deadline is the
+    # timeout after their last heartbeat, the others keep beating
+    beating, silent = conns[:-SILENT], conns[-SILENT:]
+    selector = selectors.DefaultSelector()
+    for conn in silent:
+        conn.sendall(heartbeat)
+        selector.register(conn, selectors.EVENT_READ)
+    deadline = time.perf_counter() + timeout
+    beater = threading.Thread(target=send_heartbeats,
+                              args=(beating, heartbeat, 2 * timeout),
+                              daemon=True)
+    beater.start()
+    latencies = []
+    while len(latencies) < SILENT and time.perf_counter() < deadline + timeout:
+        for key, _ in selector.select(timeout=0.1):
+            try:
+                if key.fileobj.recv(4096):
+                    continue
+            except ConnectionError:
+                pass
+            latencies.append(time.perf_counter() - deadline)
+            selector.unregister(key.fileobj)
+    # none of the beating ones may have been evicted
+    for conn in beating:
+        try:
+            if conn.recv(4096) == b"":
+                failed += 1
+        except BlockingIOError:
+            pass
+        except ConnectionError:
+            failed += 1
+    for conn in conns:
+        conn.close()
+    server.kill()
+    server.wait()
+    return {"cpu_per_heartbeat": cpu_per_heartbeat, "evicted": len(latencies),
+            "latencies": latencies, "failed": failed}
+
+
+def main():
+    if sys.argv[1:2] == ["--serve"]:
+        serve(int(sys.argv[2]), float(sys.argv[3]))
+        return
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--timeout", default=LIVENESS_TIMEOUT, type=float)
+    args = parser.parse_args()
+
+    for clients in (1000, 10000):
+        scan, tracked = tracker_us(clients)
+        print(f"{clients:>6} clients: per heartbeat, previous scan "
+              f"{scan:7.1f} us, tracker {tracked:5.2f} us")
+    for count in (1000, 10000):
+        result = bench(count, args.timeout)
+        latencies = sorted(result["latencies"]) or [float("nan")]
+        print(f"{count:>6} connections: server cpu "
+              f"{result['cpu_per_heartbeat'] * 1e6:.0f} us per heartbeat, "
+              f"{result['evicted']}/{SILENT} silent ones evicted "
+              f"{args.timeout:.0f} s timeout + median "
+              f"{statistics.median(latencies) * 1000:.0f} ms, max "
+              f"{latencies[-1] * 1000:.0f} ms after their deadline, "
+              f"{result['failed']} live ones lost")
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
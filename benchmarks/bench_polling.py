@@ -0,0 +1,92 @@
+"""
+Wakeups per hour and change-to-read latency of the clipboard poll loop, in
+virtual time: fixed 0.3s polling (the old loop) vs `PollScheduler` polling vs
+an event driven backend.
+
+    python benchmarks/bench_polling.py [--hours 1] [--changes-per-hour 60]
+"""
+import os
+import sys
+import random
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sync_clip.stuff.poller import PollScheduler  # noqa: E402
+
+
+def change_times(duration, changes_per_hour, seed=0):
+    """
+    Clipboard changes come in bursts (copy, copy again shortly after)
+    """
+    rnd = random.Random(seed)
+    times, now = [], 0.0
+    while True:
+        now += rnd.expovariate(changes_per_hour / 3600)
+        if now >= duration:
+            return times
+        times.append(now)
+        for _ in range(rnd.randint(0, 3)):
+            now += rnd.uniform(0.2, 5)
+            times.append(now)
+
+
+def simulate(changes, duration, scheduler=None, fixed=None, event=False):
+    now, wakeups, latencies, pending = 0.0, 0, [], list(changes)
+    while now < duration:
+        if fixed:
+            timeout = fixed
+        else:
+            timeout = scheduler.timeout()
+        next_poll = now + timeout
+        if event and pending and pending[0] < next_poll:
+            # the backend wakes the poller right away
+            next_poll = pending[0]
+        now = next_poll
+        wakeups += 1
+        changed = False
+        while pending and pending[0] <= now:
+            latencies.append(now - pending.pop(0))
+            changed = True
+        if scheduler is not None:
+            if changed:
+                scheduler.on_change()
+            else:
+                scheduler.on_idle()
+    return wakeups, latencies
+
+
+def report(name, duration, wakeups, latencies):
+    latencies = sorted(latencies) or [0.0]
+    p95 = latencies[int(len(latencies) * 0.95) - 1 if len(latencies) > 1
+                    else 0]
+    print(f"{name:<14} {wakeups * 3600 / duration:>10.0f} "
+          f"{statistics.mean(latencies) * 1000:>10.1f} {p95 * 1000:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", default=1.0, type=float)
+    parser.add_argument("--changes-per-hour", default=60, type=float)
+    parser.add_argument("--min-interval", default=0.05, type=float)
+    parser.add_argument("--max-interval", default=2.0, type=float)
+    args = parser.parse_args()
+
+    duration = args.hours * 3600
+    changes = change_times(duration, args.changes_per_hour)
+    print(f"{len(changes)} clipboard changes in {args.hours}h")
+    print(f"{'mode':<14} {'wakeups/h':>10} {'mean ms':>10} {'p95 ms':>10}")
+    report("fixed 0.3s", duration, *simulate(changes, duration, fixed=0.3))
+    report("adaptive", duration, *simulate(
+        changes, duration,
+        scheduler=PollScheduler(args.min_interval, args.max_interval)))
+    scheduler = PollScheduler(args.min_interval, args.max_interval)
+    scheduler.event_driven = True
+    report("event driven", duration,
+           *simulate(changes, duration, scheduler=scheduler, event=True))
+
+
+if __name__ == "__main__":
+    main()
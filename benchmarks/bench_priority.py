@@ -0,0 +1,172 @@
+"""
+Heartbeat latency during a large transfer. A client sends a 20MB image
+through a link of 10MB/s (--rate) while it sends a heartbeat every 20 ms,
+then another client receives such an image through that link while it
+sends heartbeats. Reports how long the heartbeats waited to be written and
+their round trip to the server, with every message sent whole in order (as
+under the previous send lock, and a server without urgent frames) and with
+the priority sender.
+
+    python benchmarks/bench_priority.py [--rate 10] [--size-mb 20]
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+import threading
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_compression import free_port, ThrottlingProxy  # noqa: E402
+
+from sync_clip.stuff.sync_signal import *  # noqa: E402
+from sync_clip.remote.protocol import *  # noqa: E402
+from sync_clip.remote.sender import *  # noqa: E402
+from sync_clip.remote.client import Client  # noqa: E402
+from sync_clip.remote.aio_server import AioServer  # noqa: E402
+
+HEARTBEAT_INTERVAL = 0.02
+# queue of the link (the kernel doubles it), about its bandwidth-delay
+# product at 10MB/s and 10 ms
+LINK_BUFFER = 64 * 1024
+
+
+class FifoClient(Client):
+    """
+    Every message whole and in order, like under the previous send lock
+    """
+
+    def _priority(self, signal: SyncSignal) -> int:
+        return PRIORITY_BULK
+
+
+class FifoServer(AioServer):
+    """
+    Control frames queued behind the messages, as before urgent frames
+    """
+
+    def _send_frames(self, peer, frames: List[bytes], urgent=False):
+        super()._send_frames(peer, frames)
+
+
+def serve(port: int, fifo: bool):
+    logging.getLogger("sync_clip").setLevel(logging.ERROR)
+    cls = FifoServer if fifo else AioServer
+    cls(host="127.0.0.1", port=port, history_size=0).start()
+
+
+class Heartbeats(object):
+    """
+    Sends a heartbeat every `HEARTBEAT_INTERVAL` on its own thread,
+    recording how long each send blocked and the round trip of its ack, by
+    the time it was sent
+    """
+
+    def __init__(self, client: Client):
+        self.client = client
+        self.waits: List[Tuple[float, float]] = []
+        self.rtts: List[Tuple[float, float]] = []
+        self.is_closed = False
+        record_rtt = client.chunk_sizer.record_rtt
+
+        def on_ack(seconds: float):
+            self.rtts.append((time.monotonic() - seconds, seconds))
+            record_rtt(seconds)
+
+        client.chunk_sizer.record_rtt = on_ack
+        threading.Thread(target=self._beat, daemon=True).start()
+
+    def _beat(self):
+        while not self.is_closed:
+            start = time.monotonic()
+            self.client.send_sync_data(HeartbeatSignal(sent_at=start))
+            self.waits.append((start, time.monotonic() - start))
+            time.sleep(HEARTBEAT_INTERVAL)
+
+    @staticmethod
+    def between(samples: List[Tuple[float, float]], start: float,
+                end: float) -> List[float]:
+        return [seconds for at, seconds in samples if start <= at <= end]
+
+    def close(self):
+        self.is_closed = True
+
+
+def percentiles(values: List[float]) -> str:
+    values = sorted(values) or [float("nan")]
+    return (f"median {statistics.median(values) * 1000:6.1f} ms, p99 "
+            f"{values[int(len(values) * 0.99)] * 1000:6.1f} ms, max "
+            f"{values[-1] * 1000:6.1f} ms")
+
+
+def bench(server_port: int, fifo: bool, rate: float, size: int,
+          upload: bool) -> dict:
+    """
+    The beating client sends the image (`upload`) or receives it, through a
+    link of `rate` bytes per second
+    """
+    cls = FifoClient if fifo else Client
+    proxy = ThrottlingProxy(server_port, rate=rate if upload else None,
+                            downstream_rate=None if upload else rate,
+                            buffer_size=LINK_BUFFER)
+    # no announces nor deltas, the image goes in full
+    beating = cls("127.0.0.1", proxy.port, features=())
+    other = cls("127.0.0.1", server_port, features=())
+    beating.start()
+    other.start()
+    sender, receiver = (beating, other) if upload else (other, beating)
+    time.sleep(0.5)
+    heartbeats = Heartbeats(beating)
+    time.sleep(0.2)
+    image = os.urandom(size)
+    start = time.monotonic()
+    sender.send_sync_data(SyncData(image))
+    assert receiver.recv_sync_sig.get(timeout=120).data == image
+    end = time.monotonic()
+    # acks of the last heartbeats
+    time.sleep(0.5)
+    heartbeats.close()
+    beating.close()
+    other.close()
+    return {"seconds": end - start,
+            "waits": heartbeats.between(heartbeats.waits, start, end),
+            "rtts": heartbeats.between(heartbeats.rtts, start, end)}
+
+
+def main():
+    if sys.argv[1:2] == ["--serve"]:
+        serve(int(sys.argv[2]), sys.argv[3] == "fifo")
+        return
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", default=10, type=float,
+                        help="link rate in MB/s")
+    parser.add_argument("--size-mb", default=20, type=int)
+    args = parser.parse_args()
+    logging.getLogger("sync_clip").setLevel(logging.ERROR)
+
+    for fifo in (True, False):
+        port = free_port()
+        server = subprocess.Popen([sys.executable, __file__, "--serve",
+                                   str(port), "fifo" if fifo else "priority"])
+        time.sleep(1)
+        name = "whole messages" if fifo else "priority sender"
+        for upload in (True, False):
+            result = bench(port, fifo, args.rate * 1024 * 1024,
+                           args.size_mb * 1024 * 1024, upload)
+            print(f"{name:>15}, {'sending' if upload else 'receiving'} "
+                  f"{args.size_mb}MB at {args.rate:.0f}MB/s in "
+                  f"{result['seconds']:.1f} s, "
+                  f"{len(result['rtts'])} heartbeats")
+            print(f"{'':>17}written after: {percentiles(result['waits'])}")
+            print(f"{'':>17}round trip:    {percentiles(result['rtts'])}")
+        server.kill()
+        server.wait()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Per-frame overhead and encode/decode throughput of the legacy pickle framing
+against the binary framing.
+
+    python benchmarks/bench_protocol.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sync_clip.stuff.sync_signal import *  # noqa: E402
+from sync_clip.remote.protocol import *  # noqa: E402
+
+SIZES = [0, 1024, 25 * 1024, 1024 * 1024]
+
+
+def timeit(func, min_seconds=0.5):
+    count, start = 0, time.perf_counter()
+    while True:
+        func()
+        count += 1
+        cost = time.perf_counter() - start
+        if cost >= min_seconds:
+            return cost / count
+
+
+def legacy_roundtrip(sig):
+    frame = encode_legacy(sig)
+    return lambda: encode_legacy(sig), \
+        lambda: decode_legacy(frame[LEGACY_HEADER_SIZE:]), len(frame)
+
+
+def binary_roundtrip(sig):
+    frame = b"".join(encode_signal(sig))
+    return lambda: encode_signal(sig), \
+        lambda: decode_signal(unpack_header(frame[:HEADER.size]),
+                              frame[HEADER.size:]), len(frame)
+
+
+def main():
+    print(f"{'signal':<18}{'format':<8}{'bytes':>10}{'overhead':>10}"
+          f"{'encode us':>11}{'decode us':>11}{'encode MB/s':>13}"
+          f"{'decode MB/s':>13}")
+    signals = [("heartbeat", HeartbeatSignal(), 0)]
+    for size in SIZES[1:]:
+        signals.append((f"data {size // 1024}KB", SyncData(os.urandom(size)),
+                        size))
+    for name, sig, size in signals:
+        for fmt, roundtrip in (("legacy", legacy_roundtrip),
+                               ("binary", binary_roundtrip)):
+            encode, decode, frame_size = roundtrip(sig)
+            encode_cost, decode_cost = timeit(encode), timeit(decode)
+            mb = frame_size / 1024 / 1024
+            print(f"{name:<18}{fmt:<8}{frame_size:>10}"
+                  f"{frame_size - size:>10}"
+                  f"{encode_cost * 1e6:>11.2f}{decode_cost * 1e6:>11.2f}"
+                  f"{mb / encode_cost:>13.1f}{mb / decode_cost:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
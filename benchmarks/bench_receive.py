@@ -0,0 +1,105 @@
+"""
+Peak memory and time to receive one payload of 1KB to 100MB over a socket
+pair, sent as 25KB chunks.
+
+* baseline:  the previous client path, ``response += recv()`` per frame and
+  ``sig.data += next_sig.data`` per chunk (skipped above 20MB, quadratic)
+* legacy:    `SignalReader` on legacy pickle frames
+* binary:    `SignalReader` on binary frames, ``recv_into`` a preallocated
+  buffer
+
+    python benchmarks/bench_receive.py
+"""
+import os
+import sys
+import time
+import pickle
+import socket
+import threading
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sync_clip.stuff.sync_signal import *  # noqa: E402
+from sync_clip.remote.protocol import *  # noqa: E402
+from sync_clip.remote.client import Client  # noqa: E402
+
+SIZES = [1024, 64 * 1024, 1024 * 1024, 20 * 1024 * 1024,
+         100 * 1024 * 1024]
+BASELINE_MAX_SIZE = 20 * 1024 * 1024
+CHUNK = Client.MAX_MESSAGE_SIZE
+
+
+def legacy_frames(data):
+    frames = []
+    for index in range(0, len(data), CHUNK):
+        sig = SyncData(data[index:index + CHUNK])
+        sig.is_end = index + CHUNK >= len(data)
+        frames.append(encode_legacy(sig))
+    return frames
+
+
+def binary_frames(data):
+    return encode_signal(SyncData(data), stream_id=1, chunk_size=CHUNK)
+
+
+def baseline_receive(conn):
+    def receive_data():
+        header = conn.recv(10)
+        data_size = int(header.decode())
+        response = conn.recv(data_size)
+        while data_size - len(response) > 0:
+            response += conn.recv(data_size - len(response))
+        return response
+
+    sig = pickle.loads(receive_data())
+    while not sig.is_end:
+        next_sig = pickle.loads(receive_data())
+        sig.data += next_sig.data
+        sig.is_end = next_sig.is_end
+    return sig
+
+
+def reader_receive(conn):
+    reader = SignalReader(conn)
+    while True:
+        sig = reader.read_signal()
+        if sig is not None:
+            return sig
+
+
+def measure(frames, receive):
+    left, right = socket.socketpair()
+    sender = threading.Thread(
+        target=lambda: [left.sendall(frame) for frame in frames])
+    tracemalloc.start()
+    start = time.perf_counter()
+    sender.start()
+    sig = receive(right)
+    cost = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    sender.join()
+    left.close()
+    right.close()
+    return len(sig.data), cost, peak
+
+
+def main():
+    print(f"{'size':>10}{'path':>10}{'ms':>10}{'peak MB':>10}"
+          f"{'peak/size':>11}")
+    for size in SIZES:
+        data = os.urandom(size)
+        paths = [("legacy", legacy_frames, reader_receive),
+                 ("binary", binary_frames, reader_receive)]
+        if size <= BASELINE_MAX_SIZE:
+            paths.insert(0, ("baseline", legacy_frames, baseline_receive))
+        for name, make_frames, receive in paths:
+            received, cost, peak = measure(make_frames(data), receive)
+            assert received == size
+            print(f"{size // 1024:>8}KB{name:>10}{cost * 1000:>10.1f}"
+                  f"{peak / 1024 / 1024:>10.2f}{peak / size:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Redundant image transfers when clipboards re-encode images. Two monitors
+on in-memory clipboards share a server; A copies screenshots, B's clipboard
+re-encodes what the monitor writes into it (the Windows DIB round trip),
+then a clipboard manager on B takes the image over, re-encoding it again,
+and the user on A copies the same screenshot from another application,
+encoded differently. Reports the images sent beyond the copies made and
+the clipboard writes beyond the images received, then the cost of the
+pixel digest of an image, decoded and from cache.
+
+Pass --tree to run another checkout (e.g. a ``git worktree`` of an older
+commit) for a before/after comparison.
+
+    python benchmarks/bench_reencode.py [--images 10]
+"""
+import os
+import sys
+import timeit
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+REENCODE_CODE = """
+import os, sys, time, socket, logging, threading
+from io import BytesIO
+from PIL import Image, ImageDraw
+sys.path.insert(0, sys.argv[1])
+from sync_clip.stuff.clipboards import Clipboard, FakeClipboard
+
+IMAGES = int(sys.argv[2])
+TIMEOUT = 3.0
+
+
+def screenshot(index: int) -> Image.Image:
+    im = Image.new("RGB", (1280, 720), (40, 44, 52))
+    draw = ImageDraw.Draw(im)
+    for line in range(40):
+        draw.text((20, 16 * line + 10), f"screenshot {index} line {line} "
+                  + "x" * ((index * 7 + line * 13) % 90), fill=(220, 220, 220))
+    return im
+
+
+def encode(im: Image.Image, level: int) -> bytes:
+    output = BytesIO()
+    im.save(output, format="png", compress_level=level)
+    return output.getvalue()
+
+
+def reencode(data: bytes, level: int) -> bytes:
+    im = Image.open(BytesIO(data))
+    # the DIB round trip adds an opaque alpha channel
+    return encode(im.convert("RGBA"), level)
+
+
+class UserClipboard(FakeClipboard):
+    def __init__(self, reencoding):
+        super().__init__()
+        self.reencoding = reencoding
+        self.sent = 0
+        self.written = 0
+
+    def copy(self, data):
+        FakeClipboard.write_clip(self, data)
+
+    def write_clip(self, data):
+        self.written += 1
+        if self.reencoding:
+            data = reencode(data, 9)
+        FakeClipboard.write_clip(self, data)
+
+
+clips = []
+
+
+def get_clipboard(cls, backend="auto"):
+    clips.append(UserClipboard(reencoding=len(clips) == 1))
+    return clips[-1]
+
+
+Clipboard.get_clipboard = classmethod(get_clipboard)
+
+from sync_clip.remote.aio_server import AioServer
+from sync_clip.monitor import ClipboardMonitor
+from sync_clip.stuff.sync_signal import SyncData
+
+
+def count_sent(monitor: ClipboardMonitor):
+    send_sync_data, clip = monitor.rclip.send_sync_data, monitor.tclip
+
+    def send(signal, *args, **kwargs):
+        if isinstance(signal, SyncData):
+            clip.sent += 1
+        return send_sync_data(signal, *args, **kwargs)
+
+    monitor.rclip.send_sync_data = send
+
+
+def wait(condition) -> bool:
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+logging.getLogger("sync_clip").setLevel(logging.ERROR)
+with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+server = AioServer(host="127.0.0.1", port=port, history_size=0)
+threading.Thread(target=server.start, daemon=True).start()
+time.sleep(0.5)
+monitors = [ClipboardMonitor("127.0.0.1", port, poll_max_interval=0.1)
+            for _ in range(2)]
+for monitor in monitors:
+    count_sent(monitor)
+    monitor.start()
+time.sleep(2)
+a, b = clips
+
+for index in range(IMAGES):
+    im = screenshot(index)
+    a.copy(encode(im, 6))
+    writes = b.written
+    wait(lambda: b.written > writes)
+    time.sleep(0.5)
+    # a clipboard manager takes the image over
+    b.copy(reencode(b._data, 3))
+    time.sleep(0.5)
+    # copied again, from another application
+    a.copy(encode(im, 1))
+    time.sleep(0.5)
+print(f"result: {a.sent + b.sent - IMAGES} {a.written + b.written - IMAGES}",
+      flush=True)
+for monitor in monitors:
+    monitor.close()
+os._exit(0)
+"""
+
+
+def digest_cost():
+    from PIL import Image, ImageDraw
+    from sync_clip.utils.util_hash import hash_data
+    from sync_clip.utils.utiil_image import PixelDigests, get_output_data
+
+    im = Image.new("RGB", (1920, 1080), (40, 44, 52))
+    ImageDraw.Draw(im).rectangle((100, 100, 900, 600), fill=(200, 80, 80))
+    data = get_output_data(im)
+    digests = PixelDigests()
+    decoded = min(timeit.repeat(
+        lambda: PixelDigests().digest(data), number=5, repeat=3)) / 5
+    key = hash_data(data)
+    digests.digest(data, key)
+    cached = min(timeit.repeat(
+        lambda: digests.digest(data, key), number=1000, repeat=3)) / 1000
+    print(f"pixel digest of a 1920x1080 PNG ({len(data) // 1024}KB): "
+          f"{decoded * 1000:.1f} ms decoded, {cached * 1e6:.1f} us cached")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tree", default=ROOT)
+    parser.add_argument("--images", default=10, type=int)
+    args = parser.parse_args()
+
+    proc = subprocess.Popen(
+        [sys.executable, "-c", REENCODE_CODE, args.tree, str(args.images)],
+        stdout=subprocess.PIPE, text=True)
+    for line in proc.stdout:
+        if line.startswith("result: "):
+            _, sent, written = line.split()
+            break
+    proc.wait(timeout=10)
+    print(f"{args.images} screenshots: {sent} redundant image transfers, "
+          f"{written} redundant clipboard writes")
+    if args.tree == ROOT:
+        digest_cost()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Server cpu time per relayed MB: one binary client sends a large payload to
+N binary clients. Pass --tree to run the server of another checkout (e.g. a
+``git worktree`` of an older commit) for a before/after comparison.
+
+    python benchmarks/bench_relay.py [--receivers 10] [--size-mb 30]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sync_clip.stuff.sync_signal import *  # noqa: E402
+from sync_clip.remote.protocol import *  # noqa: E402
+from sync_clip.remote.client import Client  # noqa: E402
+
+SERVER_CODE = """
+import sys
+sys.path.insert(0, sys.argv[3])
+from sync_clip.remote.server import Server
+from sync_clip.remote.aio_server import AioServer
+cls = AioServer if sys.argv[1] == "aio" else Server
+cls(host="127.0.0.1", port=int(sys.argv[2])).start()
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def proc_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as fp:
+        fields = fp.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def binary_conn(port):
+    conn = socket.create_connection(("127.0.0.1", port))
+    conn.sendall(encode_legacy(ConCheck(protocols=SUPPORTED_PROTOCOLS)))
+    reader = SignalReader(conn)
+    sig = None
+    while sig is None:
+        sig = reader.read_signal()
+    assert isinstance(sig, ConCheck) and sig.protocol == PROTOCOL_BINARY
+    return conn, reader
+
+
+def receive(reader, count):
+    for _ in range(count):
+        sig = None
+        while sig is None:
+            sig = reader.read_signal()
+
+
+def bench(mode, tree, receivers, size, rounds):
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, "-c", SERVER_CODE, mode,
+                             str(port), tree])
+    try:
+        time.sleep(1)
+        sender, _ = binary_conn(port)
+        readers = [binary_conn(port) for _ in range(receivers)]
+        time.sleep(0.5)
+        threads = [threading.Thread(target=receive, args=(reader, rounds))
+                   for _, reader in readers]
+        for thread in threads:
+            thread.start()
+        payload = os.urandom(size)
+        cpu_start = proc_cpu_seconds(proc.pid)
+        start = time.perf_counter()
+        for i in range(rounds):
+            write_frames(sender, encode_signal(
+                SyncData(payload), stream_id=i + 1,
+                chunk_size=Client.MAX_MESSAGE_SIZE))
+        for thread in threads:
+            thread.join()
+        cost = time.perf_counter() - start
+        cpu = proc_cpu_seconds(proc.pid) - cpu_start
+        relayed_mb = size * receivers * rounds / 1024 / 1024
+        return cpu / relayed_mb * 1000, cost
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tree", default=ROOT)
+    parser.add_argument("--receivers", type=int, default=10)
+    parser.add_argument("--size-mb", type=int, default=30)
+    parser.add_argument("--rounds", type=int, default=2)
+    args = parser.parse_args()
+    print(f"{'engine':<8}{'cpu ms/MB':>11}{'wall s':>9}")
+    for mode in ("thread", "aio"):
+        cpu_per_mb, cost = bench(mode, args.tree, args.receivers,
+                                 args.size_mb * 1024 * 1024, args.rounds)
+        print(f"{mode:<8}{cpu_per_mb:>11.2f}{cost:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+A server killed in the middle of a large clipboard: a client copies a 50MB
+image (incompressible) through a proxy limiting its link and counting its
+bytes, another client receives it. Once half the image went through, the
+server is killed and restarted on the same port and spool directory a
+second later. Reports the bytes of the sender's link and how many of them
+were sent again, against a run without the kill, with the upload resumed
+and sent again whole (resumes not offered). Then the image is copied while
+the server is down: the time it takes to arrive once the server is back.
+
+    python benchmarks/bench_resume.py [--size-mb 50] [--rate-mb 20]
+"""
+import os
+import sys
+import time
+import socket
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER_CODE = """
+import sys, logging
+sys.path.insert(0, sys.argv[1])
+from sync_clip.remote.aio_server import AioServer
+from sync_clip.remote.server import Server
+logging.getLogger("sync_clip").setLevel(logging.CRITICAL)
+# the history catches up the receiver if it reconnects after the upload
+server = (AioServer if sys.argv[3] == "aio" else Server)(
+    host="127.0.0.1", port=int(sys.argv[2]))
+print("ready", flush=True)
+server.start()
+"""
+
+# argv: tree, server port, mode (clean/resume/whole/offline), size, rate,
+# timeout
+CLIENT_CODE = """
+import os, sys, time, socket, logging, threading
+sys.path.insert(0, sys.argv[1])
+from sync_clip.remote import protocol
+from sync_clip.remote.client import Client
+from sync_clip.stuff.sync_signal import SyncData
+
+port, mode = int(sys.argv[2]), sys.argv[3]
+size, rate = int(sys.argv[4]), float(sys.argv[5])
+
+
+class Proxy(object):
+    # forwards every connection to the server, the sender comes back after
+    # the restart, counting the bytes sent upstream, limited to `rate` bytes
+    # per second
+    BURST = 64 * 1024
+
+    def __init__(self):
+        self.upstream_bytes = 0
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(4)
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            conn, _ = self.listener.accept()
+            upstream = socket.socket()
+            try:
+                upstream.connect(("127.0.0.1", port))
+            except OSError:
+                conn.close()
+                continue
+            for src, dst, is_up in ((conn, upstream, True),
+                                    (upstream, conn, False)):
+                threading.Thread(target=self._pipe, args=(src, dst, is_up),
+                                 daemon=True).start()
+
+    def _pipe(self, src, dst, is_up):
+        tokens, last = 0.0, time.monotonic()
+        try:
+            while True:
+                data = src.recv(self.BURST)
+                if not data:
+                    break
+                if is_up:
+                    self.upstream_bytes += len(data)
+                    now = time.monotonic()
+                    tokens = min(self.BURST, tokens + (now - last) * rate)
+                    last = now
+                    tokens -= len(data)
+                    if tokens < 0:
+                        time.sleep(-tokens / rate)
+                dst.sendall(data)
+        except OSError:
+            pass
+        finally:
+            # a killed server closes the client's connection at once, close
+            # alone would wait for the other direction's recv
+            for sock in (src, dst):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                sock.close()
+
+
+offsets = []
+
+
+class Offsets(logging.Handler):
+    def emit(self, record):
+        message = record.getMessage()
+        if message.startswith("resuming an upload at "):
+            offsets.append(int(message.split()[4]))
+
+
+logger = logging.getLogger("sync_clip")
+logger.setLevel(logging.INFO)
+logger.addHandler(Offsets())
+features = [feature for feature in protocol.SUPPORTED_FEATURES
+            if mode != "whole"
+            or feature != getattr(protocol, "FEATURE_RESUME", None)]
+proxy = Proxy()
+receiver = Client("127.0.0.1", port)
+receiver.start()
+sender = Client("127.0.0.1", proxy.port, features=features)
+sender.start()
+time.sleep(1)
+image = b"\\x89PNG\\r\\n\\x1a\\n" + os.urandom(size - 8)
+print("ready", flush=True)
+copy = threading.Thread(target=sender.send_sync_data,
+                        args=(SyncData(image),), daemon=True)
+if mode == "offline":
+    sys.stdin.readline()
+    # the server is down
+    time.sleep(0.5)
+    copy.start()
+else:
+    copy.start()
+    if mode != "clean":
+        while proxy.upstream_bytes < size // 2:
+            time.sleep(0.005)
+        print("kill", flush=True)
+if mode != "clean":
+    sys.stdin.readline()
+# from the restart on
+started = time.time()
+deadline = started + float(sys.argv[6])
+ok = False
+while time.time() < deadline:
+    try:
+        sig = receiver.recv_sync_sig.get(timeout=deadline - time.time())
+    except Exception:
+        break
+    if isinstance(sig, SyncData) and len(sig.data) == size:
+        ok = sig.data == image
+        break
+print(f"result {int(ok)} {proxy.upstream_bytes} {time.time() - started} "
+      f"{offsets[-1] if offsets else -1}", flush=True)
+os._exit(0)
+"""
+
+MODES = (("no kill", "clean"), ("resumed", "resume"),
+         ("sent again whole", "whole"), ("copied while down", "offline"))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def read_line(proc: subprocess.Popen, prefix: str) -> str:
+    for line in proc.stdout:
+        if line.startswith(prefix):
+            return line[len(prefix):].strip()
+    raise RuntimeError(f"{prefix!r} never printed")
+
+
+def start_server(args, port: int, env: dict) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, "-c", SERVER_CODE, args.tree, str(port),
+         args.server], stdout=subprocess.PIPE, text=True, env=env)
+    read_line(server, "ready")
+    return server
+
+
+def run(args, mode: str, env: dict) -> tuple:
+    port = free_port()
+    server = start_server(args, port, env)
+    client = subprocess.Popen(
+        [sys.executable, "-c", CLIENT_CODE, args.tree, str(port), mode,
+         str(args.size_mb * 1024 * 1024), str(args.rate_mb * 1024 * 1024),
+         str(args.timeout)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=env)
+    try:
+        read_line(client, "ready")
+        if mode != "clean":
+            if mode != "offline":
+                read_line(client, "kill")
+            server.kill()
+            server.wait()
+            if mode == "offline":
+                client.stdin.write("\n")
+                client.stdin.flush()
+            time.sleep(args.down)
+            server = start_server(args, port, env)
+            client.stdin.write("\n")
+            client.stdin.flush()
+        ok, sent, seconds, offset = read_line(client, "result").split()
+        return ok == "1", int(sent), float(seconds), int(offset)
+    finally:
+        client.kill()
+        client.wait()
+        server.kill()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tree", default=ROOT)
+    parser.add_argument("--server", default="aio", choices=("aio", "thread"))
+    parser.add_argument("--size-mb", default=50, type=int)
+    parser.add_argument("--rate-mb", default=20, type=float,
+                        help="limit of the sender's link, MB/s")
+    parser.add_argument("--down", default=1.0, type=float,
+                        help="seconds the server stays down")
+    parser.add_argument("--timeout", default=60, type=float,
+                        help="seconds the image may take to arrive")
+    args = parser.parse_args()
+
+    # the server spools uploads in its cache, kept across the restart
+    home = tempfile.mkdtemp(prefix="bench_resume-")
+    env = dict(os.environ, HOME=home)
+    size = args.size_mb * 1024 * 1024
+    clean = None
+    try:
+        for name, mode in MODES:
+            ok, sent, seconds, offset = run(args, mode, env)
+            if clean is None:
+                clean = sent
+            line = (f"{name:>17}: {'received' if ok else 'NOT received'} "
+                    f"in {seconds:5.2f} s, sender's link "
+                    f"{sent / 1024 / 1024:6.1f}MB")
+            if mode != "clean":
+                line += f", {(sent - clean) / 1024 / 1024:6.1f}MB sent again"
+            if offset >= 0:
+                line += (f" (resumed at {offset / 1024 / 1024:.1f}MB of "
+                         f"{size / 1024 / 1024:.0f}MB)")
+            print(line, flush=True)
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
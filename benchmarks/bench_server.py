@@ -0,0 +1,128 @@
+"""
+Compare the server engines: thread count, idle cpu and broadcast latency
+with 10, 100 and 1000 connected (legacy protocol) clients.
+
+    python benchmarks/bench_server.py [--counts 10 100 1000] [--idle 5]
+"""
+import os
+import sys
+import time
+import pickle
+import socket
+import argparse
+import selectors
+import subprocess
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sync_clip.stuff.sync_signal import SyncData  # noqa: E402
+
+SERVER_CODE = """
+import sys
+from sync_clip.remote.server import Server
+from sync_clip.remote.aio_server import AioServer
+cls = AioServer if sys.argv[1] == "aio" else Server
+cls(host="127.0.0.1", port=int(sys.argv[2])).start()
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def proc_threads(pid):
+    with open(f"/proc/{pid}/status") as fp:
+        for line in fp:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+
+
+def proc_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as fp:
+        fields = fp.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def pack(sig):
+    p = pickle.dumps(sig)
+    return f"{len(p)}".zfill(10).encode() + p
+
+
+def connect_all(port, count):
+    conns = []
+    for _ in range(count):
+        while True:
+            try:
+                conns.append(socket.create_connection(("127.0.0.1", port)))
+                break
+            except (ConnectionRefusedError, ConnectionResetError):
+                time.sleep(0.05)
+    return conns
+
+
+def broadcast_latency(conns, payload, rounds=5):
+    sender, receivers = conns[0], conns[1:]
+    frame = pack(SyncData(payload))
+    results = []
+    for _ in range(rounds):
+        sel = selectors.DefaultSelector()
+        pending = {}
+        for conn in receivers:
+            conn.setblocking(False)
+            sel.register(conn, selectors.EVENT_READ)
+            pending[conn] = len(frame)
+        start = time.perf_counter()
+        sender.sendall(frame)
+        while pending:
+            for key, _ in sel.select(timeout=10):
+                data = key.fileobj.recv(1 << 16)
+                pending[key.fileobj] -= len(data)
+                if pending[key.fileobj] <= 0:
+                    pending.pop(key.fileobj)
+                    sel.unregister(key.fileobj)
+        results.append(time.perf_counter() - start)
+        sel.close()
+    return median(results)
+
+
+def bench(mode, count, idle):
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, "-c", SERVER_CODE, mode,
+                             str(port)], cwd=sys.path[0])
+    try:
+        time.sleep(1)
+        conns = connect_all(port, count)
+        time.sleep(1)
+        threads = proc_threads(proc.pid)
+        cpu_start = proc_cpu_seconds(proc.pid)
+        time.sleep(idle)
+        idle_cpu = (proc_cpu_seconds(proc.pid) - cpu_start) / idle * 100
+        latency = broadcast_latency(conns, "x" * 1024)
+        for conn in conns:
+            conn.close()
+        return threads, idle_cpu, latency
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--counts", nargs="+", type=int,
+                        default=[10, 100, 1000])
+    parser.add_argument("--idle", type=float, default=5)
+    args = parser.parse_args()
+    print(f"{'mode':<8}{'conns':>7}{'threads':>9}{'idle cpu %':>12}"
+          f"{'broadcast ms':>14}")
+    for count in args.counts:
+        for mode in ("thread", "aio"):
+            threads, idle_cpu, latency = bench(mode, count, args.idle)
+            print(f"{mode:<8}{count:>7}{threads:>9}{idle_cpu:>12.2f}"
+                  f"{latency * 1000:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
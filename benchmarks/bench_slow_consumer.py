@@ -0,0 +1,99 @@
+"""
+Fan-out latency to healthy clients while one connected client never reads.
+
+    python benchmarks/bench_slow_consumer.py [--healthy 10] [--messages 40]
+"""
+import os
+import sys
+import time
+import socket
+import logging
+import argparse
+import threading
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sync_clip.stuff.sync_signal import *  # noqa: E402
+from sync_clip.remote.protocol import *  # noqa: E402
+from sync_clip.remote.server import Server  # noqa: E402
+from sync_clip.remote.aio_server import AioServer  # noqa: E402
+from sync_clip.remote.send_queue import OVERFLOW_POLICIES  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def receive_messages(conn, count, arrivals):
+    reader = SignalReader(conn)
+    for _ in range(count):
+        sig = None
+        while sig is None:
+            sig = reader.read_signal()
+        arrivals.append(time.perf_counter())
+
+
+def bench(server_cls, policy, healthy, messages, payload, with_slow):
+    port = free_port()
+    srv = server_cls(host="127.0.0.1", port=port, queue_policy=policy,
+                     queue_size=8)
+    threading.Thread(target=srv.start, daemon=True).start()
+    time.sleep(0.3)
+    sender = socket.create_connection(("127.0.0.1", port))
+    slow = socket.create_connection(("127.0.0.1", port)) if with_slow else None
+    if slow is not None:
+        slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    receivers = [socket.create_connection(("127.0.0.1", port))
+                 for _ in range(healthy)]
+    time.sleep(0.3)
+    arrivals = [[] for _ in receivers]
+    threads = [threading.Thread(target=receive_messages,
+                                args=(conn, messages, arrivals[i]))
+               for i, conn in enumerate(receivers)]
+    for thread in threads:
+        thread.start()
+    sent_at = []
+    for i in range(messages):
+        sent_at.append(time.perf_counter())
+        sender.sendall(encode_legacy(SyncData(payload + str(i).encode())))
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join(timeout=30)
+    latencies = [arrival - sent_at[i] for arrival_list in arrivals
+                 for i, arrival in enumerate(arrival_list)]
+    dropped = sum(stats["dropped"] for stats in srv.queue_stats())
+    srv.close()
+    for conn in [sender, slow, *receivers]:
+        if conn is not None:
+            conn.close()
+    complete = sum(len(a) == messages for a in arrivals)
+    return median(latencies), max(latencies), complete, dropped
+
+
+def main():
+    logging.getLogger("sync_clip").setLevel(logging.ERROR)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--healthy", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--size", type=int, default=256 * 1024)
+    args = parser.parse_args()
+    payload = os.urandom(args.size)
+    print(f"{'engine':<8}{'policy':<13}{'slow peer':>10}{'median ms':>11}"
+          f"{'max ms':>9}{'complete':>10}{'dropped':>9}")
+    for server_cls in (Server, AioServer):
+        engine = "aio" if server_cls is AioServer else "thread"
+        for policy in OVERFLOW_POLICIES:
+            for with_slow in (False, True):
+                med, worst, complete, dropped = bench(
+                    server_cls, policy, args.healthy, args.messages,
+                    payload, with_slow)
+                print(f"{engine:<8}{policy:<13}{str(with_slow):>10}"
+                      f"{med * 1000:>11.2f}{worst * 1000:>9.2f}"
+                      f"{complete:>6}/{args.healthy:<3}{dropped:>9}")
+
+
+if __name__ == "__main__":
+    main()
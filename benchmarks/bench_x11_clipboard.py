@@ -0,0 +1,87 @@
+"""
+Read latency and CPU of the in process X11 clipboard (`X11Clipboard`) vs the
+xclip one (`LinuxClipboard`). Each backend reads a selection owned by the
+other, so both the reading and the serving side are exercised. Needs xclip
+and python-xlib; runs headless with `--xvfb`.
+
+    python benchmarks/bench_x11_clipboard.py [--xvfb] [--reads 200]
+"""
+import os
+import sys
+import time
+import shutil
+import resource
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def start_xvfb(display=":99"):
+    proc = subprocess.Popen([shutil.which("Xvfb"), display, "-nolisten",
+                             "tcp"], stderr=subprocess.DEVNULL)
+    os.environ["DISPLAY"] = display
+    time.sleep(1)
+    return proc
+
+
+def cpu_time():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (own.ru_utime + own.ru_stime
+            + children.ru_utime + children.ru_stime)
+
+
+def bench_reads(name, clip, expected, reads):
+    assert clip.read_clip() == expected, f"{name} read wrong data"
+    latencies = []
+    cpu = cpu_time()
+    for _ in range(reads):
+        start = time.perf_counter()
+        clip.read_clip()
+        latencies.append(time.perf_counter() - start)
+    cpu = cpu_time() - cpu
+    latencies.sort()
+    print(f"{name:<28} {latencies[len(latencies) // 2] * 1000:>9.2f} "
+          f"{latencies[int(len(latencies) * 0.99) - 1] * 1000:>9.2f} "
+          f"{cpu / reads * 1000:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--xvfb", action="store_true",
+                        help="start a private Xvfb display")
+    parser.add_argument("--reads", default=200, type=int)
+    parser.add_argument("--size-kb", default=1024, type=int,
+                        help="size of the large (INCR) payload")
+    args = parser.parse_args()
+
+    xvfb = start_xvfb() if args.xvfb else None
+    try:
+        from sync_clip.stuff.clipboards import LinuxClipboard, X11Clipboard
+
+        xclip, xlib = LinuxClipboard(), X11Clipboard()
+        small = b"sync clip benchmark " * 10
+        large = os.urandom(args.size_kb * 1024).hex().encode()[
+                :args.size_kb * 1024]
+        print(f"{'reader (owner)':<28} {'p50 ms':>9} {'p99 ms':>9} "
+              f"{'cpu ms':>9}")
+        for label, payload in (("small", small), ("large", large)):
+            xlib.write_clip(payload)
+            bench_reads(f"xclip ({label}, xlib owns)", xclip, payload,
+                        args.reads)
+            xclip.write_clip(payload)
+            bench_reads(f"xlib ({label}, xclip owns)", xlib, payload,
+                        args.reads)
+            xlib.write_clip(payload)
+            bench_reads(f"xlib ({label}, own data)", xlib, payload,
+                        args.reads)
+        xlib._clip.close()
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -58,7 +58,7 @@ setup(
     description="A cross platform clipboard synchronous tool, supports "
                 "synchronized `text`and screenshots (PNG), support os system: "
                 "Windows, Linux",
-    python_requires=">=3.6",
+    python_requires=">=3.7",
     install_requires=INSTALL_REQUIRES,
     url="https://github.com/yujun2647/sync-clip",
     license='Apache-2.0',
@@ -1,15 +1,92 @@
 import argparse
 from sync_clip import __version__
 
-from sync_clip.remote.server import server
+from sync_clip.remote.server import server, SERVER_MODES
+from sync_clip.remote.client import show_history
+from sync_clip.remote.send_queue import OVERFLOW_POLICIES, OVERFLOW_DROP_OLDEST
 from sync_clip.monitor import monitor
+from sync_clip.stuff.clipboards import CLIPBOARD_BACKENDS
 
 parser = argparse.ArgumentParser()
 
 parser.add_argument(
     "-t", "--start-type",
-    help="choose the type, client or server, default: client",
+    help="choose the type, client or server, or 'history' to list the "
+         "server's clipboard history, default: client",
     default="client", type=str)
+parser.add_argument("-sm", "--server-mode",
+                    help="choose the server engine, 'aio' (one event loop "
+                         "for all connections) or 'thread' (one thread per "
+                         "connection), default: aio",
+                    default="aio", choices=SERVER_MODES, type=str)
+parser.add_argument("-qp", "--queue-policy",
+                    help="what the server does when a slow client's send "
+                         "queue is full, default: drop-oldest",
+                    default=OVERFLOW_DROP_OLDEST, choices=OVERFLOW_POLICIES,
+                    type=str)
+parser.add_argument("-qs", "--queue-size",
+                    help="max messages queued for one client on the server, "
+                         "default: 32",
+                    default=32, type=int)
+parser.add_argument("-bc", "--blob-cache-mb",
+                    help="MB of recent clipboard payloads the server keeps, "
+                         "so content a client has already is announced by "
+                         "hash instead of sent again, default: 256",
+                    default=256, type=int)
+parser.add_argument("-hm", "--history-mb",
+                    help="MB of clipboard history the server keeps in a "
+                         "memory-mapped file, newly connected clients get "
+                         "the latest entry, 0 disables it, default: 256",
+                    default=256, type=int)
+parser.add_argument("-lt", "--liveness-timeout",
+                    help="seconds the server waits for a silent client (they "
+                         "send a heartbeat every 3 seconds) before "
+                         "disconnecting it, 0 waits for a failed send, "
+                         "default: 10",
+                    default=10.0, type=float)
+parser.add_argument("-hb", "--history-before",
+                    help="with '-t history', list the entries older than "
+                         "this sequence number, default: the latest ones",
+                    default=0, type=int)
+parser.add_argument("-pmin", "--poll-min-interval",
+                    help="seconds between clipboard reads right after a "
+                         "change, default: 0.05",
+                    default=0.05, type=float)
+parser.add_argument("-pmax", "--poll-max-interval",
+                    help="seconds between clipboard reads once idle, "
+                         "default: 2",
+                    default=2.0, type=float)
+parser.add_argument("-cb", "--clipboard-backend",
+                    help="how the client accesses the linux clipboard, "
+                         "'xlib' (in process, python-xlib), 'xclip' (one "
+                         "xclip process per read/write) or 'auto' (xlib, "
+                         "falling back to xclip), default: auto",
+                    default="auto", choices=CLIPBOARD_BACKENDS, type=str)
+parser.add_argument("-iw", "--image-workers",
+                    help="processes shrinking large screenshots, 0 shrinks "
+                         "them in the client's own process, default: 1",
+                    default=1, type=int)
+parser.add_argument("-lz", "--lazy-threshold-kb",
+                    help="copies of at least this many KB (all formats) are "
+                         "offered to the other clients, which fetch them "
+                         "when pasted, 0 sends every copy in full, "
+                         "default: 64",
+                    default=64, type=int)
+parser.add_argument("-mf", "--max-files-mb",
+                    help="files copied (in a file manager) are synced with "
+                         "their content up to this many MB in total, "
+                         "default: 512",
+                    default=512, type=int)
+parser.add_argument("-nfh", "--no-file-hash",
+                    help="do not hash the files synced, their content is "
+                         "not checked once received",
+                    action="store_true")
+parser.add_argument("-ch", "--channel",
+                    help="channel the client joins, clipboards are only "
+                         "synced between the clients of one channel, "
+                         "default: the default channel, shared with clients "
+                         "naming none",
+                    default="", type=str)
 parser.add_argument("-sh", "--server-host",
                     help="choose server host the client is going to connect",
                     default="0.0.0.0", type=str)
@@ -27,9 +104,22 @@ def main():
     start_type = args.start_type.lower()
     host, port = args.server_host, args.server_port
     if start_type == "client":
-        monitor(host, port)
+        monitor(host, port, poll_min_interval=args.poll_min_interval,
+                poll_max_interval=args.poll_max_interval,
+                clipboard_backend=args.clipboard_backend,
+                image_workers=args.image_workers, channel=args.channel,
+                lazy_threshold=args.lazy_threshold_kb * 1024,
+                max_files_size=args.max_files_mb * 1024 * 1024,
+                hash_files=not args.no_file_hash)
     elif start_type == "server":
-        server(port)
+        server(port, mode=args.server_mode, queue_size=args.queue_size,
+               queue_policy=args.queue_policy,
+               blob_cache_size=args.blob_cache_mb * 1024 * 1024,
+               history_size=args.history_mb * 1024 * 1024,
+               liveness_timeout=args.liveness_timeout)
+    elif start_type == "history":
+        show_history(host, port, before=args.history_before,
+                     channel=args.channel)
     else:
         print(f"invalid type: {start_type}, please assign 'server' or client")
 
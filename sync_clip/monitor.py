@@ -1,115 +1,347 @@
 import time
 import logging
+import functools
 import traceback
 from queue import Empty
+from concurrent.futures import Future
 from threading import Lock
+from typing import *
 
 from sync_clip.remote.client import Client
+from sync_clip.remote.files import MAX_FILES_BYTES
+from sync_clip.remote.versions import (Version, UNVERSIONED, stamp,
+                                       version_of)
 from sync_clip.utils.util_thread import new_thread
-from sync_clip.utils.util_hash import hash_data
-from sync_clip.utils.utiil_image import reduce_image_size
+from sync_clip.utils.util_hash import Fingerprint
+from sync_clip.utils.utiil_image import ImagePool, PixelDigests, is_png_image
 from sync_clip.stuff.sync_signal import *
-from sync_clip.stuff.clipboards import Clipboard
+from sync_clip.stuff.clipboards import Clipboard, format_of
+from sync_clip.stuff.poller import PollScheduler
 
 logger = logging.getLogger("sync_clip")
 
 
 class ClipboardMonitor(object):
-    def __init__(self, host="0.0.0.0", port=12364):
-        self.tclip = Clipboard.get_clipboard()
-        self.rclip = Client(host=host, port=port)
+    MAX_IMAGE_SIZE = 1024 * 1024
+    LAZY_THRESHOLD = 64 * 1024
+
+    def __init__(self, host="0.0.0.0", port=12364, poll_min_interval=0.05,
+                 poll_max_interval=2.0, clipboard_backend="auto",
+                 image_workers=1, channel="",
+                 lazy_threshold=LAZY_THRESHOLD, max_files_size=MAX_FILES_BYTES,
+                 hash_files=True):
+        self.tclip = Clipboard.get_clipboard(backend=clipboard_backend)
+        self.poller = PollScheduler(min_interval=poll_min_interval,
+                                    max_interval=poll_max_interval)
+        self.poller.event_driven = self.tclip.watch_changes(self.poller.wake)
+        self.rclip = Client(host=host, port=port, channel=channel,
+                            max_files_size=max_files_size,
+                            hash_files=hash_files)
         self.rclip.start()
         self.is_closed = True
         self._compare_lock = Lock()
-        self._last_hash_clip_data = b""
-        self._last_get_remote_time = time.time()
+        self._last_fingerprint: Optional[Fingerprint] = None
+        self._last_change_token = None
+        # clipboard writes of the monitor (remote clipboards, reduced
+        # images), a read started before one of them is not a local copy
+        self._writes = 0
+        self.image_pool = ImagePool(max_workers=image_workers)
+        self.pixel_digests = PixelDigests(self.image_pool)
+        # copies of at least this many bytes (all formats) are offered by
+        # format, the peers fetch what they paste, 0 sends every copy whole
+        self.lazy_threshold = lazy_threshold
 
     @classmethod
     def data_is_png_image(cls, data):
-        return isinstance(data, bytes) and data.startswith(b"\x89PNG")
+        return is_png_image(data)
+
+    @classmethod
+    def _log_sync(cls, title, data):
+        sync_sample = bytes(data[:500]) if not isinstance(data, str) \
+            else data[:500]
+        if isinstance(sync_sample, bytes):
+            try:
+                sync_sample = sync_sample.decode("utf-8")
+            except UnicodeDecodeError:
+                pass
+        banner = f"[{title}]".center(80, "-")
+        logger.info(f"""
+{banner}
+{sync_sample}
+{banner}
+
+                    """)
+
+    def _held_fingerprint(self) -> Tuple[Fingerprint, Union[str, bytes]]:
+        """
+        Fingerprint of the clipboard right after writing it, and what it
+        holds: the backend may have re-encoded an image (same image,
+        different bytes), so later reads of it are told from a new copy
+        exactly
+        """
+        data = self.tclip.read_clip()
+        fingerprint = Fingerprint(data)
+        fingerprint.digest()
+        return fingerprint, data
+
+    def _submit_pixels(self, fingerprint: Fingerprint, data):
+        """
+        Have the pixels of an image held decoded in the image pool, to tell
+        a re-encoding of it later; call out of the compare lock
+        """
+        if fingerprint.kind == "png":
+            self.pixel_digests.submit(data, fingerprint.digest())
+
+    def _held_pixels(self, held: Fingerprint) -> Optional[bytes]:
+        if held.pixels is None:
+            future = self.pixel_digests.submitted(held.digest())
+            if future is not None:
+                pixels = future.result()
+                with self._compare_lock:
+                    held.pixels = pixels
+        return held.pixels
+
+    def _prepare_pixels(self, fingerprint: Fingerprint, data,
+                        held: Optional[Fingerprint]):
+        """
+        The pixel digests telling whether `data` is image `held` encoded
+        differently, decoded in the image pool before taking the compare
+        lock, only if its header has the size of the held one
+        """
+        if (held is None or fingerprint.image_size is None
+                or fingerprint.image_size != held.image_size
+                or fingerprint == held):
+            return
+        if self._held_pixels(held) is not None:
+            fingerprint.pixels = self.pixel_digests.digest(
+                data, fingerprint.digest())
+
+    def _is_reencoded(self, fingerprint: Fingerprint) -> bool:
+        """
+        Whether `fingerprint`, not the bytes held, is the image held encoded
+        differently, by the pixel digests `_prepare_pixels` got
+        """
+        return (fingerprint.pixels is not None
+                and fingerprint.may_be_same_image(self._last_fingerprint)
+                and fingerprint == self._last_fingerprint)
 
     @new_thread
     def _monitor_this_clip(self):
         while not self.is_closed:
             # noinspection PyBroadException
             try:
-                time.sleep(0.3)
+                self.poller.wait()
+                with self._compare_lock:
+                    writes, last_token = self._writes, self._last_change_token
+                    held = self._last_fingerprint
+                token = self.tclip.change_token()
+                if token is not None and token == last_token:
+                    # unchanged, skip reading, reducing and hashing (and
+                    # fetching the formats offered by a peer)
+                    self.poller.on_idle()
+                    continue
+                clip_data: [str, bytes] = self.tclip.read_clip()
+                fingerprint = (Fingerprint(clip_data) if clip_data.strip()
+                               else None)
+                if fingerprint is not None:
+                    self._prepare_pixels(fingerprint, clip_data, held)
                 with self._compare_lock:
-                    clip_data: [str, bytes] = self.tclip.read_clip()
-                    if not clip_data.strip():
+                    if writes != self._writes:
+                        # read around a write of ours, which recorded its
+                        # token
                         continue
+                    self._last_change_token = token
+                    if fingerprint is None:
+                        self.poller.on_idle()
+                        continue
+                    if fingerprint == self._last_fingerprint:
+                        self.poller.on_idle()
+                        continue
+                    # full hash, unless the compare already took it
+                    fingerprint.digest()
+                    if self._is_reencoded(fingerprint):
+                        # same pixels, nothing to send
+                        self._last_fingerprint = fingerprint
+                        self.poller.on_idle()
+                        continue
+                    self._last_fingerprint = fingerprint
+                    # newer than the remote clipboards not written yet
+                    version = self.rclip.versions.tick()
+                self.poller.on_change()
 
-                    if self.data_is_png_image(clip_data):
-                        # prevent large image
-                        a = time.time()
-                        clip_data, reduced = reduce_image_size(clip_data)
-                        if reduced:
-                            print(
-                                f"Reduced image cost: {round(time.time() - a, 2)}")
-                            self.tclip.write_clip(clip_data)
-
-                    h_data = hash_data(clip_data)
-                    if h_data != self._last_hash_clip_data:
-                        self._last_hash_clip_data = h_data
-                        if time.time() - self._last_get_remote_time < 0.5:
-                            # same image different bytes datas
-                            continue
-                        self.rclip.send_sync_data(SyncData(clip_data))
-                        sync_sample = clip_data[:500]
-                        if isinstance(sync_sample, bytes):
-                            try:
-                                sync_sample = sync_sample.decode("utf-8")
-                            except UnicodeDecodeError:
-                                pass
-                        logger.info(f"""
---------------------------------[sync to remote]--------------------------------
-{sync_sample}
---------------------------------[sync to remote]--------------------------------
-
-                                    """)
+                if (self.data_is_png_image(clip_data)
+                        and len(clip_data) > self.MAX_IMAGE_SIZE):
+                    # prevent large image, reduced off this thread
+                    future = self.image_pool.reduce_image_size(
+                        clip_data, self.MAX_IMAGE_SIZE)
+                    future.add_done_callback(
+                        functools.partial(self._on_image_reduced,
+                                          fingerprint, version, time.time()))
+                    continue
+                self._sync_to_remote(clip_data, version)
+                self._submit_pixels(fingerprint, clip_data)
             except Exception as exp:
                 logger.error(f"[monitor_this_clip] error: {exp}, \n"
                              f"{traceback.format_exc()}")
                 pass
 
+    def _on_image_reduced(self, fingerprint: Fingerprint, version: Version,
+                          started: float, future: Future):
+        # noinspection PyBroadException
+        try:
+            clip_data, _ = future.result()
+            with self._compare_lock:
+                if self._last_fingerprint is not fingerprint:
+                    logger.debug("clipboard changed during image reduction, "
+                                 "discard the reduced image")
+                    return
+                held = self._write_clip(clip_data)
+            self._submit_pixels(*held)
+            print(f"Reduced image cost: {round(time.time() - started, 2)}")
+            self._sync_to_remote(clip_data, version)
+        except Exception as exp:
+            logger.error(f"[on_image_reduced] error: {exp}, \n"
+                         f"{traceback.format_exc()}")
+
+    def _write_clip(self, data: bytes) -> Tuple[Fingerprint, bytes]:
+        """
+        Write the clipboard and record what it holds now, call under the
+        compare lock, then `_submit_pixels` what it returns out of it
+        """
+        self.tclip.write_clip(data)
+        self._writes += 1
+        held = self._held_fingerprint()
+        self._last_fingerprint = held[0]
+        self._last_change_token = self.tclip.change_token()
+        return held
+
+    def _write_remote(self, data: Union[str, bytes],
+                      version: Version = UNVERSIONED):
+        if not data.strip():
+            return
+        if not isinstance(data, (bytes, bytearray)):
+            data = data.encode()
+            print("data is not bytes, force to convert")
+
+        # union format, windows clipboard will add '\r' before '\n'
+        if not data.startswith(b"\x89PNG"):
+            data = data.replace(b"\r\n", b"\n")
+        elif len(data) > self.MAX_IMAGE_SIZE:
+            # senders reduce their images, this one did not
+            data, _ = self.image_pool.reduce_image_size(
+                data, self.MAX_IMAGE_SIZE).result()
+
+        fingerprint = Fingerprint(data)
+        # remote updates are rare, compare them exactly
+        fingerprint.digest()
+        self._prepare_pixels(fingerprint, data, self._last_fingerprint)
+        with self._compare_lock:
+            if self._is_overtaken(version):
+                return
+            if (fingerprint == self._last_fingerprint
+                    or self._is_reencoded(fingerprint)):
+                return
+            held = self._write_clip(data)
+        self._submit_pixels(*held)
+        # the local clipboard is likely to change again soon
+        self.poller.on_change()
+        self._log_sync("sync from remote", data)
+
+    def _is_overtaken(self, version: Version) -> bool:
+        """
+        Whether a remote clipboard is older than one copied or received
+        since it was taken, call under the compare lock
+        """
+        if not self.rclip.is_stale(version):
+            return False
+        logger.debug(f"remote clipboard of version {version} overtaken, "
+                     f"not written")
+        return True
+
+    def _sync_to_remote(self, clip_data: Union[str, bytes],
+                        version: Version):
+        """
+        Send a local copy of `version`: the files copied with their content,
+        else offered by format if at least `lazy_threshold` bytes and the
+        server takes offers
+        """
+        files = self.rclip.sendable_files(self.tclip.copied_files())
+        if files:
+            self._send_files(files, version)
+            return
+        if self.lazy_threshold and self.rclip.takes_offers:
+            formats = {format_of(clip_data): clip_data.encode("utf-8")
+                       if isinstance(clip_data, str) else bytes(clip_data),
+                       **self.tclip.extra_formats()}
+            if sum(map(len, formats.values())) >= self.lazy_threshold:
+                self.rclip.offer(formats, version)
+                self._log_sync("offer to remote", ", ".join(
+                    f"{mime}: {len(data)}" for mime, data in formats.items()))
+                return
+        sig = SyncData(clip_data)
+        stamp(sig, version)
+        self.rclip.send_sync_data(sig)
+        self._log_sync("sync to remote", clip_data)
+
+    @new_thread
+    def _send_files(self, paths: List[str], version: Version):
+        # off the monitor thread: the next copy supersedes the files still
+        # being sent
+        if self.rclip.send_files(paths, version):
+            self._log_sync("files to remote", "\n".join(paths))
+
+    def _write_files(self, sig: FilesSignal):
+        """
+        Own the clipboard with the files received, or write their paths
+        where the backend holds no file lists
+        """
+        with self._compare_lock:
+            if self._is_overtaken(version_of(sig)):
+                return
+            if self.tclip.write_files(sig.paths):
+                self._writes += 1
+                self._last_fingerprint, _ = self._held_fingerprint()
+                self._last_change_token = self.tclip.change_token()
+                self._log_sync("files from remote", "\n".join(sig.paths))
+                return
+        self._write_remote("\n".join(sig.paths), version_of(sig))
+
+    def _take_offer(self, offer: OfferSignal):
+        """
+        Own the clipboard with the formats offered, fetched when pasted, or
+        write the preferred one the backend takes, fetched now
+        """
+        digests = {mime: digest for mime, digest, _ in offer.formats}
+        with self._compare_lock:
+            if self._is_overtaken(version_of(offer)):
+                return
+            if self.tclip.offer_formats(
+                    {mime: size for mime, _, size in offer.formats},
+                    lambda mime: self.rclip.fetch_format(digests[mime])):
+                self._writes += 1
+                self._last_fingerprint = None
+                self._last_change_token = self.tclip.change_token()
+                self._log_sync("offer from remote", ", ".join(digests))
+                return
+        mime = next((mime for mime in digests
+                     if mime in (MIME_TEXT, MIME_PNG)), None)
+        data = (self.rclip.fetch_format(digests[mime]) if mime is not None
+                else None)
+        if data is not None:
+            self._write_remote(data, version_of(offer))
+
     @new_thread
     def _monitor_remote_clip(self):
         while not self.is_closed:
             # noinspection PyBroadException
             try:
-                clip_data: SyncData = self.rclip.recv_sync_sig.get(timeout=5)
-                if not clip_data.data.strip():
-                    continue
-                if not isinstance(clip_data.data, bytes):
-                    clip_data.data = clip_data.data.encode()
-                    print("data is not bytes, force to convert")
-
-                # union format, windows clipboard will add '\r' before '\n'
-                if not clip_data.data.startswith(b"\x89PNG"):
-                    clip_data.data = clip_data.data.replace(b"\r\n", b"\n")
-
-                compare_data = clip_data.data
-                if not isinstance(compare_data, bytes):
-                    compare_data = compare_data.encode()
-
-                h_data = hash_data(compare_data)
-                with self._compare_lock:
-                    if h_data != self._last_hash_clip_data:
-                        self.tclip.write_clip(clip_data.data)
-                        self._last_hash_clip_data = h_data
-                        self._last_get_remote_time = time.time()
-                        sync_sample = clip_data.data[:500]
-                        if isinstance(sync_sample, bytes):
-                            try:
-                                sync_sample = sync_sample.decode("utf-8")
-                            except UnicodeDecodeError:
-                                pass
-                        logger.info(f"""
--------------------------------[sync from remote]-------------------------------
-{sync_sample}
--------------------------------[sync from remote]-------------------------------
-
-                        """)
+                sig = self.rclip.recv_sync_sig.get(timeout=5)
+                if isinstance(sig, OfferSignal):
+                    self._take_offer(sig)
+                elif isinstance(sig, FilesSignal):
+                    self._write_files(sig)
+                else:
+                    self._write_remote(sig.data, version_of(sig))
             except Empty:
                 pass
             except Exception as exp:
@@ -131,6 +363,8 @@ class ClipboardMonitor(object):
     def close(self):
         if hasattr(self, "rclip"):
             self.rclip.close()
+        if hasattr(self, "image_pool"):
+            self.image_pool.close()
         if hasattr(self, "is_closed"):
             self.is_closed = True
 
@@ -138,12 +372,12 @@ class ClipboardMonitor(object):
         self.close()
 
 
-def monitor(host="0.0.0.0", port=12364):
+def monitor(host="0.0.0.0", port=12364, **options):
     from sync_clip.utils.util_log import set_scripts_logging
 
     set_scripts_logging(__file__, logger=logger, level=logging.DEBUG,
                         console_log=True, file_mode="a")
-    ClipboardMonitor(host=host, port=port).start()
+    ClipboardMonitor(host=host, port=port, **options).start()
 
 
 if __name__ == "__main__":
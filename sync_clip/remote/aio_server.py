@@ -0,0 +1,293 @@
+import os
+import socket
+import asyncio
+import logging
+import threading
+import traceback
+import functools
+from typing import *
+
+from sync_clip.stuff.sync_signal import *
+from sync_clip.remote.protocol import *
+from sync_clip.remote.server import Server, Peer
+from sync_clip.remote.relay import RelayMessage
+
+logger = logging.getLogger("sync_clip")
+
+
+class AioServer(Server):
+    """
+    Event-loop engine of `Server`: every connection is served by a coroutine
+    on one asyncio loop, so idle clients cost no thread and no polling.
+    Wire format and broadcast rules are inherited from `Server`.
+
+    Frames whose handling reads or writes files (spooled uploads and file
+    lists, resumes, the end of a large clipboard stored in the history) are
+    handled in the loop's executor, as the threaded engine would, the
+    connection waiting for them: the loop goes on serving the others.
+    """
+    # the end of smaller clipboards is handled on the loop
+    OFFLOAD_MIN_SIZE = 256 * 1024
+
+    def __init__(self, host="0.0.0.0", port=12364, **options):
+        super().__init__(host=host, port=port, **options)
+        self._loop: asyncio.AbstractEventLoop = None
+        self._loop_thread: Optional[int] = None
+        self._aio_server: asyncio.AbstractServer = None
+
+    def _is_on_loop(self) -> bool:
+        return (self._loop_thread is None
+                or threading.get_ident() == self._loop_thread)
+
+    def _on_loop(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        `callback` of the loop made safe to call from the executor
+        """
+        def call():
+            if self._is_on_loop():
+                callback()
+            else:
+                self._loop.call_soon_threadsafe(callback)
+        return call
+
+    def _drop_peer(self, peer: Peer):
+        if self._is_on_loop():
+            super()._drop_peer(peer)
+            return
+        # its stream writer belongs to the loop
+        peer.is_closed = True
+        self._loop.call_soon_threadsafe(
+            functools.partial(Server._drop_peer, self, peer))
+
+    def _keep_sending(self, peer: Peer):
+        ready = asyncio.Event()
+        peer.send_queue.on_ready = self._on_loop(ready.set)
+        self._loop.create_task(self._keep_sending_async(peer, ready))
+
+    async def _keep_sending_async(self, peer: Peer, ready: asyncio.Event):
+        writer: asyncio.StreamWriter = peer.conn
+        while not self.is_closed and not peer.send_queue.is_closed:
+            item = peer.send_queue.get_nowait()
+            if item is None:
+                ready.clear()
+                await ready.wait()
+                continue
+            try:
+                if isinstance(item, RelayMessage):
+                    await self._write_message_async(peer, item, ready)
+                else:
+                    writer.writelines(item)
+                # waits only for this peer's socket buffer to drain
+                await self._drain(writer)
+            except (ConnectionError, OSError) as exp:
+                logger.info(f"sending to {peer.addr} failed: {exp}")
+                self._drop_peer(peer)
+                break
+            except Exception as exp:
+                logger.error(f"sending sync data error: {exp} "
+                             f"\n{traceback.format_exc()}")
+
+    @staticmethod
+    async def _drain(writer: asyncio.StreamWriter):
+        """
+        Like `write_frames`, a peer that takes nothing for
+        `WRITE_STALL_TIMEOUT` seconds fails the write
+        """
+        buffered = writer.transport.get_write_buffer_size()
+        while True:
+            try:
+                await asyncio.wait_for(writer.drain(), WRITE_STALL_TIMEOUT)
+                return
+            except asyncio.TimeoutError:
+                left = writer.transport.get_write_buffer_size()
+                if left >= buffered:
+                    raise socket.timeout(f"nothing written for "
+                                         f"{WRITE_STALL_TIMEOUT} s")
+                buffered = left
+
+    @staticmethod
+    def _write_urgent_async(peer: Peer):
+        frames = peer.send_queue.get_urgent_nowait()
+        while frames is not None:
+            peer.conn.writelines(frames)
+            frames = peer.send_queue.get_urgent_nowait()
+
+    def _write_buffers(self, writer: asyncio.StreamWriter,
+                       buffers: List[bytes]):
+        """
+        Write `buffers`, a `FileRegion` is sent from its file
+        """
+        start = 0
+        for index, buffer in enumerate(buffers):
+            if isinstance(buffer, FileRegion):
+                writer.writelines(buffers[start:index])
+                self._send_region(writer, buffer)
+                start = index + 1
+        writer.writelines(buffers[start:] if start else buffers)
+
+    @staticmethod
+    def _send_region(writer: asyncio.StreamWriter, region: FileRegion):
+        """
+        Send what the socket takes of `region` from its file, when nothing is
+        buffered ahead of it (``transport.write`` takes the same shortcut),
+        and buffer the rest. ``loop.sendfile`` would pause reading the peer
+        for the whole region.
+        """
+        if (hasattr(os, "sendfile") and region.count
+                and not writer.transport.get_write_buffer_size()):
+            sock = writer.get_extra_info("socket")
+            try:
+                sent = os.sendfile(sock.fileno(), region.fd, region.offset,
+                                   region.count)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            region = region[sent:]
+        if region.count:
+            data = region.read()
+            # a file cut shorter meanwhile, see `FileRegion.send`
+            writer.write(data + bytes(region.count - len(data)))
+
+    async def _write_batches_async(self, peer: Peer, buffers: List[bytes],
+                                   can_stop=False, is_started=False) -> bool:
+        writer: asyncio.StreamWriter = peer.conn
+        for batch in self._iter_batches(peer, buffers):
+            if can_stop and is_started and self._is_superseded(peer):
+                return False
+            self._write_buffers(writer, batch)
+            self._write_urgent_async(peer)
+            await self._drain(writer)
+            is_started = True
+        return True
+
+    async def _write_message_async(self, peer: Peer, message: RelayMessage,
+                                   ready: asyncio.Event):
+        """
+        :param ready: set by new frames of the message and by queued ones,
+            urgent frames are written in between
+        """
+        message.add_listener(self._on_loop(ready.set))
+        can_stop = FEATURE_CANCEL in peer.features
+        index, is_stopped = 0, False
+        while not peer.is_closed:
+            ready.clear()
+            self._write_urgent_async(peer)
+            if not self._can_forward(peer, message):
+                if self._is_superseded(peer):
+                    break
+                if message.is_complete:
+                    frames = self._complete_frames(peer, message)
+                    if frames and not await self._write_batches_async(
+                            peer, self._stamp_frames(
+                                peer, message.stream_id,
+                                message.version) + frames, can_stop):
+                        peer.conn.writelines(self._cancel_frames(message))
+                if message.is_done:
+                    break
+            else:
+                buffers, is_done = message.buffers[index:], message.is_done
+                if ((buffers or not is_done) and (not index or can_stop)
+                        and self._is_superseded(peer)):
+                    is_stopped = True
+                    break
+                if buffers:
+                    stamp_frames = [] if index else self._stamp_frames(
+                        peer, message.stream_id, message.version)
+                    is_stopped = not await self._write_batches_async(
+                        peer, stamp_frames + buffers, can_stop, index > 0)
+                    index += len(buffers)
+                    if is_stopped:
+                        break
+                if is_done:
+                    break
+                if index < len(message.buffers):
+                    continue
+            await ready.wait()
+        if index and can_stop and (is_stopped or message.is_aborted):
+            peer.conn.writelines(self._cancel_frames(message))
+
+    @classmethod
+    async def _read_frame_async(cls, reader: asyncio.StreamReader):
+        first = await reader.readexactly(1)
+        if first[0] == FRAME_MAGIC:
+            header_bytes = first + await reader.readexactly(HEADER.size - 1)
+            header = unpack_header(header_bytes)
+            return header, header_bytes, await reader.readexactly(
+                header.length)
+        header = first + await reader.readexactly(LEGACY_HEADER_SIZE - 1)
+        return None, None, await reader.readexactly(
+            parse_legacy_header(header))
+
+    def _does_file_io(self, peer: Peer,
+                      header: Optional[FrameHeader]) -> bool:
+        if header is None:
+            return False
+        if header.type in (FRAME_FILE, FRAME_RESUME):
+            return True
+        return header.type == FRAME_DATA and (
+            header.stream_id in peer.uploads
+            or bool(header.flags & FLAG_END)
+            and header.total >= self.OFFLOAD_MIN_SIZE)
+
+    async def _keep_evicting_async(self):
+        while not self.is_closed:
+            await asyncio.sleep(self.liveness.wait_time(1.0))
+            self._evict_dead_peers()
+
+    async def _keep_receiving_async(self, reader: asyncio.StreamReader,
+                                    writer: asyncio.StreamWriter):
+        self._configure_conn(writer.get_extra_info("socket"))
+        peer = self._add_peer(writer, writer.get_extra_info("peername"))
+        try:
+            while not self.is_closed:
+                frame = await self._read_frame_async(reader)
+                if self._does_file_io(peer, frame[0]):
+                    await self._loop.run_in_executor(None, self._on_frame,
+                                                     peer, *frame)
+                else:
+                    self._on_frame(peer, *frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.info(f"client exit: {peer.addr}")
+        except asyncio.CancelledError:
+            # server shutting down
+            pass
+        except Exception as exp:
+            logger.error(f"exception: {exp}, \n"
+                         f"{traceback.format_exc()}")
+        finally:
+            self._drop_peer(peer)
+        logger.info(f"client: {peer.addr} listening coroutine end")
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._aio_server = await asyncio.start_server(
+            self._keep_receiving_async, sock=self.tcp_socket)
+        if self.liveness is not None:
+            self._loop.create_task(self._keep_evicting_async())
+        async with self._aio_server:
+            await self._aio_server.serve_forever()
+
+    def start(self):
+        self.is_closed = False
+        logger.info(f"\n\n\t[AioServer starting] listening on "
+                    f"`{self.host}:{self.port}`")
+        try:
+            asyncio.run(self._serve())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        loop = getattr(self, "_loop", None)
+        if loop is not None and loop.is_running():
+            try:
+                running_loop = asyncio.get_running_loop()
+            except RuntimeError:
+                running_loop = None
+            if running_loop is not loop:
+                # peers and queues belong to the loop thread
+                loop.call_soon_threadsafe(self.close)
+                return
+            self._aio_server.close()
+        super().close()
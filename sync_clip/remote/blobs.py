@@ -0,0 +1,113 @@
+"""
+Content addressed payload store, keyed by `hash_data` digest.
+
+The server keeps a large one and clients a small one, so a payload one side
+already has is announced by digest (``AnnounceSignal``) instead of sent
+again; a miss is answered by a ``FetchSignal`` of the digest. The stores
+are also the delta bases, see `sync_clip.remote.delta`.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+from typing import *
+
+# smaller payloads are cheaper to send than to announce
+BLOB_MIN_SIZE = 64 * 1024
+SERVER_BLOB_BYTES = 256 * 1024 * 1024
+CLIENT_BLOB_BYTES = 64 * 1024 * 1024
+CLIENT_BLOB_ENTRIES = 8
+
+Blob = namedtuple("Blob", ["digest", "payload", "is_text"])
+
+
+class BlobStore(object):
+    """
+    LRU of payloads bounded by total bytes and entries, with the hit rate
+    and bytes saved by announces for tuning
+    """
+
+    def __init__(self, max_bytes: int, max_entries: int = None,
+                 min_size: int = BLOB_MIN_SIZE):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.min_size = min_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._blobs: Dict[bytes, Blob] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def __contains__(self, digest: bytes) -> bool:
+        return digest in self._blobs
+
+    def put(self, digest: bytes, payload: bytes, is_text=False) -> bool:
+        """
+        :return: whether the payload is stored, too small or too large ones
+            are not
+        """
+        if not self.min_size <= len(payload) <= self.max_bytes:
+            return False
+        with self._lock:
+            old = self._blobs.pop(digest, None)
+            if old is not None:
+                self.size -= len(old.payload)
+            self._blobs[digest] = Blob(digest, bytes(payload), is_text)
+            self.size += len(payload)
+            while (self.size > self.max_bytes
+                   or self.max_entries
+                   and len(self._blobs) > self.max_entries):
+                _, blob = self._blobs.popitem(last=False)
+                self.size -= len(blob.payload)
+        return True
+
+    def get(self, digest: bytes, count=True) -> Optional[Blob]:
+        """
+        :param count: whether the lookup counts in the hit rate, lookups of
+            delta bases and fetches do not
+        """
+        with self._lock:
+            blob = self._blobs.get(digest)
+            if blob is not None:
+                self._blobs.move_to_end(digest)
+            if count:
+                self._count(blob)
+            return blob
+
+    def _count(self, blob: Optional[Blob]):
+        if blob is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.bytes_saved += len(blob.payload)
+
+    def record_lookup(self, blob: Optional[Blob]):
+        """
+        Count a lookup answered elsewhere (e.g. by the server history) in
+        the hit rate
+        """
+        with self._lock:
+            self._count(blob)
+
+    def record_saved(self, size: int):
+        """
+        Count bytes not sent thanks to an announce the peer had
+        """
+        with self._lock:
+            self.bytes_saved += size
+
+    def latest(self) -> Optional[Blob]:
+        with self._lock:
+            if not self._blobs:
+                return None
+            return next(reversed(self._blobs.values()))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"entries": len(self._blobs), "bytes": self.size,
+                "max_bytes": self.max_bytes, "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved}
@@ -0,0 +1,71 @@
+import threading
+
+
+class ChunkSizer(object):
+    """
+    Chunk size of one connection, adapted to the measured link.
+
+    The goal is that writing one chunk takes about one rtt (bounded to
+    `MIN_TARGET_TIME`..`MAX_TARGET_TIME`): small chunks on slow or lossy
+    links so other frames can get through, MB sized chunks on a LAN where
+    per-chunk overhead dominates. Throughput is measured over windows of
+    writes, a single write that only fills the kernel buffer says nothing.
+    """
+    MIN_CHUNK_SIZE = 16 * 1024
+    MAX_CHUNK_SIZE = 4 * 1024 * 1024
+    MIN_TARGET_TIME = 0.005
+    MAX_TARGET_TIME = 0.05
+    WINDOW_TIME = 0.05
+    SMOOTHING = 0.5
+
+    def __init__(self, chunk_size=25 * 1024, max_chunk_size=MAX_CHUNK_SIZE,
+                 min_chunk_size=MIN_CHUNK_SIZE):
+        self.min_chunk_size = min(min_chunk_size, max_chunk_size)
+        self.max_chunk_size = max_chunk_size
+        self._chunk_size = self._clamp(chunk_size)
+        self.throughput = 0.0
+        self.rtt = 0.0
+        self._window_bytes = 0
+        self._window_time = 0.0
+        self._lock = threading.Lock()
+
+    def _clamp(self, size: float) -> int:
+        return int(max(self.min_chunk_size, min(self.max_chunk_size, size)))
+
+    def set_max_chunk_size(self, max_chunk_size: int):
+        self.max_chunk_size = max(max_chunk_size, self.min_chunk_size)
+        self._chunk_size = self._clamp(self._chunk_size)
+
+    def chunk_size(self) -> int:
+        return self._chunk_size
+
+    def record_rtt(self, seconds: float):
+        with self._lock:
+            self.rtt = (seconds if not self.rtt else
+                        self.SMOOTHING * seconds
+                        + (1 - self.SMOOTHING) * self.rtt)
+            self._adapt()
+
+    def record_write(self, size: int, seconds: float):
+        with self._lock:
+            self._window_bytes += size
+            self._window_time += seconds
+            if self._window_time < self.WINDOW_TIME:
+                # a window of fast writes: the link keeps up, grow
+                if self._window_bytes >= 4 * self._chunk_size:
+                    self._chunk_size = self._clamp(self._chunk_size * 2)
+                    self._window_bytes, self._window_time = 0, 0.0
+                return
+            throughput = self._window_bytes / self._window_time
+            self._window_bytes, self._window_time = 0, 0.0
+            self.throughput = (throughput if not self.throughput else
+                               self.SMOOTHING * throughput
+                               + (1 - self.SMOOTHING) * self.throughput)
+            self._adapt()
+
+    def _adapt(self):
+        if not self.throughput:
+            return
+        target_time = min(self.MAX_TARGET_TIME,
+                          max(self.MIN_TARGET_TIME, self.rtt))
+        self._chunk_size = self._clamp(self.throughput * target_time)
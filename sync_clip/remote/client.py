@@ -1,44 +1,160 @@
+import os
 import sys
 import logging
-import pickle
 import threading
 import time
 import socket
+import itertools
+import functools
 import traceback
-from queue import Queue
+from queue import Queue, Empty
+from collections import OrderedDict
 from typing import *
 
 from sync_clip.stuff.sync_signal import *
-from sync_clip.utils.util_thread import new_thread
+from sync_clip.remote.protocol import *
+from sync_clip.remote.delta import *
+from sync_clip.remote.blobs import *
+from sync_clip.remote.chunking import ChunkSizer
+from sync_clip.remote.sender import *
+from sync_clip.remote.versions import *
+from sync_clip.remote.files import *
+from sync_clip.remote.resume import *
+from sync_clip.utils.util_hash import hash_data
+from sync_clip.utils.util_path import get_cache_data_dir
+from sync_clip.utils.util_thread import new_thread, LatestQueue
 
 logger = logging.getLogger("sync_clip")
 
 
 class Client(object):
     MAX_MESSAGE_SIZE = 25 * 1024
+    NEGOTIATE_TIMEOUT = 1.5
+    FETCH_TIMEOUT = 10.0
+    RESUME_TIMEOUT = 3.0
 
-    def __init__(self, host="0.0.0.0", port=8902):
+    def __init__(self, host="0.0.0.0", port=8902,
+                 codecs: Sequence[int] = SUPPORTED_CODECS,
+                 features: Sequence[int] = SUPPORTED_FEATURES,
+                 blob_cache_size=CLIENT_BLOB_BYTES,
+                 channel=DEFAULT_CHANNEL, max_files_size=MAX_FILES_BYTES,
+                 hash_files=True, files_dir: str = None):
         self.host = host
         self.port = port
+        # clipboards are only synced with the clients of the same channel,
+        # old servers ignore it
+        self.channel = channel
+        # compression codecs and features offered, and those agreed on by the
+        # server
+        self.offered_codecs = list(codecs)
+        self.codecs: List[int] = []
+        self.offered_features = list(features)
+        self.features: List[int] = []
+        # large payloads synced lately, for announces, fetches and as delta
+        # bases, the latest is the base of deltas sent
+        self.blobs = BlobStore(max_bytes=blob_cache_size,
+                               max_entries=CLIENT_BLOB_ENTRIES)
+        # versions of the clipboards copied here and received, of the large
+        # payloads (the server may fetch them) and of those being fetched
+        self.versions = VersionClock()
+        self._blob_versions: Dict[bytes, Version] = OrderedDict()
+        self._fetches: Dict[bytes, Version] = OrderedDict()
+        # digest -> (mime type, payload) of the formats of the latest offer
+        self._offered: Dict[bytes, Tuple[str, bytes]] = {}
+        # digest -> [event, payload] of the formats being fetched
+        self._waiters: Dict[bytes, list] = {}
+        self._waiters_lock = threading.Lock()
+        # file lists larger than this in total are neither sent nor kept,
+        # received files go to `files_dir`, checked against the digests of
+        # their sender if it hashes them
+        self.max_files_size = max_files_size
+        self.file_digests = FileDigests() if hash_files else None
+        self.files_dir = files_dir or get_cache_data_dir("files")
+        # stream id -> resumable upload being sent
+        self._uploads: Dict[int, Upload] = {}
+        # transfer id -> [event, offset] of the resumes asked
+        self._resumes: Dict[bytes, list] = {}
+        self._resumes_lock = threading.Lock()
+        # the latest clipboard that could not be sent, sent once reconnected
+        self.outbox = LatestQueue()
+        self.backoff = Backoff()
+        # number of reconnections
+        self._connections = 0
         self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.is_connected = False
-        self.send_lock = threading.Lock()
+        # frames of concurrent sends, most urgent first, one per connection
+        self.sender = PrioritySender(functools.partial(self._write_frames,
+                                                       self.tcp_socket))
+        self.protocol = PROTOCOL_LEGACY
+        self._reader = SignalReader(self.tcp_socket, self._receive_files)
+        self._stream_ids = itertools.count(1)
+        self.chunk_sizer = ChunkSizer(chunk_size=self.MAX_MESSAGE_SIZE)
+        # clipboards received, a newer one replaces the one not taken yet
+        self.recv_sync_sig = LatestQueue()
+        # answers of history requests
+        self.history_pages = Queue()
+        self._history_lock = threading.Lock()
         if not self._check_connection():
             sys.exit(1)
         print("confirmed connection !!!")
         self.is_closed = True
-        self.recv_sync_sig = Queue()
 
     def _check_connection(self):
         try:
             self.tcp_socket.connect((self.host, self.port))
-            self.is_connected = True
-            return True
+            try:
+                limit_unsent(self.tcp_socket)
+            except OSError as exp:
+                logger.warning(f"unable to limit unsent bytes: {exp}")
         except ConnectionRefusedError:
             print(f"\n\n unable to connect to remote server "
                   f"`{self.host}:{self.port}` !!! \n")
             self.is_connected = False
             return False
+        self._negotiate()
+        # clipboards copied until now wait in the outbox
+        self.is_connected = True
+        return True
+
+    def _negotiate(self):
+        """
+        Offer the binary protocol, old servers never answer and the
+        connection keeps the legacy pickle framing
+        """
+        self.protocol = PROTOCOL_LEGACY
+        self.codecs = []
+        self.features = []
+        self._reader = SignalReader(self.tcp_socket, self._receive_files)
+        self.chunk_sizer = ChunkSizer(chunk_size=self.MAX_MESSAGE_SIZE)
+        # messages still queued for the previous connection fail with it
+        self.sender = PrioritySender(functools.partial(self._write_frames,
+                                                       self.tcp_socket))
+        self.sender.send([[encode_legacy(ConCheck(
+            protocols=SUPPORTED_PROTOCOLS,
+            max_chunk_size=ChunkSizer.MAX_CHUNK_SIZE,
+            codecs=self.offered_codecs, features=self.offered_features,
+            channel=self.channel))]], PRIORITY_CONTROL)
+        deadline = time.time() + self.NEGOTIATE_TIMEOUT
+        while time.time() < deadline:
+            try:
+                sig = self.merge_recv_sig_data()
+            except socket.timeout:
+                continue
+            if isinstance(sig, ConCheck):
+                self.protocol = sig.protocol
+                if getattr(sig, "max_chunk_size", 0):
+                    self.chunk_sizer.set_max_chunk_size(sig.max_chunk_size)
+                self.codecs = choose_codecs(getattr(sig, "codecs", ()))
+                self.features = [
+                    feature for feature in getattr(sig, "features", ())
+                    if feature in self.offered_features]
+                # copies made from now on are newer than the channel's
+                self.versions.witness(getattr(sig, "clock", 0))
+                break
+            if isinstance(sig, SyncData):
+                self._take_sync_data(sig)
+        logger.info(f"negotiated protocol: {self.protocol}, "
+                    f"codecs: {self.codecs}, features: {self.features}")
 
     def split_sig_data(self, signal: SyncSignal) -> List[SyncSignal]:
         data_length = len(signal.data)
@@ -51,58 +167,517 @@ class Client(object):
             split_data = signal.data[index:index + self.MAX_MESSAGE_SIZE]
             split_sig = sig_cls(data=split_data)
             split_sig.is_end = False
+            stamp(split_sig, version_of(signal))
             split_sig_datas.append(split_sig)
             index += self.MAX_MESSAGE_SIZE
 
         split_sig_datas[-1].is_end = True
         return split_sig_datas
 
-    def send_sync_data(self, signal: SyncSignal):
-        with self.send_lock:
-            sig_datas = self.split_sig_data(signal)
-            for sig_data in sig_datas:
-                p_sig_data = pickle.dumps(sig_data)
-                try:
-                    data_length = len(p_sig_data)
-                    header = f"{data_length}".zfill(10)
-                    p_sig_data = header.encode() + p_sig_data
-                    # print(f"[client] send length : {data_length}, "
-                    #       f"expect full length: {len(p_sig_data)}")
-                    t = self.tcp_socket.send(p_sig_data)
-                    # print(f"\t\t[client]: sent: {t}")
-
-                except Exception as exp:
-                    logger.error(f"sending sync data error: {exp} "
-                                 f"\n{traceback.format_exc()}")
-
-    def _receive_data(self):
-        self.tcp_socket.settimeout(0.5)
-        header = self.tcp_socket.recv(10)
-        if not header:
-            raise ConnectionResetError()
-        print(f"[client] receive header: {header}, type:{type(header)}")
-        data_size = int(header.decode())
-        response = self.tcp_socket.recv(data_size)
-        print(f"response: {len(response)}, header size: {data_size}")
-        if not response:
-            raise ConnectionResetError()
-        while data_size - len(response) > 0:
-            response += self.tcp_socket.recv(data_size - len(response))
-        return response
+    def _remember_blob(self, signal: SyncData, payload: bytes = None,
+                       digest: bytes = None) -> Optional[bytes]:
+        """
+        :return: the digest of a payload large enough to be stored
+        """
+        if payload is None:
+            payload, _ = signal_payload(signal)
+        if not self.blobs.min_size <= len(payload) <= self.blobs.max_bytes:
+            return None
+        digest = digest or hash_data(payload)
+        self.blobs.put(digest, payload, isinstance(signal.data, str))
+        if signal.clock:
+            self._blob_versions[digest] = version_of(signal)
+            while len(self._blob_versions) > CLIENT_BLOB_ENTRIES:
+                self._blob_versions.popitem(last=False)
+        return digest
 
-    def merge_recv_sig_data(self) -> SyncSignal:
-        rsp = self._receive_data()
-        sig: SyncSignal = pickle.loads(rsp)
+    def _accept(self, version: Version) -> bool:
+        if self.versions.accept(version):
+            return True
+        logger.info(f"dropped clipboard of version {version}, older than "
+                    f"{self.versions.latest} or sent from here")
+        return False
+
+    def is_stale(self, version: Version) -> bool:
+        """
+        Whether a clipboard received (`recv_sync_sig`) was overtaken while
+        waiting to be written, by a newer one received or copied here
+        """
+        return bool(version[0]) and version < self.versions.latest
+
+    def _take_sync_data(self, signal: SyncData):
+        """
+        Deliver a received clipboard, a fetched one has the version of the
+        announce or delta it was fetched for. An offered format goes to the
+        thread fetching it.
+        """
+        if self._waiters and getattr(signal, "is_answer", False):
+            payload, _ = signal_payload(signal)
+            with self._waiters_lock:
+                waiter = self._waiters.pop(hash_data(payload), None)
+            if waiter is not None:
+                waiter[1] = bytes(payload)
+                waiter[0].set()
+            return
+        digest = self._remember_blob(signal)
+        version = version_of(signal)
+        if not version[0] and digest is not None:
+            version = self._fetches.pop(digest, UNVERSIONED)
+            stamp(signal, version)
+        if self._accept(version):
+            self.recv_sync_sig.put(signal)
+
+    def _fetch(self, digest: bytes, version: Version):
+        self._fetches[digest] = version
+        while len(self._fetches) > CLIENT_BLOB_ENTRIES:
+            self._fetches.popitem(last=False)
+        self.send_sync_data(FetchSignal(digest))
+
+    @staticmethod
+    def _blob_signal(blob: Blob) -> SyncData:
+        return SyncData(blob.payload.decode("utf-8") if blob.is_text
+                        else blob.payload)
+
+    def _compact(self, signal: SyncData) -> SyncSignal:
+        """
+        A large `signal` as a delta against the last synced payload when
+        that is much smaller, else announced by digest. It becomes the next
+        delta base either way.
+        """
+        payload, _ = signal_payload(signal)
+        if not self.blobs.min_size <= len(payload) <= self.blobs.max_bytes:
+            return signal
+        is_text = isinstance(signal.data, str)
+        base = self.blobs.latest()
+        digest = hash_data(payload)
+        self._remember_blob(signal, payload, digest)
+        if (FEATURE_DELTA in self.features and base is not None
+                and base.digest != digest):
+            delta = encode_delta(base.payload, payload,
+                                 base_digest=base.digest,
+                                 max_size=int(len(payload) * MAX_DELTA_RATIO))
+            if delta is not None:
+                logger.debug(f"sending a delta of {len(delta)} bytes for "
+                             f"{len(payload)}")
+                return SyncDelta(delta, is_text=is_text)
+        if FEATURE_ANNOUNCE in self.features:
+            return AnnounceSignal(digest, len(payload), is_text)
+        return signal
+
+    def _apply_delta(self, signal: SyncDelta) -> Optional[SyncData]:
+        """
+        Rebuild the payload of a received delta, fetched in full from the
+        server if the base is missing
+        """
+        base_digest, target_digest, _ = delta_digests(signal.data)
+        base = self.blobs.get(base_digest, count=False)
+        if base is not None:
+            try:
+                payload = apply_delta(base.payload, signal.data)
+            except DeltaError as exp:
+                logger.warning(f"bad delta: {exp}")
+            else:
+                sig = SyncData(str(payload, "utf-8") if signal.is_text
+                               else payload)
+                self._remember_blob(sig, payload, target_digest)
+                return sig
+        logger.info("delta base is missing, fetching the full payload")
+        self._fetch(target_digest, version_of(signal))
+        return None
+
+    def _take_announce(self, signal: AnnounceSignal) -> Optional[SyncData]:
+        """
+        The announced payload from the local blob store, fetched from the
+        server if missing
+        """
+        blob = self.blobs.get(signal.digest)
+        if blob is not None:
+            return self._blob_signal(blob)
+        self._fetch(signal.digest, version_of(signal))
+        return None
+
+    def _answer_fetch(self, signal: FetchSignal):
+        if signal.digest in self._offered:
+            _, payload = self._offered[signal.digest]
+            self.send_sync_data(SyncData(payload, is_answer=True),
+                                compact=False, is_clipboard=False)
+            return
+        blob = self.blobs.get(signal.digest, count=False)
+        if blob is None:
+            logger.info("the server fetches an unknown payload")
+            return
+        # the upload of the latest clipboard announced, superseded by the
+        # next one like the clipboards sent in full
+        latest = self.blobs.latest()
+        sig = self._blob_signal(blob)
+        stamp(sig, self._blob_versions.get(blob.digest, UNVERSIONED))
+        self.send_sync_data(sig, compact=False,
+                            is_clipboard=latest is not None
+                            and latest.digest == blob.digest)
+
+    @property
+    def takes_offers(self) -> bool:
+        return (self.protocol != PROTOCOL_LEGACY
+                and FEATURE_LAZY in self.features)
+
+    def offer(self, formats: Dict[str, bytes], version: Version = None
+              ) -> bool:
+        """
+        Sync a clipboard by its formats (mime type -> content, the preferred
+        first), peers fetch the ones pasted. Supersedes the clipboard being
+        sent, like `send_sync_data`.
+
+        :param version: of the clipboard, taken from `versions` if not given
+        :return: False if the server does not take offers, or the offer was
+            superseded
+        """
+        if not self.takes_offers:
+            return False
+        connection = self._connections
+        if not self.is_connected:
+            self._send_later(functools.partial(self.offer, formats,
+                                               version), connection)
+            return False
+        self._offered = {hash_data(payload): (mime, bytes(payload))
+                         for mime, payload in formats.items()}
+        sig = OfferSignal([(mime, digest, len(payload))
+                           for digest, (mime, payload)
+                           in self._offered.items()])
+        stamp(sig, version or self.versions.tick())
+        stream_id = next(self._stream_ids)
+        try:
+            return self.sender.send([
+                encode_signal(StampSignal(stream_id, *version_of(sig)))
+                + encode_signal(sig, stream_id=stream_id)],
+                PRIORITY_TEXT, key=SyncData)
+        except OSError as exp:
+            logger.warning(f"offer not sent, sending it once reconnected: "
+                           f"{exp}")
+            self._send_later(functools.partial(self.offer, formats,
+                                               version), connection)
+            return False
+        except Exception as exp:
+            logger.error(f"sending offer error: {exp} "
+                         f"\n{traceback.format_exc()}")
+            return False
+
+    @property
+    def takes_files(self) -> bool:
+        return (self.protocol != PROTOCOL_LEGACY
+                and FEATURE_FILES in self.features)
+
+    def sendable_files(self, paths: Sequence[str]) -> List[str]:
+        """
+        The regular files of `paths` (directories are not synced), none if
+        the server does not take file lists or they are larger than
+        `max_files_size` in total
+        """
+        if not self.takes_files:
+            return []
+        files = [path for path in paths if os.path.isfile(path)]
+        size = sum(map(os.path.getsize, files))
+        if size > self.max_files_size:
+            logger.info(f"not syncing {len(files)} files of {size} bytes, "
+                        f"more than {self.max_files_size}")
+            return []
+        return files
+
+    def send_files(self, paths: Sequence[str], version: Version = None
+                   ) -> bool:
+        """
+        Sync a file list clipboard with the content of the files at `paths`,
+        sent from disk. Supersedes the clipboard being sent, like
+        `send_sync_data`.
+
+        :param version: of the clipboard, taken from `versions` if not given
+        :return: False if none of `paths` can be sent (see
+            `sendable_files`), or the file list was superseded
+        """
+        connection = self._connections
+        # noinspection PyBroadException
+        try:
+            paths = self.sendable_files(paths)
+            if not paths:
+                return False
+            if not self.is_connected:
+                self._send_later(functools.partial(self.send_files, paths,
+                                                   version), connection)
+                return False
+            sizes = [os.path.getsize(path) for path in paths]
+            names = []
+            for path in paths:
+                name = base = os.path.basename(path)
+                stem, ext = os.path.splitext(base)
+                while name in names:
+                    name = f"{stem} ({len(names) + 1}){ext}"
+                names.append(name)
+            sig = FilesSignal(
+                [(name, size, self.file_digests.digest(path)
+                  if self.file_digests is not None else NO_DIGEST)
+                 for name, size, path in zip(names, sizes, paths)], paths)
+            stamp(sig, version or self.versions.tick())
+            stream_id = next(self._stream_ids)
+            first = encode_signal(sig, stream_id=stream_id)
+            if FEATURE_VERSION in self.features:
+                first = encode_signal(StampSignal(
+                    stream_id, *version_of(sig))) + first
+            return self.sender.send(
+                itertools.chain([first], iter_file_frames(
+                    paths, sizes, stream_id, self.chunk_sizer.chunk_size)),
+                PRIORITY_BULK, key=SyncData,
+                cancel_frame=encode_signal(CancelSignal(stream_id))
+                if FEATURE_CANCEL in self.features else None)
+        except OSError as exp:
+            logger.warning(f"files not sent, sending them once reconnected: "
+                           f"{exp}")
+            self._send_later(functools.partial(self.send_files, paths,
+                                               version), connection)
+            return False
+        except Exception as exp:
+            logger.error(f"sending files error: {exp} "
+                         f"\n{traceback.format_exc()}")
+            return False
 
-        while not sig.is_end:
-            rsp = self._receive_data()
-            next_sig: SyncSignal = pickle.loads(rsp)
-            if not isinstance(next_sig, type(sig)):
-                logger.error(f"received different type sig !!!")
-            sig.data += next_sig.data
-            sig.is_end = next_sig.is_end
+    def _receive_files(self, sig: FilesSignal) -> FileReceiver:
+        return FileReceiver(sig, self.files_dir, self.max_files_size)
 
-        return sig
+    def fetch_format(self, digest: bytes,
+                     timeout: float = None) -> Optional[bytes]:
+        """
+        The content of an offered format, fetched from its sender through
+        the server unless synced lately. Needs the receiving thread
+        (`start`).
+
+        :return: None if it did not arrive in time
+        """
+        blob = self.blobs.get(digest, count=False)
+        if blob is not None:
+            return blob.payload
+        with self._waiters_lock:
+            waiter = self._waiters.get(digest)
+            is_asked = waiter is not None
+            if not is_asked:
+                waiter = self._waiters[digest] = [threading.Event(), None]
+        if not is_asked:
+            self.send_sync_data(FetchSignal(digest))
+        if not waiter[0].wait(self.FETCH_TIMEOUT if timeout is None
+                              else timeout):
+            with self._waiters_lock:
+                if self._waiters.get(digest) is waiter:
+                    self._waiters.pop(digest)
+            logger.warning(f"offered format {digest.hex()[:12]} not fetched "
+                           f"in time")
+        return waiter[1]
+
+    def history(self, before=0, limit=10,
+                timeout=5.0) -> Optional[List[tuple]]:
+        """
+        A page of the server's clipboard history, the entries older than
+        sequence `before` (0 for the latest ones), see `HistorySignal`.
+        Needs the receiving thread (`start`).
+
+        :return: None if the server keeps no history or did not answer in
+            time
+        """
+        if FEATURE_HISTORY not in self.features:
+            return None
+        with self._history_lock:
+            # answers of requests timed out earlier
+            while not self.history_pages.empty():
+                self.history_pages.get_nowait()
+            self.send_sync_data(HistorySignal(before, limit))
+            try:
+                return self.history_pages.get(timeout=timeout).entries
+            except Empty:
+                return None
+
+    def fetch(self, digest: bytes):
+        """
+        Ask for a payload of the history by digest, it arrives on
+        `recv_sync_sig` like any synced clipboard
+        """
+        blob = self.blobs.get(digest, count=False)
+        if blob is not None:
+            self.recv_sync_sig.put(self._blob_signal(blob))
+            return
+        self.send_sync_data(FetchSignal(digest))
+
+    def iter_sig_frames(self, signal: SyncSignal, compact=True,
+                        stream_id: int = None,
+                        upload: Upload = None) -> Iterator[List[bytes]]:
+        """
+        Frames of `signal`, binary chunks are memoryview slices of its
+        (compressed) data sized by the connection's `ChunkSizer` as they are
+        sent
+
+        :param compact: whether a large payload may go as a delta or an
+            announce, fetches are answered in full
+        :param stream_id: of a `SyncData`, a new one by default. Clipboards
+            have theirs, a large one goes as a resumable upload where the
+            server takes them.
+        :param upload: the interrupted upload of the clipboard `signal`, it
+            goes on from where the server has it
+        """
+        if self.protocol == PROTOCOL_LEGACY:
+            for sig_data in self.split_sig_data(signal):
+                yield [encode_legacy(sig_data)]
+            return
+        version = version_of(signal)
+        frames = None
+        if not isinstance(signal, SyncData):
+            stream_id = 0
+        else:
+            is_resumable = (stream_id is not None
+                            and FEATURE_RESUME in self.features)
+            if stream_id is None:
+                stream_id = next(self._stream_ids)
+            if is_resumable and upload is not None and upload.fits(
+                    self.codecs):
+                frames = self._resume_frames(upload, stream_id)
+            else:
+                if compact:
+                    signal = self._compact(signal)
+                else:
+                    self._remember_blob(signal)
+                if is_resumable and isinstance(signal, (SyncData, SyncDelta)):
+                    payload, flags = signal_payload(signal)
+                    if len(payload) >= RESUME_MIN_SIZE:
+                        upload = self._uploads[stream_id] = Upload(
+                            payload, flags, self.codecs)
+                        frames = upload.frames(stream_id, 0,
+                                               self.chunk_sizer.chunk_size)
+        if frames is None:
+            frames = iter_signal_frames(signal, stream_id,
+                                        self.chunk_sizer.chunk_size,
+                                        self.codecs)
+        if version[0] and FEATURE_VERSION in self.features:
+            # the stamp goes with the first frame, the first one of the
+            # message written
+            yield encode_signal(StampSignal(stream_id, *version)) + next(
+                frames)
+        yield from frames
+
+    def _ask_resume(self, transfer_id: bytes) -> int:
+        """
+        Payload bytes of upload `transfer_id` the server holds, 0 if it does
+        not answer in time. Needs the receiving thread (`start`).
+        """
+        waiter = [threading.Event(), 0]
+        with self._resumes_lock:
+            self._resumes[transfer_id] = waiter
+        self.send_sync_data(ResumeSignal(transfer_id=transfer_id))
+        if not waiter[0].wait(self.RESUME_TIMEOUT):
+            logger.warning("the server did not tell where an upload was cut, "
+                           "sending it whole")
+        with self._resumes_lock:
+            self._resumes.pop(transfer_id, None)
+        return waiter[1]
+
+    def _resume_frames(self, upload: Upload,
+                       stream_id: int) -> Iterator[List[bytes]]:
+        offset = self._ask_resume(upload.transfer_id)
+        logger.info(f"resuming an upload at {offset} of "
+                    f"{len(upload.payload)} bytes")
+        self._uploads[stream_id] = upload
+        return upload.frames(stream_id, offset, self.chunk_sizer.chunk_size)
+
+    def _write_frames(self, conn: socket.socket, buffers: List[bytes]):
+        start = time.perf_counter()
+        write_frames(conn, buffers)
+        self.chunk_sizer.record_write(sum(len(buffer) for buffer in buffers),
+                                      time.perf_counter() - start)
+
+    def _priority(self, signal: SyncSignal) -> int:
+        if self.protocol == PROTOCOL_LEGACY:
+            # legacy chunks of a message can not be interleaved, every
+            # message goes whole in order
+            return PRIORITY_BULK
+        if not isinstance(signal, (SyncData, SyncDelta, AnnounceSignal)):
+            return PRIORITY_CONTROL
+        # large text is compacted like images, it keeps their order
+        if (isinstance(signal, SyncData) and isinstance(signal.data, str)
+                and len(signal.data) < self.blobs.min_size):
+            return PRIORITY_TEXT
+        return PRIORITY_BULK
+
+    def send_sync_data(self, signal: SyncSignal, compact=True,
+                       is_clipboard: bool = None,
+                       upload: Upload = None) -> bool:
+        """
+        Send `signal`, blocking until it is written. The frames of more
+        urgent signals sent meanwhile by other threads go in between.
+
+        A clipboard is superseded by the next one: dropped if not started
+        yet, else cancelled where the server can. One that can not be sent,
+        the connection being down, waits in the `outbox` and goes once
+        reconnected, a large one from where it was cut.
+
+        :param is_clipboard: of a `SyncData`, compacted ones by default
+        :param upload: the interrupted upload of the clipboard `signal`
+        :return: whether it was written whole
+        """
+        connection = self._connections
+        if is_clipboard is None:
+            is_clipboard = compact
+        if isinstance(signal, SyncData) and compact and not signal.clock:
+            # copied here
+            stamp(signal, self.versions.tick())
+        key = cancel_frame = stream_id = retry = None
+        if isinstance(signal, SyncData) and is_clipboard:
+            key = SyncData
+            retry = functools.partial(self.send_sync_data, signal, compact,
+                                      is_clipboard)
+            if not self.is_connected:
+                self._send_later(functools.partial(retry, upload=upload),
+                                 connection)
+                return False
+            if self.protocol != PROTOCOL_LEGACY:
+                stream_id = next(self._stream_ids)
+                if FEATURE_CANCEL in self.features:
+                    cancel_frame = encode_signal(CancelSignal(stream_id))
+        try:
+            return self.sender.send(
+                self.iter_sig_frames(signal, compact, stream_id, upload),
+                self._priority(signal), key=key, cancel_frame=cancel_frame)
+        except Exception as exp:
+            if retry is None or not isinstance(exp, OSError):
+                logger.error(f"sending sync data error: {exp} "
+                             f"\n{traceback.format_exc()}")
+                return False
+            logger.warning(f"clipboard not sent, sending it once "
+                           f"reconnected: {exp}")
+            self._send_later(functools.partial(
+                retry, upload=self._uploads.get(stream_id, upload)),
+                connection)
+            return False
+        finally:
+            self._uploads.pop(stream_id, None)
+
+    def _send_later(self, send: Callable[[], bool], connection: int):
+        """
+        Keep the clipboard `send` sends for the next connection, it failed
+        on connection number `connection`
+        """
+        self.outbox.put(send)
+        if self._connections != connection:
+            # reconnected meanwhile, the outbox was flushed already
+            self._flush_outbox()
+
+    @new_thread
+    def _flush_outbox(self):
+        try:
+            send = self.outbox.get_nowait()
+        except Empty:
+            return
+        logger.info("sending the clipboard the connection dropped")
+        send()
+
+    def merge_recv_sig_data(self) -> SyncSignal:
+        self.tcp_socket.settimeout(0.5)
+        while True:
+            sig = self._reader.read_signal()
+            if sig is not None:
+                return sig
 
     @new_thread
     def _keep_receiving(self):
@@ -110,40 +685,84 @@ class Client(object):
             # noinspection PyBroadException
             try:
                 sig: SyncSignal = self.merge_recv_sig_data()
-                if isinstance(sig, SyncData):
-                    self.recv_sync_sig.put(sig)
+                if isinstance(sig, SyncDelta):
+                    version = version_of(sig)
+                    if self._accept(version):
+                        sig = self._apply_delta(sig)
+                        if sig is not None:
+                            stamp(sig, version)
+                            self.recv_sync_sig.put(sig)
+                elif isinstance(sig, AnnounceSignal):
+                    version = version_of(sig)
+                    if self._accept(version):
+                        sig = self._take_announce(sig)
+                        if sig is not None:
+                            stamp(sig, version)
+                            self.recv_sync_sig.put(sig)
+                elif isinstance(sig, SyncData):
+                    self._take_sync_data(sig)
+                elif isinstance(sig, (OfferSignal, FilesSignal)):
+                    if self._accept(version_of(sig)):
+                        self.recv_sync_sig.put(sig)
+                elif isinstance(sig, FetchSignal):
+                    self._answer_fetch(sig)
+                elif isinstance(sig, HistorySignal):
+                    self.history_pages.put(sig)
+                elif isinstance(sig, ResumeSignal) and sig.is_answer:
+                    with self._resumes_lock:
+                        waiter = self._resumes.get(sig.transfer_id)
+                    if waiter is not None:
+                        waiter[1] = sig.offset
+                        waiter[0].set()
+                elif isinstance(sig, HeartbeatSignal) and sig.is_ack:
+                    self.chunk_sizer.record_rtt(
+                        time.monotonic() - sig.sent_at)
 
             except socket.timeout:
                 continue
-            except ConnectionResetError:
+            except OSError:
                 self.is_connected = False
-                while True:
-                    logger.info(f"======== server offline, try to reconnect..."
-                                f"==========")
-                    self.tcp_socket.close()
-                    try:
-                        self.tcp_socket = socket.socket(socket.AF_INET,
-                                                        socket.SOCK_STREAM)
-                        if self._check_connection():
-                            logger.info(
-                                f"======== server reconnect success !!!"
-                                f"==========")
-                            break
-                    except Exception as e:
-                        try:
-                            self.tcp_socket.close()
-                        except Exception:
-                            pass
-                    time.sleep(1)
+                self._reconnect()
+            except ProtocolError as exp:
+                # a frame cut after its header, what follows is not a frame
+                logger.error(f"protocol error while receiving: {exp}")
+                self.is_connected = False
+                self._reconnect()
             except Exception as exp:
                 logger.error(f"Exception while receiving: {exp}\n"
                              f"{traceback.format_exc()}")
                 continue
 
+    def _reconnect(self):
+        """
+        Reconnect, waiting a `Backoff` delay between attempts, then send the
+        clipboard of the outbox
+        """
+        while not self.is_closed:
+            logger.info("======== server offline, try to reconnect..."
+                        "==========")
+            self.tcp_socket.close()
+            try:
+                self.tcp_socket = socket.socket(socket.AF_INET,
+                                                socket.SOCK_STREAM)
+                if self._check_connection():
+                    logger.info("======== server reconnect success !!!"
+                                "==========")
+                    self.backoff.reset()
+                    self._connections += 1
+                    self._flush_outbox()
+                    return
+            except Exception:
+                try:
+                    self.tcp_socket.close()
+                except Exception:
+                    pass
+            time.sleep(self.backoff.next_delay())
+
     @new_thread
     def _keep_alive(self):
         while not self.is_closed:
-            self.send_sync_data(HeartbeatSignal())
+            self.send_sync_data(HeartbeatSignal(sent_at=time.monotonic()))
             time.sleep(3)
 
     def start(self):
@@ -155,9 +774,28 @@ class Client(object):
         self.is_closed = True
 
 
+def show_history(host="0.0.0.0", port=12364, before=0, limit=20,
+                 channel=DEFAULT_CHANNEL):
+    """
+    Print a page of the server's clipboard history of `channel`
+    """
+    client = Client(host=host, port=port, channel=channel)
+    client.start()
+    entries = client.history(before, limit)
+    client.close()
+    if entries is None:
+        print("the server keeps no history")
+        return
+    for seq, digest, size, is_text, at, preview in entries:
+        preview = (preview.decode("utf-8", errors="replace") if is_text
+                   else f"<{size} bytes>")
+        at = time.strftime('%m-%d %H:%M:%S', time.localtime(at))
+        print(f"{seq:>6}  {at}  {digest.hex()[:12]}  {size:>10}  "
+              f"{' '.join(preview.split())[:60]}")
+
+
 if __name__ == "__main__":
     import sys
-    from queue import Empty
 
     tc = Client()
     tc.start()
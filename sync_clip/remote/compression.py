@@ -0,0 +1,171 @@
+"""
+Payload compression of binary DATA streams, negotiated per connection.
+
+The client offers ``SUPPORTED_CODECS`` in its ``ConCheck``, the server
+answers with the ones both sides have. zlib is always there, zstd and lz4
+when the ``zstandard`` / ``lz4`` packages are installed. A sender compresses
+a payload with its most preferred agreed codec unless the payload is small,
+already compressed (png, jpeg, zip, ...) or does not shrink; the codec id
+travels in the frame flags and the stream ``total`` is the decompressed
+size, so receivers still know it and decompress frame by frame.
+"""
+import zlib
+from typing import *
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_LZ4 = 3
+
+# smaller payloads are sent as they are
+COMPRESS_MIN_SIZE = 1024
+# compressed payloads must shrink below this ratio to be worth it
+MAX_RATIO = 0.9
+
+# signatures of payloads compressed already
+_COMPRESSED_MAGICS = (
+    b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"RIFF", b"PK\x03\x04",
+    b"\x1f\x8b", b"BZh", b"\xfd7zXZ", b"7z\xbc\xaf", b"\x28\xb5\x2f\xfd",
+    b"\x04\x22\x4d\x18")
+
+
+class CompressionError(Exception):
+    ...
+
+
+class Codec(object):
+
+    def __init__(self, codec_id: int, name: str,
+                 compress: Callable[[bytes], bytes],
+                 decompressobj: Callable[[], Any]):
+        self.codec_id = codec_id
+        self.name = name
+        self.compress = compress
+        # makes objects whose `decompress` takes a max output length
+        self.decompressobj = decompressobj
+
+
+class _OutputFull(Exception):
+    ...
+
+
+class _ZstdDecompressObj(object):
+    """
+    zstd decompression object taking a max output length like zlib's: a
+    stream writer hands the output over block by block and is stopped past
+    the length, the output of a chunk is never materialised whole
+    """
+
+    def __init__(self):
+        self._output = bytearray()
+        self._max_length = 0
+        self._writer = zstandard.ZstdDecompressor().stream_writer(self)
+
+    def write(self, block) -> int:
+        room = self._max_length - len(self._output)
+        self._output += block[:room]
+        if len(block) > room:
+            raise _OutputFull()
+        return len(block)
+
+    def decompress(self, chunk, max_length: int) -> bytearray:
+        self._output, self._max_length = bytearray(), max_length
+        try:
+            self._writer.write(chunk)
+        except _OutputFull:
+            pass
+        return self._output
+
+
+CODECS: Dict[int, Codec] = {
+    CODEC_ZLIB: Codec(CODEC_ZLIB, "zlib", lambda data: zlib.compress(data, 1),
+                      zlib.decompressobj),
+}
+if zstandard is not None:
+    CODECS[CODEC_ZSTD] = Codec(
+        CODEC_ZSTD, "zstd",
+        lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        _ZstdDecompressObj)
+if lz4 is not None:
+    CODECS[CODEC_LZ4] = Codec(CODEC_LZ4, "lz4", lz4.frame.compress,
+                              lz4.frame.LZ4FrameDecompressor)
+
+# most preferred first
+SUPPORTED_CODECS = tuple(codec_id for codec_id in
+                         (CODEC_ZSTD, CODEC_LZ4, CODEC_ZLIB)
+                         if codec_id in CODECS)
+
+
+def choose_codecs(offered: Iterable[int]) -> List[int]:
+    offered = set(offered or ())
+    return [codec_id for codec_id in SUPPORTED_CODECS if codec_id in offered]
+
+
+def is_compressible(payload) -> bool:
+    return (len(payload) >= COMPRESS_MIN_SIZE
+            and not bytes(payload[:4]).startswith(_COMPRESSED_MAGICS))
+
+
+def compress_payload(payload, codecs: Sequence[int]) -> Tuple[Any, int]:
+    """
+    :return: the payload to send and its codec, the payload itself with
+        `CODEC_NONE` when compression is not worth it
+    """
+    if not codecs or not is_compressible(payload):
+        return payload, CODEC_NONE
+    codec = CODECS[codecs[0]]
+    compressed = codec.compress(payload)
+    if len(compressed) > len(payload) * MAX_RATIO:
+        return payload, CODEC_NONE
+    return compressed, codec.codec_id
+
+
+class Decompressor(object):
+    """
+    Decompress a stream chunk by chunk into the buffer `output`, grown up to
+    the announced decompressed size `total` (its length by default), more
+    output than announced is an error
+    """
+
+    def __init__(self, codec_id: int, output: bytearray, total: int = None):
+        codec = CODECS.get(codec_id)
+        if codec is None:
+            raise CompressionError(f"unsupported codec: {codec_id}")
+        self._codec = codec
+        self._obj = codec.decompressobj()
+        self._output = output
+        self.total = len(output) if total is None else total
+        self.offset = 0
+
+    def feed(self, chunk):
+        remaining = self.total - self.offset
+        # bounded, a chunk expanding past the total stops right there
+        data = self._obj.decompress(chunk, remaining + 1)
+        if len(data) > remaining or getattr(self._obj, "unconsumed_tail",
+                                            b""):
+            raise CompressionError(f"stream decompresses beyond its total: "
+                                   f"{self.total}")
+        # grows the output past the part reserved
+        self._output[self.offset:self.offset + len(data)] = data
+        self.offset += len(data)
+
+    def finish(self) -> bytearray:
+        if self.offset != self.total:
+            raise CompressionError(f"stream decompressed to {self.offset} "
+                                   f"of {self.total}")
+        return self._output
+
+
+def decompress_payload(payload, codec_id: int, total: int) -> bytearray:
+    decompressor = Decompressor(codec_id, bytearray(total))
+    decompressor.feed(payload)
+    return decompressor.finish()
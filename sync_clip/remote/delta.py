@@ -0,0 +1,217 @@
+"""
+Binary deltas of a payload against a base both peers have, for large
+clipboards copied again after a small edit.
+
+A delta is ``DELTA_HEADER`` (base digest, target digest, target size)
+followed by ops: ``COPY`` of a base range or ``LITERAL`` bytes. Digests are
+`hash_data` of the payloads, the receiver checks the rebuilt target against
+it. `encode_delta` matches blocks of the base by a rolling (adler32) hash:
+base blocks are indexed with `zlib.adler32`, the target window is rolled
+byte by byte only where nothing matches, a match is verified and extended
+with slice comparisons.
+"""
+import zlib
+import struct
+from typing import *
+
+from sync_clip.utils.util_hash import hash_data
+
+# payloads worth a delta, smaller ones are sent as they are
+DELTA_MIN_SIZE = 64 * 1024
+# a delta larger than this ratio of its target is not worth it
+MAX_DELTA_RATIO = 0.5
+
+# base digest, target digest, target size
+DELTA_HEADER = struct.Struct("!16s16sQ")
+OP_COPY = 0
+OP_LITERAL = 1
+# target positions probed for shared content before a full scan
+PROBES = 8
+
+# op, base offset, length
+_COPY = struct.Struct("!BQI")
+# op, length
+_LITERAL = struct.Struct("!BI")
+
+_ADLER_MOD = 65521
+
+
+class DeltaError(Exception):
+    ...
+
+
+def block_size_for(size: int) -> int:
+    return max(64, min(4096, int(size ** 0.5 / 4)))
+
+
+def _roll(checksum: int, out_byte: int, in_byte: int, block: int) -> int:
+    a = checksum & 0xffff
+    b = checksum >> 16
+    a = (a - out_byte + in_byte) % _ADLER_MOD
+    b = (b - block * out_byte + a - 1) % _ADLER_MOD
+    return (b << 16) | a
+
+
+def _match_length(base: memoryview, base_start: int, target: memoryview,
+                  target_start: int) -> int:
+    """
+    Length of the common run of base and target from the given offsets,
+    compared in doubling then halving steps
+    """
+    limit = min(len(base) - base_start, len(target) - target_start)
+    length, step = 0, 64
+    while step:
+        step = min(step, limit - length)
+        if step and (base[base_start + length:base_start + length + step]
+                     == target[target_start + length:
+                               target_start + length + step]):
+            length += step
+            step *= 2
+        else:
+            step //= 2
+    return length
+
+
+class _DeltaWriter(object):
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+        self.size = 0
+
+    def copy(self, offset: int, length: int):
+        self.parts.append(_COPY.pack(OP_COPY, offset, length))
+        self.size += _COPY.size
+
+    def literal(self, data):
+        if len(data):
+            self.parts.append(_LITERAL.pack(OP_LITERAL, len(data)))
+            self.parts.append(bytes(data))
+            self.size += _LITERAL.size + len(data)
+
+
+def _find_block(index: Dict[int, List[int]], base: memoryview,
+                target: memoryview, position: int, end: int,
+                block: int) -> Tuple[int, Optional[int]]:
+    """
+    Roll a `block` sized window over the target from `position` until it
+    matches a base block or starts at `end`
+
+    :return: the window position and the matching base offset, None if
+        nothing matched
+    """
+    end = min(end, len(target) - block)
+    if position > end:
+        return position, None
+    checksum = zlib.adler32(target[position:position + block])
+    while True:
+        window = target[position:position + block]
+        for offset in index.get(checksum, ()):
+            if base[offset:offset + block] == window:
+                return position, offset
+        if position >= end:
+            return position, None
+        checksum = _roll(checksum, target[position], target[position + block],
+                         block)
+        position += 1
+
+
+def encode_delta(base, target, base_digest: bytes = None,
+                 max_size: int = None) -> Optional[bytes]:
+    """
+    :param base_digest: `hash_data` of `base` if known already
+    :param max_size: give up once the delta grows past it
+    :return: the delta turning `base` into `target`, None if over `max_size`
+        or if probes spread over the target find too little of the base
+    """
+    base = memoryview(base).cast("B")
+    target = memoryview(target).cast("B")
+    block = block_size_for(len(base))
+    index: Dict[int, List[int]] = {}
+    for offset in range(0, len(base) - block + 1, block):
+        index.setdefault(zlib.adler32(base[offset:offset + block]),
+                         []).append(offset)
+    max_size = len(target) if max_size is None else max_size
+
+    # a run shared with the base longer than two blocks holds a whole base
+    # block, unrelated content is turned down without a full scan
+    step = len(target) // PROBES
+    if step > 2 * block:
+        hits = sum(_find_block(index, base, target, probe * step,
+                               probe * step + 2 * block, block)[1] is not None
+                   for probe in range(PROBES))
+        if hits < PROBES * 3 // 4:
+            return None
+
+    writer = _DeltaWriter()
+    literal_start = position = 0
+    while True:
+        position, match = _find_block(
+            index, base, target, position,
+            literal_start + max_size - writer.size, block)
+        if match is None:
+            break
+        # grow the match backwards into the pending literal
+        start = position
+        while (start > literal_start and match > 0
+               and base[match - 1] == target[start - 1]):
+            start -= 1
+            match -= 1
+        length = _match_length(base, match, target, start)
+        writer.literal(target[literal_start:start])
+        writer.copy(match, length)
+        if writer.size > max_size:
+            return None
+        position = literal_start = start + length
+    writer.literal(target[literal_start:])
+    if writer.size > max_size:
+        return None
+    if base_digest is None:
+        base_digest = hash_data(base)
+    return DELTA_HEADER.pack(base_digest, hash_data(target),
+                             len(target)) + b"".join(writer.parts)
+
+
+def delta_digests(delta) -> Tuple[bytes, bytes, int]:
+    """
+    :return: base digest, target digest and target size of `delta`
+    """
+    if len(delta) < DELTA_HEADER.size:
+        raise DeltaError(f"delta too short: {len(delta)}")
+    return DELTA_HEADER.unpack_from(delta)
+
+
+def apply_delta(base, delta) -> bytearray:
+    """
+    Rebuild the target of `delta` from `base`, checked against its digest
+    """
+    base_digest, target_digest, size = delta_digests(delta)
+    base = memoryview(base).cast("B")
+    delta = memoryview(delta).cast("B")
+    target = bytearray(size)
+    position = 0
+    index = DELTA_HEADER.size
+    try:
+        while index < len(delta):
+            if delta[index] == OP_COPY:
+                _, offset, length = _COPY.unpack_from(delta, index)
+                index += _COPY.size
+                if offset + length > len(base):
+                    raise DeltaError(f"copy past the base end: "
+                                     f"{offset + length}")
+                source = base[offset:offset + length]
+            elif delta[index] == OP_LITERAL:
+                _, length = _LITERAL.unpack_from(delta, index)
+                index += _LITERAL.size
+                source = delta[index:index + length]
+                index += length
+            else:
+                raise DeltaError(f"unknown delta op: {delta[index]}")
+            if len(source) != length or position + length > size:
+                raise DeltaError("delta overflows its target")
+            target[position:position + length] = source
+            position += length
+    except struct.error as exp:
+        raise DeltaError(f"truncated delta: {exp}")
+    if position != size or hash_data(target) != target_digest:
+        raise DeltaError("rebuilt target does not match its digest")
+    return target
@@ -0,0 +1,269 @@
+"""
+File list clipboards (files copied in a file manager) synced with the
+content of their files.
+
+The sender writes a FILES frame listing the files (name, size, digest),
+then their content in FILE frames whose payloads are `FileRegion`s of the
+open files: ``os.sendfile`` hands them to the socket without reading them
+into the process (memory maps of the files where the platform has no
+sendfile). The server spools the frames to disk as it relays them. The
+receiver writes each file into a new directory of its cache, checks it
+against its digest and only then offers the file list to the clipboard.
+"""
+import os
+import mmap
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from hashlib import blake2b
+from collections import OrderedDict
+from typing import *
+
+from sync_clip.stuff.sync_signal import FilesSignal
+from sync_clip.remote.protocol import *
+from sync_clip.utils.util_hash import DIGEST_SIZE, hash_file
+
+logger = logging.getLogger("sync_clip")
+
+# copies of files larger than this in total are not synced
+MAX_FILES_BYTES = 512 * 1024 * 1024
+# received files kept, the latest file list always is
+FILES_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+# digest of a file not hashed by its sender
+NO_DIGEST = bytes(DIGEST_SIZE)
+# directories of files being received, left behind by a crash are removed
+# after a day
+PART_PREFIX = ".part-"
+PART_MAX_AGE = 24 * 3600
+
+
+def iter_file_frames(paths: Sequence[str], sizes: Sequence[int],
+                     stream_id: int, chunk_size: Union[int, Callable[[], int]]
+                     ) -> Iterator[List[bytes]]:
+    """
+    FILE frames of the files at `paths`, of the `sizes` of their manifest,
+    as ``[header, payload]`` lists, payloads are `FileRegion`s or memory
+    map slices. Every file has a frame, an empty one a frame of no payload.
+    """
+    total, last = sum(sizes), len(paths) - 1
+    for index, (path, size) in enumerate(zip(paths, sizes)):
+        with open(path, "rb") as file:
+            mapped = None
+            if not hasattr(os, "sendfile") and size:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            offset = 0
+            while True:
+                count = min(chunk_size() if callable(chunk_size)
+                            else chunk_size, size - offset)
+                is_end = index == last and offset + count >= size
+                if mapped is None:
+                    payload = FileRegion(file.fileno(), offset, count, file)
+                else:
+                    payload = memoryview(mapped)[offset:offset + count]
+                    if len(payload) < count:
+                        # cut shorter meanwhile, see `FileRegion.send`
+                        payload = bytes(payload) + bytes(count - len(payload))
+                yield [pack_header(FRAME_FILE, FLAG_END if is_end else 0,
+                                   stream_id, count, total), payload]
+                offset += count
+                if offset >= size:
+                    break
+
+
+class FileDigests(object):
+    """
+    Digests of the files copied lately, by path, size and modification time:
+    a file copied again is not read again
+    """
+    CACHE_SIZE = 256
+
+    def __init__(self):
+        self.hashed = 0
+        self._cache: Dict[tuple, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def digest(self, path: str) -> bytes:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        digest = hash_file(path)
+        self.hashed += stat.st_size
+        with self._lock:
+            self._cache[key] = digest
+            while len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return digest
+
+
+class FileReceiver(object):
+    """
+    Writes the files of a received file list into a new directory of the
+    cache `directory` as their frames arrive, hashing them on the way.
+    Files of lists larger than `max_bytes`, or that fail to be written or
+    checked, are received and dropped.
+    """
+
+    def __init__(self, sig: FilesSignal, directory: Optional[str],
+                 max_bytes=MAX_FILES_BYTES, cache_bytes=FILES_CACHE_BYTES):
+        self.sig = sig
+        self.directory = directory
+        self.cache_bytes = cache_bytes
+        self.total = sum(size for _, size, _ in sig.files)
+        if self.total > MAX_FILES_SIZE:
+            raise ProtocolError(f"file list too large: {self.total}")
+        self.received = 0
+        self._scratch = bytearray()
+        # file being written, its end in the stream, its file and hash
+        self._index = -1
+        self._end = 0
+        self._file = None
+        self._hash = None
+        self._part: Optional[str] = None
+        if directory is None:
+            self.is_dropped = True
+        elif self.total > max_bytes:
+            logger.info(f"dropping a file list of {self.total} bytes, more "
+                        f"than {max_bytes}")
+            self.is_dropped = True
+        else:
+            self.is_dropped = False
+            try:
+                self._part = tempfile.mkdtemp(prefix=PART_PREFIX,
+                                              dir=directory)
+            except OSError as exp:
+                self._drop(f"cannot create a cache directory: {exp}")
+
+    def buffer(self, length: int) -> memoryview:
+        if len(self._scratch) < length:
+            self._scratch = bytearray(length)
+        return memoryview(self._scratch)[:length]
+
+    def _drop(self, reason: str):
+        logger.warning(f"dropping a received file list: {reason}")
+        self.is_dropped = True
+        self.abort()
+
+    def _next_file(self):
+        self._end_file()
+        self._index += 1
+        name, size, _ = self.sig.files[self._index]
+        self._end += size
+        if self.is_dropped:
+            return
+        self._hash = blake2b(digest_size=DIGEST_SIZE)
+        try:
+            self._file = open(os.path.join(self._part, name), "wb")
+        except OSError as exp:
+            self._drop(f"cannot write {name}: {exp}")
+
+    def _end_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._index < 0 or self.is_dropped:
+            return
+        name, _, digest = self.sig.files[self._index]
+        if digest != NO_DIGEST and self._hash.digest() != digest:
+            self._drop(f"{name} does not match its digest")
+
+    def write(self, payload: memoryview):
+        """
+        Write the payload of the next FILE frame
+        """
+        if self.received + len(payload) > self.total:
+            raise ProtocolError(f"file list overflows its total: "
+                                f"{self.total}")
+        while self.received >= self._end and self._index + 1 < len(
+                self.sig.files):
+            self._next_file()
+        if self.received + len(payload) > self._end:
+            raise ProtocolError("a file frame spans two files")
+        self.received += len(payload)
+        if self.is_dropped:
+            return
+        self._hash.update(payload)
+        try:
+            self._file.write(payload)
+        except OSError as exp:
+            self._drop(f"cannot write {self.sig.files[self._index][0]}: "
+                       f"{exp}")
+
+    def finish(self) -> Optional[FilesSignal]:
+        """
+        :return: the file list with the paths of the files written in the
+            cache, stamped like the one received, None if dropped
+        """
+        if self.received != self.total:
+            self.abort()
+            raise ProtocolError(f"file list ended at {self.received} of "
+                                f"{self.total}")
+        while self._index + 1 < len(self.sig.files):
+            # empty files at the end
+            self._next_file()
+        self._end_file()
+        if self.is_dropped:
+            return None
+        directory = os.path.join(self.directory,
+                                 os.path.basename(self._part)[
+                                     len(PART_PREFIX):])
+        try:
+            for name, _, _ in self.sig.files:
+                # empty files were not opened
+                open(os.path.join(self._part, name), "ab").close()
+            os.rename(self._part, directory)
+        except OSError as exp:
+            self._drop(f"cannot move the files in the cache: {exp}")
+            return None
+        self._part = None
+        prune_cache(self.directory, self.cache_bytes, keep=directory)
+        sig = FilesSignal(self.sig.files, paths=[
+            os.path.join(directory, name) for name, _, _ in self.sig.files])
+        sig.clock, sig.origin = self.sig.clock, self.sig.origin
+        return sig
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._part is not None:
+            shutil.rmtree(self._part, ignore_errors=True)
+            self._part = None
+
+
+def _tree_size(path: str) -> int:
+    size = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+def prune_cache(directory: str, max_bytes: int, keep: str = None):
+    """
+    Remove the oldest file lists of the cache `directory` beyond `max_bytes`
+    (never `keep`) and the directories of files left half received
+    """
+    now = time.time()
+    lists = []
+    for entry in os.scandir(directory):
+        if not entry.is_dir():
+            continue
+        if entry.name.startswith(PART_PREFIX):
+            if now - entry.stat().st_mtime > PART_MAX_AGE:
+                shutil.rmtree(entry.path, ignore_errors=True)
+            continue
+        lists.append((entry.stat().st_mtime, entry.path))
+    total = 0
+    for _, path in sorted(lists, reverse=True):
+        total += _tree_size(path)
+        if total > max_bytes and path != keep:
+            logger.debug(f"removing received files {path}")
+            shutil.rmtree(path, ignore_errors=True)
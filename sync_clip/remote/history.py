@@ -0,0 +1,230 @@
+"""
+Clipboard history of the server: a bounded ring of the latest payloads in a
+memory-mapped file, so large images do not sit on the Python heap.
+
+Entries are appended back to back, each ``ENTRY_HEADER`` (magic, sequence,
+digest, is text, time, size) followed by the payload. Writing wraps to the
+start of the file when an entry does not fit before its end, overwriting
+the oldest entries. Writes go through `os.pwrite` where available, so the
+appended pages are never mapped in the server process, reads copy out of
+the map. The index by sequence and by digest lives in memory, the file is
+scratch space: only the server can read it, it is removed once mapped
+(on close where an open file can not be removed) and a restarted server
+starts with an empty history. Entries
+belong to the channel they were synced in, the latest entry and pages are
+per channel.
+"""
+import os
+import mmap
+import time
+import struct
+import threading
+from collections import OrderedDict, namedtuple
+from typing import *
+
+from sync_clip.utils.util_hash import hash_data
+
+HISTORY_BYTES = 256 * 1024 * 1024
+HISTORY_ENTRIES = 4096
+# entries listed by one history page at most
+MAX_PAGE_SIZE = 100
+PREVIEW_SIZE = 64
+
+ENTRY_MAGIC = 0xC6
+# magic, sequence, digest, is text, time, size
+ENTRY_HEADER = struct.Struct("!BQ16s?dQ")
+
+_HAS_PWRITE = hasattr(os, "pwrite")
+
+HistoryEntry = namedtuple(
+    "HistoryEntry",
+    ["seq", "digest", "size", "is_text", "time", "offset", "channel"])
+
+
+class HistoryRing(object):
+    """
+    Latest payloads in a ring file of `capacity` bytes, `max_entries` at
+    most, sequence numbers start at 1
+    """
+
+    def __init__(self, path: str, capacity: int = HISTORY_BYTES,
+                 max_entries: int = HISTORY_ENTRIES):
+        self.path = path
+        self.capacity = capacity
+        self.max_entries = max_entries
+        self.last_seq = 0
+        # offset of the next entry
+        self._head = 0
+        self._entries: Dict[int, HistoryEntry] = OrderedDict()
+        self._by_digest: Dict[bytes, int] = {}
+        # channel -> sequence of its latest entry
+        self._latest: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        # synced clipboards may be passwords: created anew, never through a
+        # file or link of someone else
+        self._file = os.fdopen(os.open(
+            path, os.O_RDWR | os.O_CREAT | os.O_EXCL
+            | getattr(os, "O_BINARY", 0), 0o600), "w+b")
+        self._file.truncate(capacity)
+        self._map = mmap.mmap(self._file.fileno(), capacity)
+        self._is_removed = self._remove()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, digest: bytes) -> bool:
+        return digest in self._by_digest
+
+    @property
+    def size(self) -> int:
+        """
+        Payload bytes of the entries held
+        """
+        return sum(entry.size for entry in list(self._entries.values()))
+
+    def _evict_oldest(self):
+        _, entry = self._entries.popitem(last=False)
+        if self._by_digest.get(entry.digest) == entry.seq:
+            self._by_digest.pop(entry.digest)
+        if self._latest.get(entry.channel) == entry.seq:
+            self._latest.pop(entry.channel)
+
+    def _oldest(self) -> Optional[HistoryEntry]:
+        return next(iter(self._entries.values()), None)
+
+    def _make_room(self, length: int) -> int:
+        """
+        Evict the entries the next `length` bytes overwrite
+
+        :return: offset of the new entry
+        """
+        offset = self._head
+        if offset + length > self.capacity:
+            # the tail of the file is left unused, its entries are the
+            # oldest ones
+            while self._entries and self._oldest().offset >= offset:
+                self._evict_oldest()
+            offset = 0
+        end = offset + length
+        while self._entries:
+            oldest = self._oldest()
+            if (len(self._entries) < self.max_entries
+                    and not offset <= oldest.offset < end):
+                break
+            self._evict_oldest()
+        return offset
+
+    def _write(self, offset: int, data):
+        view = memoryview(data).cast("B")
+        if not _HAS_PWRITE:
+            self._map[offset:offset + len(view)] = view
+            return
+        while view:
+            written = os.pwrite(self._file.fileno(), view, offset)
+            view = view[written:]
+            offset += written
+
+    def append(self, payload, is_text=False, digest: bytes = None,
+               channel="") -> Optional[HistoryEntry]:
+        """
+        :return: the new entry, the latest one of the channel if it holds
+            the same payload already, None if the payload is larger than the
+            ring
+        """
+        length = ENTRY_HEADER.size + len(payload)
+        if length > self.capacity:
+            return None
+        digest = digest or hash_data(payload)
+        with self._lock:
+            latest = self.latest(channel)
+            if latest is not None and latest.digest == digest:
+                return latest
+            offset = self._make_room(length)
+            entry = HistoryEntry(self.last_seq + 1, digest, len(payload),
+                                 is_text, time.time(), offset, channel)
+            self._write(offset, ENTRY_HEADER.pack(
+                ENTRY_MAGIC, entry.seq, digest, is_text, entry.time,
+                entry.size))
+            self._write(offset + ENTRY_HEADER.size, payload)
+            self.last_seq = entry.seq
+            self._head = offset + length
+            self._entries[entry.seq] = entry
+            self._by_digest[digest] = entry.seq
+            self._latest[channel] = entry.seq
+        return entry
+
+    def latest(self, channel="") -> Optional[HistoryEntry]:
+        seq = self._latest.get(channel)
+        return self._entries.get(seq) if seq is not None else None
+
+    def get(self, seq: int) -> Optional[HistoryEntry]:
+        return self._entries.get(seq)
+
+    def find(self, digest: bytes) -> Optional[HistoryEntry]:
+        seq = self._by_digest.get(digest)
+        return self._entries.get(seq) if seq is not None else None
+
+    def read(self, entry: HistoryEntry, length: int = None) -> Optional[bytes]:
+        """
+        Copy of the payload of `entry` (its first `length` bytes if given),
+        None if it was overwritten meanwhile
+        """
+        start = entry.offset + ENTRY_HEADER.size
+        end = start + (entry.size if length is None
+                       else min(length, entry.size))
+        with self._lock:
+            if self._entries.get(entry.seq) is not entry:
+                return None
+            return self._map[start:end]
+
+    def page(self, before: int = 0, limit: int = 10,
+             channel="") -> List[Tuple[HistoryEntry, bytes]]:
+        """
+        Entries of `channel` older than sequence `before` (0 for the latest
+        ones), newest first, with the first `PREVIEW_SIZE` bytes of their
+        payload
+        """
+        limit = max(0, min(limit, MAX_PAGE_SIZE))
+        with self._lock:
+            seq = min(before - 1, self.last_seq) if before else self.last_seq
+            oldest = self._oldest()
+            entries = []
+            while (oldest is not None and seq >= oldest.seq
+                   and len(entries) < limit):
+                entry = self._entries.get(seq)
+                if entry is not None and entry.channel == channel:
+                    entries.append(entry)
+                seq -= 1
+        page = []
+        for entry in entries:
+            preview = self.read(entry, PREVIEW_SIZE)
+            if preview is not None:
+                page.append((entry, preview))
+        return page
+
+    def stats(self) -> dict:
+        oldest = self._oldest()
+        return {"entries": len(self._entries), "bytes": self.size,
+                "capacity": self.capacity, "last_seq": self.last_seq,
+                "first_seq": oldest.seq if oldest is not None else 0}
+
+    def close(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_digest.clear()
+            self._latest.clear()
+            self._map.close()
+            self._file.close()
+            if not self._is_removed:
+                self._is_removed = self._remove()
+
+    def _remove(self) -> bool:
+        try:
+            os.remove(self.path)
+        except OSError:
+            return False
+        return True
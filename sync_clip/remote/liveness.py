@@ -0,0 +1,124 @@
+"""
+Liveness of the server's connections: every received frame pushes the
+sender's deadline back, peers whose deadline passed are evicted.
+
+Clients send a heartbeat every 3 seconds, so a peer silent for
+``LIVENESS_TIMEOUT`` missed several of them. Deadlines sit in a heap with
+lazy updates: touching a peer only writes its new deadline to a dict, the
+heap entry is moved when it comes up and the peer turns out to have been
+touched since. A touch is O(1), every peer is re-pushed at most once per
+timeout, so the cost does not grow with the number of idle connections.
+"""
+import heapq
+import socket
+import itertools
+import threading
+import time
+from typing import *
+
+LIVENESS_TIMEOUT = 10.0
+# TCP keepalive of accepted sockets: probes after KEEPALIVE_IDLE silent
+# seconds, every KEEPALIVE_INTERVAL, the connection is reset after
+# KEEPALIVE_COUNT unanswered ones
+KEEPALIVE_IDLE = 10
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_COUNT = 3
+
+
+def enable_keepalive(sock: socket.socket, idle=KEEPALIVE_IDLE,
+                     interval=KEEPALIVE_INTERVAL, count=KEEPALIVE_COUNT):
+    """
+    Let the kernel probe a silent peer, the options a platform lacks keep
+    their system defaults
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # linux names the idle time TCP_KEEPIDLE, macos TCP_KEEPALIVE
+    idle_option = getattr(socket, "TCP_KEEPIDLE",
+                          getattr(socket, "TCP_KEEPALIVE", None))
+    for option, value in ((idle_option, idle),
+                          (getattr(socket, "TCP_KEEPINTVL", None), interval),
+                          (getattr(socket, "TCP_KEEPCNT", None), count)):
+        if option is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, option, value)
+
+
+class LivenessTracker(object):
+    """
+    Deadlines of tracked keys (e.g. peers), `timeout` seconds after they
+    were last touched
+    """
+
+    def __init__(self, timeout: float = LIVENESS_TIMEOUT,
+                 clock: Callable[[], float] = time.monotonic):
+        self.timeout = timeout
+        self.clock = clock
+        # key -> [deadline, token], the token tells the key's live heap entry
+        # from stale ones of an earlier tracking
+        self._deadlines: Dict[Any, list] = {}
+        self._heap: List[Tuple[float, int, Any]] = []
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key) -> bool:
+        return key in self._deadlines
+
+    def touch(self, key):
+        """
+        The key was heard from, push its deadline back
+        """
+        deadline = self.clock() + self.timeout
+        with self._lock:
+            entry = self._deadlines.get(key)
+            if entry is not None:
+                entry[0] = deadline
+                return
+            token = next(self._tokens)
+            self._deadlines[key] = [deadline, token]
+            heapq.heappush(self._heap, (deadline, token, key))
+
+    def remove(self, key):
+        """
+        Stop tracking the key, its heap entry is dropped when it comes up
+        """
+        with self._lock:
+            self._deadlines.pop(key, None)
+
+    def expired(self) -> List[Any]:
+        """
+        Stop tracking and return the keys whose deadline passed
+        """
+        now = self.clock()
+        keys = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, token, key = heapq.heappop(self._heap)
+                entry = self._deadlines.get(key)
+                if entry is None or entry[1] != token:
+                    continue
+                if entry[0] > now:
+                    # touched since it was pushed
+                    heapq.heappush(self._heap, (entry[0], token, key))
+                    continue
+                self._deadlines.pop(key)
+                keys.append(key)
+        return keys
+
+    def next_deadline(self) -> Optional[float]:
+        """
+        The earliest deadline in the heap, a key touched since may be due
+        later
+        """
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def wait_time(self, limit: float) -> float:
+        """
+        Seconds until the next deadline, at most `limit`
+        """
+        deadline = self.next_deadline()
+        if deadline is None:
+            return limit
+        return max(0.0, min(limit, deadline - self.clock()))
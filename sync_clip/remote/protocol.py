@@ -0,0 +1,816 @@
+"""
+Wire format of the sync protocol.
+
+Two framings share one connection:
+
+* legacy:  10 ascii digits of length + ``pickle.dumps(SyncSignal)``, spoken by
+  every released client and server.
+* binary:  a fixed ``HEADER`` (magic, version, type, flags, stream id, length,
+  total) followed by the raw payload, used once both peers agree on it.
+
+A new client offers ``SUPPORTED_PROTOCOLS`` (and compression codecs, see
+`sync_clip.remote.compression`, and optional features) in a legacy framed
+``ConCheck``, naming the channel it joins,
+a new server answers with the chosen one, an old server ignores it and the
+connection stays legacy. The first byte of each frame tells the framings
+apart (``FRAME_MAGIC`` is never an ascii digit), so readers accept both.
+"""
+import io
+import os
+import copy
+import pickle
+import select
+import socket
+import time
+import struct
+import threading
+from collections import namedtuple
+from typing import *
+
+from sync_clip.stuff import sync_signal
+from sync_clip.stuff.sync_signal import *
+from sync_clip.remote.compression import *
+
+PROTOCOL_LEGACY = 0
+PROTOCOL_BINARY = 1
+SUPPORTED_PROTOCOLS = (PROTOCOL_BINARY,)
+
+# DATA streams may be deltas, see `sync_clip.remote.delta`
+FEATURE_DELTA = 1
+# large payloads are announced by digest first, see `sync_clip.remote.blobs`
+FEATURE_ANNOUNCE = 2
+# the server answers history pages, see `sync_clip.remote.history`
+FEATURE_HISTORY = 3
+# superseded DATA streams are abandoned half sent with a CANCEL frame
+FEATURE_CANCEL = 4
+# clipboards are stamped with their version, see `sync_clip.remote.versions`
+FEATURE_VERSION = 5
+# clipboards may be offered by format, the formats pasted are fetched
+FEATURE_LAZY = 6
+# file list clipboards are synced with the content of their files
+FEATURE_FILES = 7
+# large uploads are spooled by the server and go on from where it has them
+# after a reconnect, see `sync_clip.remote.resume`
+FEATURE_RESUME = 8
+SUPPORTED_FEATURES = (FEATURE_DELTA, FEATURE_ANNOUNCE, FEATURE_HISTORY,
+                      FEATURE_CANCEL, FEATURE_VERSION, FEATURE_LAZY,
+                      FEATURE_FILES, FEATURE_RESUME)
+
+# released clients and clients naming no channel share the default channel
+DEFAULT_CHANNEL = ""
+MAX_CHANNEL_SIZE = 255
+
+LEGACY_HEADER_SIZE = 10
+MAX_STREAM_SIZE = 1024 * 1024 * 1024
+# the content of a file list is never held in memory, receiving clients
+# apply their own limit
+MAX_FILES_SIZE = 16 * 1024 * 1024 * 1024
+# hard limit of one binary frame payload, negotiated chunk sizes stay below
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+FRAME_MAGIC = 0xC5
+FRAME_VERSION = 1
+# magic, version, type, flags, stream id, payload length, stream total length
+# (decompressed length for compressed streams)
+HEADER = struct.Struct("!BBBBIIQ")
+
+FRAME_DATA = 1
+FRAME_HEARTBEAT = 2
+FRAME_CONCHECK = 3
+FRAME_FETCH = 4
+FRAME_ANNOUNCE = 5
+FRAME_HISTORY = 6
+# no payload, the stream id is the one cancelled
+FRAME_CANCEL = 7
+# version of the DATA, ANNOUNCE, OFFER or FILES stream of its stream id,
+# sent first
+FRAME_STAMP = 8
+FRAME_OFFER = 9
+# the files of a file list clipboard, then their content back to back in
+# FILE frames of its stream id, a frame never spans two files, the stream
+# total is the sum of the file sizes
+FRAME_FILES = 10
+FRAME_FILE = 11
+# a resumable upload, ahead of the DATA frames of its stream id or, of no
+# stream, a question about it, see `ResumeSignal`
+FRAME_RESUME = 12
+
+FLAG_END = 0x01
+FLAG_TEXT = 0x02
+# an answer: a heartbeat echoed back for rtt measurement, a history page, a
+# DATA stream of an offered format fetched, the offset a resume goes on from
+FLAG_ACK = 0x04
+# a DATA stream holding a delta against an earlier payload
+FLAG_DELTA = 0x08
+# compression codec of a DATA stream, CODEC_NONE if not compressed
+FLAG_CODEC_SHIFT = 4
+FLAG_CODEC_MASK = 0x30
+
+# chosen protocol, max chunk size, number of protocols, of codecs and of
+# features, followed by the protocols, codecs, features and the channel
+_CONCHECK = struct.Struct("!BIBBB")
+# sender clock, echoed back in the ack
+_HEARTBEAT = struct.Struct("!d")
+# digest, size
+_ANNOUNCE = struct.Struct("!16sQ")
+# transfer id, offset
+_RESUME = struct.Struct("!16sQ")
+# clock, origin
+_STAMP = struct.Struct("!QQ")
+# digest, size, mime type size, followed by the mime type, per format
+_OFFER_FORMAT = struct.Struct("!16sQB")
+# size, digest (zeros if not hashed), name size, followed by the name, per
+# file
+_FILE_ENTRY = struct.Struct("!Q16sH")
+# before sequence, limit (number of entries in a page)
+_HISTORY = struct.Struct("!QH")
+# sequence, digest, size, is text, time, preview size, followed by the preview
+_HISTORY_ENTRY = struct.Struct("!Q16sQ?dB")
+
+# stamps of streams not finished kept per connection
+MAX_STAMPS = 64
+# DATA streams being received at once per connection
+MAX_OPEN_STREAMS = 16
+# bytes of a DATA stream reserved on its first frame, whatever its total,
+# the buffer grows as the rest arrives
+STREAM_RESERVE_SIZE = 4 * 1024 * 1024
+# buffers grow by blocks of these, never by a temporary the size of the growth
+_ZEROS = bytes(256 * 1024)
+
+# a write making no progress for this long fails, the peer is not reading
+# (a few liveness timeouts)
+WRITE_STALL_TIMEOUT = 30.0
+
+_HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+_HAS_SENDFILE = hasattr(os, "sendfile")
+_IOV_MAX = 512
+# file position of regions read without pread
+_seek_lock = threading.Lock()
+
+FrameHeader = namedtuple(
+    "FrameHeader",
+    ["version", "type", "flags", "stream_id", "length", "total"])
+
+_SIGNAL_FRAME_TYPES = {
+    SyncData: FRAME_DATA,
+    HeartbeatSignal: FRAME_HEARTBEAT,
+    ConCheck: FRAME_CONCHECK,
+    SyncDelta: FRAME_DATA,
+    FetchSignal: FRAME_FETCH,
+    AnnounceSignal: FRAME_ANNOUNCE,
+    HistorySignal: FRAME_HISTORY,
+    CancelSignal: FRAME_CANCEL,
+    StampSignal: FRAME_STAMP,
+    OfferSignal: FRAME_OFFER,
+    FilesSignal: FRAME_FILES,
+    ResumeSignal: FRAME_RESUME,
+}
+
+
+class ProtocolError(Exception):
+    ...
+
+
+def choose_protocol(offered: Iterable[int]) -> int:
+    common = set(offered or ()) & set(SUPPORTED_PROTOCOLS)
+    return max(common) if common else PROTOCOL_LEGACY
+
+
+def choose_features(offered: Iterable[int]) -> List[int]:
+    offered = set(offered or ())
+    return [feature for feature in SUPPORTED_FEATURES if feature in offered]
+
+
+def pack_header(frame_type: int, flags: int, stream_id: int, length: int,
+                total: int) -> bytes:
+    return HEADER.pack(FRAME_MAGIC, FRAME_VERSION, frame_type, flags,
+                       stream_id, length, total)
+
+
+def unpack_header(buffer) -> FrameHeader:
+    magic, version, frame_type, flags, stream_id, length, total = \
+        HEADER.unpack(buffer)
+    if magic != FRAME_MAGIC:
+        raise ProtocolError(f"bad frame magic: {magic:#x}")
+    if version > FRAME_VERSION:
+        raise ProtocolError(f"unsupported frame version: {version}")
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"frame too large: {length}")
+    return FrameHeader(version, frame_type, flags, stream_id, length, total)
+
+
+def encode_frame(frame_type: int, payload=b"", flags=FLAG_END, stream_id=0,
+                 total: int = None) -> bytes:
+    total = len(payload) if total is None else total
+    return pack_header(frame_type, flags, stream_id, len(payload),
+                       total) + payload
+
+
+def flags_codec(flags: int) -> int:
+    return (flags & FLAG_CODEC_MASK) >> FLAG_CODEC_SHIFT
+
+
+def codec_flags(codec_id: int) -> int:
+    return (codec_id << FLAG_CODEC_SHIFT) & FLAG_CODEC_MASK
+
+
+def signal_frame_type(sig: SyncSignal) -> int:
+    frame_type = _SIGNAL_FRAME_TYPES.get(type(sig))
+    if frame_type is None:
+        raise ProtocolError(f"no frame type for signal: {type(sig)}")
+    return frame_type
+
+
+def signal_payload(sig: SyncSignal) -> Tuple[bytes, int]:
+    """
+    :return: raw payload of `sig` and the flags describing it, bytes-like
+        data is returned as is, not copied
+    """
+    if isinstance(sig, ConCheck):
+        codecs = getattr(sig, "codecs", ())
+        features = getattr(sig, "features", ())
+        return _CONCHECK.pack(sig.protocol, getattr(sig, "max_chunk_size", 0),
+                              len(sig.protocols), len(codecs),
+                              len(features)) + bytes(sig.protocols) + bytes(
+            codecs) + bytes(features) + getattr(
+            sig, "channel", DEFAULT_CHANNEL).encode("utf-8"), 0
+    if isinstance(sig, HeartbeatSignal):
+        return (_HEARTBEAT.pack(getattr(sig, "sent_at", 0.0)),
+                FLAG_ACK if getattr(sig, "is_ack", False) else 0)
+    if isinstance(sig, FetchSignal):
+        return sig.digest, 0
+    if isinstance(sig, CancelSignal):
+        return b"", 0
+    if isinstance(sig, StampSignal):
+        return _STAMP.pack(sig.clock, sig.origin), 0
+    if isinstance(sig, ResumeSignal):
+        return (_RESUME.pack(sig.transfer_id, sig.offset),
+                FLAG_ACK if sig.is_answer else 0)
+    if isinstance(sig, AnnounceSignal):
+        return (_ANNOUNCE.pack(sig.digest, sig.size),
+                FLAG_TEXT if sig.is_text else 0)
+    if isinstance(sig, OfferSignal):
+        return b"".join(
+            _OFFER_FORMAT.pack(digest, size, len(mime)) + mime.encode()
+            for mime, digest, size in sig.formats), 0
+    if isinstance(sig, FilesSignal):
+        return b"".join(
+            _FILE_ENTRY.pack(size, digest, len(name.encode("utf-8")))
+            + name.encode("utf-8") for name, size, digest in sig.files), 0
+    if isinstance(sig, HistorySignal):
+        if sig.entries is None:
+            return _HISTORY.pack(sig.before, sig.limit), 0
+        return _HISTORY.pack(sig.before, len(sig.entries)) + b"".join(
+            _HISTORY_ENTRY.pack(seq, digest, size, is_text, at,
+                                len(preview)) + bytes(preview)
+            for seq, digest, size, is_text, at, preview in sig.entries), \
+            FLAG_ACK
+    if isinstance(sig, SyncDelta):
+        return sig.data, FLAG_DELTA | (FLAG_TEXT if sig.is_text else 0)
+    flags = FLAG_ACK if getattr(sig, "is_answer", False) else 0
+    if isinstance(sig.data, str):
+        return sig.data.encode("utf-8"), flags | FLAG_TEXT
+    if isinstance(sig.data, (bytes, bytearray, memoryview)):
+        return sig.data, flags
+    return bytes(sig.data), flags
+
+
+def iter_frames(frame_type: int, payload, flags=0, stream_id=0,
+                chunk_size: Union[int, Callable[[], int]] = None,
+                total: int = None) -> Iterator[List[bytes]]:
+    """
+    Split `payload` into frames, each yielded as ``[header, chunk]`` where
+    chunk is a memoryview slice of the payload, not a copy. The last frame
+    carries `FLAG_END`.
+
+    :param chunk_size: fixed chunk size, or a callable asked before every
+        chunk so the size can adapt during a transfer
+    :param total: announced stream total, the payload size by default
+    """
+    view = memoryview(payload)
+    size_left = view.nbytes
+    total = size_left if total is None else total
+    index = 0
+    while True:
+        size = chunk_size() if callable(chunk_size) else chunk_size
+        chunk = view[index:index + (size or size_left or 1)]
+        index += len(chunk)
+        is_end = index >= size_left
+        yield [pack_header(frame_type, flags | (FLAG_END if is_end else 0),
+                           stream_id, len(chunk), total), chunk]
+        if is_end:
+            break
+
+
+class FileRegion(object):
+    """
+    `count` bytes at `offset` of the open file `fd`, a frame payload sent
+    from the file by `write_frames`, with ``os.sendfile`` where the platform
+    has it: the content never enters the process. `owner` (the file object)
+    keeps the file open while a region of it is queued.
+    """
+
+    def __init__(self, fd: int, offset: int, count: int, owner=None):
+        self.fd = fd
+        self.offset = offset
+        self.count = count
+        self.owner = owner
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index: slice) -> "FileRegion":
+        start, stop, _ = index.indices(self.count)
+        return FileRegion(self.fd, self.offset + start, max(0, stop - start),
+                          self.owner)
+
+    def read(self) -> bytes:
+        if hasattr(os, "pread"):
+            return os.pread(self.fd, self.count, self.offset)
+        with _seek_lock:
+            os.lseek(self.fd, self.offset, os.SEEK_SET)
+            return os.read(self.fd, self.count)
+
+    def send(self, conn: socket.socket):
+        """
+        Write the region to `conn`, a file cut shorter meanwhile is padded
+        with zeros so the frame stays whole (the receiver's digest check
+        rejects it)
+        """
+        if not _HAS_SENDFILE:
+            _write_buffers(conn, [self.read()])
+            return
+        offset, end = self.offset, self.offset + self.count
+        progress = time.monotonic()
+        while offset < end:
+            try:
+                sent = os.sendfile(conn.fileno(), self.fd, offset,
+                                   end - offset)
+            except BlockingIOError:
+                _check_stall(progress)
+                # a socket with a timeout is non blocking underneath
+                select.select([], [conn], [], conn.gettimeout())
+                continue
+            if not sent:
+                _write_buffers(conn, [bytes(end - offset)])
+                return
+            offset += sent
+            progress = time.monotonic()
+
+
+def split_frame(header_bytes: bytes, payload,
+                size: int) -> List[List[bytes]]:
+    """
+    A received frame cut into frames of `size` payload bytes at most, as
+    ``[header, chunk]`` lists, only the last one keeps `FLAG_END`. Chunks
+    are views of `payload` (regions of a `FileRegion`), a frame not larger
+    is returned as is.
+    """
+    if len(payload) <= size:
+        return [[header_bytes, payload]]
+    header = unpack_header(header_bytes)
+    view = (payload if isinstance(payload, FileRegion)
+            else memoryview(payload).cast("B"))
+    frames = []
+    for start in range(0, len(view), size):
+        chunk = view[start:start + size]
+        flags = header.flags
+        if start + size < len(view):
+            flags &= ~FLAG_END
+        frames.append([pack_header(header.type, flags, header.stream_id,
+                                   len(chunk), header.total), chunk])
+    return frames
+
+
+def iter_signal_frames(sig: SyncSignal, stream_id=0,
+                       chunk_size: Union[int, Callable[[], int]] = None,
+                       codecs: Sequence[int] = ()) -> Iterator[List[bytes]]:
+    """
+    `iter_frames` of `sig`, DATA payloads compressed with the first of
+    `codecs` when worth it
+    """
+    payload, flags = signal_payload(sig)
+    total = len(payload)
+    if isinstance(sig, (CancelSignal, StampSignal, ResumeSignal)):
+        stream_id = sig.stream_id
+    if isinstance(sig, (SyncData, SyncDelta)):
+        payload, codec_id = compress_payload(payload, codecs)
+        flags |= codec_flags(codec_id)
+    yield from iter_frames(signal_frame_type(sig), payload, flags, stream_id,
+                           chunk_size, total)
+
+
+def encode_signal(sig: SyncSignal, stream_id=0, chunk_size: int = None,
+                  codecs: Sequence[int] = ()) -> List[bytes]:
+    """
+    Encode `sig` as binary frames of `chunk_size` payload bytes
+
+    :return: header and payload buffers of every frame, to be written back
+        to back
+    """
+    buffers = []
+    for frame in iter_signal_frames(sig, stream_id, chunk_size, codecs):
+        buffers.extend(frame)
+    return buffers
+
+
+def decode_signal(header: FrameHeader, payload) -> SyncSignal:
+    if header.type == FRAME_DATA:
+        if header.flags & FLAG_DELTA:
+            return SyncDelta(payload, is_text=bool(header.flags & FLAG_TEXT))
+        is_answer = bool(header.flags & FLAG_ACK)
+        if header.flags & FLAG_TEXT:
+            return SyncData(str(payload, "utf-8"), is_answer)
+        return SyncData(payload, is_answer)
+    if header.type == FRAME_HEARTBEAT:
+        sent_at = 0.0
+        if len(payload) >= _HEARTBEAT.size:
+            sent_at, = _HEARTBEAT.unpack_from(payload)
+        return HeartbeatSignal(sent_at=sent_at,
+                               is_ack=bool(header.flags & FLAG_ACK))
+    if header.type == FRAME_CONCHECK:
+        payload = bytes(payload)
+        protocol, max_chunk_size, n_protocols, n_codecs, n_features = \
+            _CONCHECK.unpack_from(payload)
+        codecs_start = _CONCHECK.size + n_protocols
+        features_start = codecs_start + n_codecs
+        channel_start = features_start + n_features
+        return ConCheck(protocols=payload[_CONCHECK.size:codecs_start],
+                        protocol=protocol, max_chunk_size=max_chunk_size,
+                        codecs=payload[codecs_start:features_start],
+                        features=payload[features_start:channel_start],
+                        channel=str(payload[channel_start:], "utf-8"))
+    if header.type == FRAME_FETCH:
+        return FetchSignal(bytes(payload))
+    if header.type == FRAME_CANCEL:
+        return CancelSignal(header.stream_id)
+    if header.type == FRAME_STAMP:
+        clock, origin = _STAMP.unpack_from(payload)
+        return StampSignal(header.stream_id, clock, origin)
+    if header.type == FRAME_RESUME:
+        transfer_id, offset = _RESUME.unpack_from(payload)
+        return ResumeSignal(header.stream_id, transfer_id, offset,
+                            is_answer=bool(header.flags & FLAG_ACK))
+    if header.type == FRAME_ANNOUNCE:
+        digest, size = _ANNOUNCE.unpack_from(payload)
+        return AnnounceSignal(digest, size,
+                              is_text=bool(header.flags & FLAG_TEXT))
+    if header.type == FRAME_OFFER:
+        payload, formats, index = bytes(payload), [], 0
+        while index < len(payload):
+            digest, size, mime_size = _OFFER_FORMAT.unpack_from(payload,
+                                                                index)
+            index += _OFFER_FORMAT.size
+            formats.append((str(payload[index:index + mime_size], "utf-8"),
+                            digest, size))
+            index += mime_size
+        return OfferSignal(formats)
+    if header.type == FRAME_FILES:
+        payload, files, index = bytes(payload), [], 0
+        while index < len(payload):
+            size, digest, name_size = _FILE_ENTRY.unpack_from(payload, index)
+            index += _FILE_ENTRY.size
+            name = str(payload[index:index + name_size], "utf-8")
+            index += name_size
+            # written in the receiver's cache, a bare file name only
+            if (name in ("", ".", "..") or "/" in name or "\\" in name
+                    or "\0" in name):
+                raise ProtocolError(f"bad file name: {name!r:.80}")
+            files.append((name, size, digest))
+        return FilesSignal(files)
+    if header.type == FRAME_HISTORY:
+        payload = bytes(payload)
+        before, count = _HISTORY.unpack_from(payload)
+        if not header.flags & FLAG_ACK:
+            return HistorySignal(before, count)
+        entries, index = [], _HISTORY.size
+        for _ in range(count):
+            seq, digest, size, is_text, at, preview_size = \
+                _HISTORY_ENTRY.unpack_from(payload, index)
+            index += _HISTORY_ENTRY.size
+            entries.append((seq, digest, size, is_text, at,
+                            payload[index:index + preview_size]))
+            index += preview_size
+        return HistorySignal(before, count, entries)
+    raise ProtocolError(f"unknown frame type: {header.type}")
+
+
+def encode_legacy(sig: SyncSignal) -> bytes:
+    if isinstance(sig.data, (bytearray, memoryview)):
+        # released clients only know str and bytes payloads
+        sig = copy.copy(sig)
+        sig.data = bytes(sig.data)
+    p_sig_data = pickle.dumps(sig)
+    header = f"{len(p_sig_data)}".zfill(LEGACY_HEADER_SIZE)
+    return header.encode() + p_sig_data
+
+
+def parse_legacy_header(header) -> int:
+    """
+    Pickle size of a legacy frame from its ASCII digits header
+    """
+    try:
+        size = int(bytes(header).decode("ascii"))
+    except ValueError:
+        raise ProtocolError(f"bad legacy header: {bytes(header)!r}")
+    if not 0 <= size <= MAX_FRAME_SIZE:
+        raise ProtocolError(f"legacy frame too large: {size}")
+    return size
+
+
+def write_frames(conn: socket.socket, frames: Sequence[bytes]):
+    """
+    Write every byte of `frames`, gathered with `sendmsg` where available,
+    a `FileRegion` is sent from its file. Unlike `sendall`, a socket timeout
+    never leaves half a frame behind, the remaining bytes are retried, until
+    none went for `WRITE_STALL_TIMEOUT` seconds
+
+    :raise socket.timeout: once stalled
+    """
+    start = 0
+    for index, frame in enumerate(frames):
+        if isinstance(frame, FileRegion):
+            _write_buffers(conn, frames[start:index])
+            frame.send(conn)
+            start = index + 1
+    _write_buffers(conn, frames[start:] if start else frames)
+
+
+def _check_stall(progress: float):
+    if time.monotonic() - progress > WRITE_STALL_TIMEOUT:
+        raise socket.timeout(f"nothing written for {WRITE_STALL_TIMEOUT} s")
+
+
+def _write_buffers(conn: socket.socket, frames: Sequence[bytes]):
+    views = [memoryview(frame).cast("B") for frame in frames if len(frame)]
+    progress = time.monotonic()
+    while views:
+        try:
+            if _HAS_SENDMSG:
+                sent = conn.sendmsg(views[:_IOV_MAX])
+            else:
+                sent = conn.send(views[0])
+        except socket.timeout:
+            _check_stall(progress)
+            continue
+        progress = time.monotonic()
+        while sent:
+            if sent >= len(views[0]):
+                sent -= len(views.pop(0))
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
+
+class SafeUnpickler(pickle.Unpickler):
+    """
+    Only allows the signal classes, legacy frames come from untrusted peers
+    """
+
+    def find_class(self, module, name):
+        if module == sync_signal.__name__:
+            cls = getattr(sync_signal, name, None)
+            if isinstance(cls, type) and issubclass(cls, SyncSignal):
+                return cls
+        raise pickle.UnpicklingError(f"forbidden global: {module}.{name}")
+
+
+def decode_legacy(payload) -> SyncSignal:
+    sig = SafeUnpickler(io.BytesIO(payload)).load()
+    if not isinstance(sig, SyncSignal):
+        raise ProtocolError(f"not a sync signal: {type(sig)}")
+    return sig
+
+
+def _grow(buffer: bytearray, size: int):
+    while len(buffer) < size:
+        buffer += _ZEROS[:size - len(buffer)]
+
+
+class SignalAssembler(object):
+    """
+    Rebuild complete signals out of the chunk frames of one connection.
+
+    The payload of a DATA stream is received straight into one buffer:
+    callers ask `payload_buffer` where the next frame payload goes, fill it,
+    then call `frame_done`. The ``total`` of the first frame is untrusted,
+    only up to `STREAM_RESERVE_SIZE` is reserved, the buffer grows as frames
+    arrive; a connection has at most `MAX_OPEN_STREAMS` streams open.
+    Compressed frames land in a scratch buffer and are decompressed into
+    place one by one. The finished buffer becomes ``SyncData.data`` as is.
+
+    The content of a file list goes to the receiver `receive_files` makes
+    of its stamped `FilesSignal` (see `sync_clip.remote.files`), which gives
+    the buffers FILE frames are received into and the `FilesSignal` of the
+    files written, or None if they were not kept.
+    """
+
+    def __init__(self, receive_files: Callable[[FilesSignal], Any] = None):
+        # stream id -> [buffer, received bytes, decompressor or None, total]
+        self._streams: Dict[int, list] = {}
+        self.receive_files = receive_files
+        # stream id -> receiver of the files of a file list
+        self._files: Dict[int, Any] = {}
+        # stream id -> StampSignal of the stream
+        self._stamps: Dict[int, StampSignal] = {}
+        self._legacy: Optional[SyncSignal] = None
+        self._legacy_parts: list = []
+
+    def payload_buffer(self, header: FrameHeader) -> memoryview:
+        if header.type == FRAME_FILE:
+            receiver = self._files.get(header.stream_id)
+            if receiver is None:
+                raise ProtocolError(f"file data of unknown stream "
+                                    f"{header.stream_id}")
+            return receiver.buffer(header.length)
+        if header.type != FRAME_DATA:
+            return memoryview(bytearray(header.length))
+        stream = self._streams.get(header.stream_id)
+        if stream is None:
+            if header.total > MAX_STREAM_SIZE:
+                raise ProtocolError(f"stream too large: {header.total}")
+            if len(self._streams) >= MAX_OPEN_STREAMS:
+                raise ProtocolError(f"more than {MAX_OPEN_STREAMS} streams "
+                                    f"open")
+            buffer = bytearray(min(header.total, STREAM_RESERVE_SIZE))
+            codec_id = flags_codec(header.flags)
+            stream = self._streams[header.stream_id] = [
+                buffer, 0,
+                Decompressor(codec_id, buffer, header.total)
+                if codec_id else None, header.total]
+        buffer, received, decompressor, total = stream
+        # compressed streams are only sent when smaller than their total
+        if received + header.length > total:
+            self._streams.pop(header.stream_id)
+            raise ProtocolError(f"stream {header.stream_id} overflows its "
+                                f"total: {total}")
+        if decompressor is not None:
+            return memoryview(bytearray(header.length))
+        end = received + header.length
+        if end > len(buffer):
+            # doubled, so a large stream is only moved a few times
+            _grow(buffer, min(total, max(end, 2 * len(buffer))))
+        return memoryview(buffer)[received:end]
+
+    def frame_done(self, header: FrameHeader,
+                   payload: memoryview) -> Optional[SyncSignal]:
+        if header.type == FRAME_CANCEL:
+            self._streams.pop(header.stream_id, None)
+            self._stamps.pop(header.stream_id, None)
+            receiver = self._files.pop(header.stream_id, None)
+            if receiver is not None:
+                receiver.abort()
+        if header.type in (FRAME_FILES, FRAME_FILE):
+            return self._files_frame_done(header, payload)
+        if header.type == FRAME_STAMP:
+            self._stamps[header.stream_id] = decode_signal(header, payload)
+            while len(self._stamps) > MAX_STAMPS:
+                self._stamps.pop(next(iter(self._stamps)))
+            return None
+        if header.type != FRAME_DATA:
+            return self._stamped(header, decode_signal(header, payload))
+        stream = self._streams[header.stream_id]
+        stream[1] += header.length
+        decompressor = stream[2]
+        try:
+            if decompressor is not None:
+                decompressor.feed(payload)
+            if not header.flags & FLAG_END:
+                return None
+            buffer, received, _, total = self._streams.pop(header.stream_id)
+            if decompressor is not None:
+                buffer = decompressor.finish()
+            elif received != total:
+                raise ProtocolError(f"stream {header.stream_id} ended at "
+                                    f"{received} of {total}")
+        except CompressionError as exp:
+            self._streams.pop(header.stream_id, None)
+            raise ProtocolError(f"stream {header.stream_id}: {exp}")
+        return self._stamped(header, decode_signal(header, buffer))
+
+    def _files_frame_done(self, header: FrameHeader,
+                          payload: memoryview) -> Optional[FilesSignal]:
+        if header.type == FRAME_FILES:
+            if self.receive_files is None:
+                raise ProtocolError("file lists are not taken")
+            if header.stream_id in self._files:
+                raise ProtocolError(f"stream {header.stream_id} has a file "
+                                    f"list already")
+            sig = self._stamped(header, decode_signal(header, payload))
+            self._files[header.stream_id] = self.receive_files(sig)
+            return None
+        self._files[header.stream_id].write(payload)
+        if not header.flags & FLAG_END:
+            return None
+        return self._files.pop(header.stream_id).finish()
+
+    def _stamped(self, header: FrameHeader, sig: SyncSignal) -> SyncSignal:
+        if header.type in (FRAME_DATA, FRAME_ANNOUNCE, FRAME_OFFER,
+                           FRAME_FILES):
+            stamp = self._stamps.pop(header.stream_id, None)
+            if stamp is not None:
+                sig.clock, sig.origin = stamp.clock, stamp.origin
+        return sig
+
+    def feed(self, header: Optional[FrameHeader],
+             payload) -> Optional[SyncSignal]:
+        """
+        Feed an already received frame, `payload` is copied once into place
+        """
+        if header is None:
+            return self.feed_legacy(payload)
+        buffer = self.payload_buffer(header)
+        buffer[:] = payload
+        return self.frame_done(header, buffer)
+
+    def feed_legacy(self, payload) -> Optional[SyncSignal]:
+        sig = decode_legacy(payload)
+        if self._legacy is None:
+            if sig.is_end:
+                return sig
+            self._legacy = sig
+            self._legacy_parts = [sig.data]
+            return None
+        if not isinstance(sig, type(self._legacy)):
+            raise ProtocolError("received different type sig !!!")
+        self._legacy_parts.append(sig.data)
+        if not sig.is_end:
+            return None
+        sig, self._legacy = self._legacy, None
+        sig.data = sig.data[:0].join(self._legacy_parts)
+        sig.is_end = True
+        self._legacy_parts = []
+        return sig
+
+
+class SignalReader(object):
+    """
+    Read signals of either framing from a blocking socket, payloads are
+    received with `recv_into` into the assembler's buffers
+    """
+
+    def __init__(self, conn: socket.socket,
+                 receive_files: Callable[[FilesSignal], Any] = None):
+        self.conn = conn
+        self.assembler = SignalAssembler(receive_files)
+        self._header = bytearray(HEADER.size)
+
+    def recv_into_exact(self, view: memoryview):
+        """
+        Fill `view`, timeouts inside a frame are retried so a slow peer can
+        not desync the stream
+        """
+        while view:
+            try:
+                received = self.conn.recv_into(view)
+            except socket.timeout:
+                continue
+            if not received:
+                raise ConnectionResetError()
+            view = view[received:]
+
+    def read_header(self) -> Tuple[Optional[FrameHeader], int]:
+        """
+        The socket timeout only applies while waiting for the first byte
+
+        :return: (header, 0) of a binary frame or (None, pickle size) of a
+            legacy frame
+        """
+        view = memoryview(self._header)
+        if not self.conn.recv_into(view[:1]):
+            raise ConnectionResetError()
+        if self._header[0] == FRAME_MAGIC:
+            self.recv_into_exact(view[1:])
+            return unpack_header(self._header), 0
+        self.recv_into_exact(view[1:LEGACY_HEADER_SIZE])
+        return None, parse_legacy_header(self._header[:LEGACY_HEADER_SIZE])
+
+    def read_frame(self) -> Tuple[Optional[FrameHeader], Optional[bytes],
+                                  bytearray]:
+        """
+        Read one frame as is, its payload received into a fresh buffer
+
+        :return: (header, header bytes, payload) of a binary frame or
+            (None, None, pickled signal) of a legacy frame
+        """
+        header, legacy_size = self.read_header()
+        payload = bytearray(legacy_size if header is None else header.length)
+        self.recv_into_exact(memoryview(payload))
+        if header is None:
+            return None, None, payload
+        return header, bytes(self._header), payload
+
+    def read_signal(self) -> Optional[SyncSignal]:
+        """
+        Read one frame
+
+        :return: the completed signal, None if the frame was a partial chunk
+        """
+        header, legacy_size = self.read_header()
+        if header is None:
+            payload = bytearray(legacy_size)
+            self.recv_into_exact(memoryview(payload))
+            return self.assembler.feed_legacy(payload)
+        buffer = self.assembler.payload_buffer(header)
+        self.recv_into_exact(buffer)
+        return self.assembler.frame_done(header, buffer)
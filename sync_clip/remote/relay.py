@@ -0,0 +1,306 @@
+import os
+import tempfile
+import threading
+from typing import *
+
+from sync_clip.stuff.sync_signal import *
+from sync_clip.remote.protocol import *
+from sync_clip.remote.delta import *
+from sync_clip.remote.versions import *
+from sync_clip.utils.util_hash import hash_data
+
+
+class RelayMessage(object):
+    """
+    One clipboard update passing through the server.
+
+    Binary frames are kept exactly as received (header bytes + payload
+    buffer) and shared by every recipient's writer, which forwards them as
+    soon as they arrive without decoding. Legacy recipients get one pickle
+    frame built once when the message is complete, binary recipients without
+    the message's compression codec (or delta support) get plain frames
+    built once too. A delta is resolved against an earlier payload found by
+    `find_base`. `on_complete` runs before anyone is told about the last
+    frame.
+    """
+
+    def __init__(self, origin: tuple, total: int, flags: int = 0,
+                 find_base: Callable[[bytes], Optional[bytes]] = None,
+                 on_complete: Callable[["RelayMessage"], None] = None,
+                 channel: str = DEFAULT_CHANNEL):
+        self.origin = origin
+        # only the peers of the origin's channel get the message
+        self.channel = channel
+        self.total = total
+        self.flags = flags
+        self.stream_id = 0
+        # the clipboard's version, see `sync_clip.remote.versions`
+        self.version: Version = UNVERSIONED
+        # header, payload, header, payload, ... (an empty payload too), so
+        # writers can cut them at frame boundaries
+        self.buffers: List[bytes] = []
+        self._payloads: List[bytes] = []
+        self.received = 0
+        self.is_complete = False
+        self.is_aborted = False
+        self._cond = threading.Condition(threading.Lock())
+        self._listeners: List[Callable[[], None]] = []
+        self.find_base = find_base
+        self.on_complete = on_complete
+        self._resolve_lock = threading.Lock()
+        self._full_payload: Optional[bytes] = None
+        self._digest: Optional[bytes] = None
+        self._signal: Optional[SyncData] = None
+        self._legacy_frame: Optional[bytes] = None
+        self._plain_buffers: Optional[List[bytes]] = None
+
+    @classmethod
+    def from_signal(cls, sig: SyncData, origin: tuple, stream_id: int,
+                    chunk_size: int,
+                    channel: str = DEFAULT_CHANNEL) -> "RelayMessage":
+        payload, flags = signal_payload(sig)
+        message = cls.from_payload(payload, flags, origin, stream_id,
+                                   chunk_size, channel=channel)
+        message._signal = sig
+        return message
+
+    @classmethod
+    def from_payload(cls, payload: bytes, flags: int, origin: tuple,
+                     stream_id: int, chunk_size: int,
+                     digest: bytes = None,
+                     channel: str = DEFAULT_CHANNEL) -> "RelayMessage":
+        """
+        A complete message of a payload the server has, frames are views
+        of it
+        """
+        message = cls(origin, len(payload), flags, channel=channel)
+        message.stream_id = stream_id
+        for frame in iter_frames(FRAME_DATA, payload, flags, stream_id,
+                                 chunk_size):
+            message.buffers.extend(frame)
+        message.is_complete = True
+        message._full_payload = bytes(payload)
+        message._digest = digest
+        return message
+
+    @property
+    def is_done(self) -> bool:
+        return self.is_complete or self.is_aborted
+
+    @property
+    def codec(self) -> int:
+        return flags_codec(self.flags)
+
+    @property
+    def is_delta(self) -> bool:
+        return bool(self.flags & FLAG_DELTA)
+
+    def can_forward(self, codecs: Sequence[int],
+                    features: Sequence[int]) -> bool:
+        """
+        Whether a binary recipient of `codecs` and `features` can take the
+        frames as is
+        """
+        return ((self.codec == CODEC_NONE or self.codec in codecs)
+                and (not self.is_delta or FEATURE_DELTA in features))
+
+    def add_listener(self, listener: Callable[[], None]):
+        self._listeners.append(listener)
+
+    def _notify(self):
+        self._cond.notify_all()
+        for listener in self._listeners:
+            listener()
+
+    def append(self, header: FrameHeader, header_bytes: bytes, payload):
+        is_end = bool(header.flags & FLAG_END)
+        with self._cond:
+            if self.received + header.length > self.total:
+                raise ProtocolError(f"stream {header.stream_id} overflows its"
+                                    f" total: {self.total}")
+            if not self.buffers:
+                self.stream_id = header.stream_id
+            if header.length:
+                self._payloads.append(payload)
+            self.received += header.length
+            self.flags = header.flags
+        if is_end and self.on_complete is not None:
+            # outside the lock, the last frame is not visible to writers yet
+            self.on_complete(self)
+        with self._cond:
+            self.buffers.append(header_bytes)
+            self.buffers.append(payload)
+            self.is_complete = is_end
+            self._notify()
+
+    def abort(self):
+        with self._cond:
+            if not self.is_complete:
+                self.is_aborted = True
+                self._notify()
+
+    def wait_buffers(self, index: int,
+                     timeout: float = None) -> Tuple[List[bytes], bool]:
+        """
+        Block until buffers past `index` arrive or the message is done
+
+        :return: the new buffers and whether the message is done
+        """
+        with self._cond:
+            if index >= len(self.buffers) and not self.is_done:
+                self._cond.wait(timeout)
+            return self.buffers[index:], self.is_done
+
+    def wait_done(self, timeout: float = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.is_done, timeout)
+
+    def payload(self) -> bytes:
+        """
+        The stream payload as sent, decompressed, i.e. the delta of a delta
+        """
+        payload = b"".join(self._payloads)
+        if self.codec != CODEC_NONE:
+            try:
+                payload = bytes(decompress_payload(payload, self.codec,
+                                                   self.total))
+            except CompressionError as exp:
+                raise ProtocolError(f"stream {self.stream_id}: {exp}")
+        return payload
+
+    def full_payload(self) -> Optional[bytes]:
+        """
+        The complete clipboard payload, a delta rebuilt from its base
+
+        :return: None if the base of a delta is not found or does not fit
+        """
+        with self._resolve_lock:
+            if self._full_payload is None:
+                if not self.is_delta:
+                    self._full_payload = self.payload()
+                else:
+                    self._full_payload = self._apply_delta(self.payload())
+            return self._full_payload
+
+    def _apply_delta(self, delta: bytes) -> Optional[bytes]:
+        base_digest, self._digest, _ = delta_digests(delta)
+        base_payload = self.find_base(base_digest) if self.find_base else None
+        if base_payload is None:
+            return None
+        try:
+            return bytes(apply_delta(base_payload, delta))
+        except DeltaError as exp:
+            raise ProtocolError(f"stream {self.stream_id}: {exp}")
+
+    @property
+    def known_digest(self) -> Optional[bytes]:
+        """
+        The digest if known without hashing
+        """
+        return self._digest
+
+    def digest(self) -> bytes:
+        """
+        `hash_data` of the full payload, read from the header of a delta
+        """
+        if self._digest is None:
+            if self.is_delta:
+                self._digest = delta_digests(self.payload())[1]
+            else:
+                self._digest = hash_data(self.full_payload())
+        return self._digest
+
+    def signal(self) -> Optional[SyncData]:
+        if self._signal is None:
+            payload = self.full_payload()
+            if payload is None:
+                return None
+            if self.flags & FLAG_TEXT:
+                payload = payload.decode("utf-8")
+            self._signal = SyncData(payload)
+        return self._signal
+
+    def legacy_frame(self) -> Optional[bytes]:
+        """
+        The pickle frame for legacy recipients, built once
+        """
+        with self._cond:
+            if self._legacy_frame is None:
+                sig = self.signal()
+                if sig is None:
+                    return None
+                self._legacy_frame = encode_legacy(sig)
+            return self._legacy_frame
+
+    def plain_buffers(self, chunk_size: int) -> Optional[List[bytes]]:
+        """
+        Plain binary frames of the full payload for recipients lacking the
+        codec or delta support, built once
+        """
+        with self._cond:
+            if self._plain_buffers is None:
+                sig = self.signal()
+                if sig is None:
+                    return None
+                payload, flags = signal_payload(sig)
+                self._plain_buffers = []
+                for frame in iter_frames(FRAME_DATA, payload, flags,
+                                         self.stream_id, chunk_size):
+                    self._plain_buffers.extend(frame)
+            return self._plain_buffers
+
+
+class FileRelay(RelayMessage):
+    """
+    A file list clipboard passing through the server: its FILES frame, then
+    FILE frames whose payloads are spooled to an unlinked file in
+    `spool_dir` and forwarded as `FileRegion`s of it, sent with sendfile.
+    The content never stays in memory, the spool goes once the message and
+    the frames queued are done with. Only peers taking file lists get it,
+    nothing of it is kept in the history.
+    """
+
+    def __init__(self, origin: tuple, files: FilesSignal, spool_dir: str,
+                 channel: str = DEFAULT_CHANNEL):
+        super().__init__(origin, sum(size for _, size, _ in files.files),
+                         channel=channel)
+        self.files = files
+        self._spool = tempfile.TemporaryFile(dir=spool_dir)
+        self._spool_lock = threading.Lock()
+
+    def can_forward(self, codecs: Sequence[int],
+                    features: Sequence[int]) -> bool:
+        return FEATURE_FILES in features
+
+    def _spool_write(self, payload, offset: int):
+        fd = self._spool.fileno()
+        view = memoryview(payload)
+        while view:
+            if hasattr(os, "pwrite"):
+                written = os.pwrite(fd, view, offset)
+            else:
+                with self._spool_lock:
+                    os.lseek(fd, offset, os.SEEK_SET)
+                    written = os.write(fd, view)
+            view, offset = view[written:], offset + written
+
+    def append(self, header: FrameHeader, header_bytes: bytes, payload):
+        with self._cond:
+            if header.type == FRAME_FILES:
+                self.stream_id = header.stream_id
+            else:
+                if self.received + header.length > self.total:
+                    raise ProtocolError(f"stream {header.stream_id} "
+                                        f"overflows its total: {self.total}")
+                offset = self.received
+                self.received += header.length
+        if header.type == FRAME_FILE:
+            self._spool_write(payload, offset)
+            payload = FileRegion(self._spool.fileno(), offset, header.length,
+                                 self._spool)
+        with self._cond:
+            self.buffers.append(header_bytes)
+            self.buffers.append(payload)
+            self.is_complete = (header.type == FRAME_FILE
+                                and bool(header.flags & FLAG_END))
+            self._notify()
@@ -0,0 +1,211 @@
+"""
+Surviving a dropped connection.
+
+A clipboard of at least ``RESUME_MIN_SIZE`` bytes is sent as a resumable
+upload: a RESUME frame names the transfer ahead of its DATA frames, the
+server appends the frames to a spool file named after it as they arrive.
+The sender keeps the payload as put on the wire (`Upload`) until it is sent
+whole. After a reconnect it asks the server how much of the transfer it
+holds, whole frames only, and sends the rest. The server
+relays the spooled frames again, then the new ones: a server restarted on
+the same spool directory resumes as well.
+
+Clients reconnect after a `Backoff` delay, clipboards copied meanwhile wait
+in the client's outbox, the latest one is sent once connected.
+"""
+import os
+import time
+import random
+import logging
+import threading
+from typing import *
+
+from sync_clip.stuff.sync_signal import *
+from sync_clip.remote.protocol import *
+
+logger = logging.getLogger("sync_clip")
+
+# smaller uploads are sent again whole
+RESUME_MIN_SIZE = 1024 * 1024
+TRANSFER_ID_SIZE = 16
+# spools of uploads never finished are removed after an hour
+UPLOAD_PREFIX = "upload-"
+UPLOAD_MAX_AGE = 3600
+
+
+class Upload(object):
+    """
+    A clipboard sent as a resumable upload: its `payload` (and the `flags`
+    describing it, see `signal_payload`) compressed with the first of
+    `codecs` when worth it, as put on the wire
+    """
+
+    def __init__(self, payload, flags: int, codecs: Sequence[int] = ()):
+        self.total = len(payload)
+        payload, codec_id = compress_payload(payload, codecs)
+        self.flags = flags | codec_flags(codec_id)
+        self.payload = payload
+        self.transfer_id = os.urandom(TRANSFER_ID_SIZE)
+
+    def fits(self, codecs: Sequence[int]) -> bool:
+        """
+        Whether a connection of `codecs` takes the payload as it is
+        """
+        codec_id = flags_codec(self.flags)
+        return codec_id == CODEC_NONE or codec_id in codecs
+
+    def frames(self, stream_id: int, offset: int,
+               chunk_size: Union[int, Callable[[], int]]
+               ) -> Iterator[List[bytes]]:
+        """
+        The RESUME frame, then the DATA frames of the payload past `offset`,
+        none if the server has it all
+        """
+        yield encode_signal(ResumeSignal(stream_id, self.transfer_id, offset))
+        if offset < len(self.payload):
+            yield from iter_frames(FRAME_DATA,
+                                   memoryview(self.payload)[offset:],
+                                   self.flags, stream_id, chunk_size,
+                                   self.total)
+
+
+def _iter_spooled(file, size: int, read_payloads=False
+                  ) -> Iterator[Tuple[int, bytes, FrameHeader, bytes]]:
+    """
+    (position, header bytes, header, payload) of the whole frames of a spool
+    file of `size` bytes, payloads are only read if asked for
+    """
+    position = 0
+    while position + HEADER.size <= size:
+        file.seek(position)
+        header_bytes = file.read(HEADER.size)
+        try:
+            header = unpack_header(header_bytes)
+        except ProtocolError:
+            return
+        end = position + HEADER.size + header.length
+        if end > size:
+            # cut by a crash in the middle of the frame
+            return
+        yield (position, header_bytes, header,
+               file.read(header.length) if read_payloads else b"")
+        position = end
+
+
+class UploadSpool(object):
+    """
+    The frames of resumable upload `transfer_id` as received, appended to a
+    file of `spool_dir` named after it. Every frame is written through to
+    the file, a server killed keeps them. A spool closed meanwhile (its
+    peer dropped by another thread) takes no more frames.
+    """
+
+    def __init__(self, spool_dir: str, transfer_id: bytes):
+        self.path = os.path.join(spool_dir,
+                                 f"{UPLOAD_PREFIX}{transfer_id.hex()}")
+        self._file = None
+        self._lock = threading.Lock()
+
+    def held(self) -> int:
+        """
+        Payload bytes of the whole frames spooled, 0 if none
+        """
+        try:
+            with open(self.path, "rb") as file:
+                return sum(header.length for _, _, header, _ in _iter_spooled(
+                    file, os.fstat(file.fileno()).st_size))
+        except FileNotFoundError:
+            return 0
+
+    def open(self, offset: int) -> List[Tuple[bytes, bytes]]:
+        """
+        Go on spooling the upload from `offset` payload bytes, a frame
+        boundary of the spool (0 starts it over)
+
+        :return: (header bytes, payload) of the frames spooled before
+            `offset`, to be relayed again
+        :raise ProtocolError: if the spool does not hold `offset` bytes
+        """
+        frames, held, end = [], 0, 0
+        if offset:
+            try:
+                with open(self.path, "rb") as file:
+                    for position, header_bytes, header, payload in \
+                            _iter_spooled(file,
+                                          os.fstat(file.fileno()).st_size,
+                                          read_payloads=True):
+                        if held >= offset:
+                            break
+                        frames.append((header_bytes, payload))
+                        held += header.length
+                        end = position + HEADER.size + header.length
+            except FileNotFoundError:
+                pass
+            if held != offset:
+                raise ProtocolError(f"upload spool holds {held} bytes, not "
+                                    f"{offset}")
+        self._file = open(self.path, "r+b" if offset else "wb")
+        self._file.truncate(end)
+        self._file.seek(end)
+        return frames
+
+    def write(self, header_bytes: bytes, payload):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(header_bytes)
+            self._file.write(payload)
+            self._file.flush()
+
+    def close(self):
+        """
+        Keep the spool for the upload to go on later
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def prune_uploads(spool_dir: str, max_age=UPLOAD_MAX_AGE):
+    """
+    Remove the spools of uploads not resumed for `max_age` seconds
+    """
+    now = time.time()
+    for entry in os.scandir(spool_dir):
+        if (entry.name.startswith(UPLOAD_PREFIX)
+                and now - entry.stat().st_mtime > max_age):
+            logger.debug(f"removing upload spool {entry.path}")
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+class Backoff(object):
+    """
+    Delays between reconnection attempts: exponential from `base` up to
+    `cap` seconds, with full jitter so clients dropped together do not
+    come back in step
+    """
+
+    def __init__(self, base=0.5, cap=30.0, rand: random.Random = None):
+        self.base = base
+        self.cap = cap
+        self.attempts = 0
+        self._random = rand or random.Random()
+
+    def next_delay(self) -> float:
+        ceiling = min(self.cap, self.base * 2 ** min(self.attempts, 32))
+        self.attempts += 1
+        return self._random.uniform(0, ceiling)
+
+    def reset(self):
+        self.attempts = 0
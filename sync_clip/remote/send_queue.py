@@ -0,0 +1,178 @@
+import threading
+from collections import deque
+from typing import *
+
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_LATEST_WINS = "latest-wins"
+OVERFLOW_DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_LATEST_WINS,
+                     OVERFLOW_DISCONNECT)
+
+
+class QueueOverflow(Exception):
+    ...
+
+
+class SendQueue(object):
+    """
+    Bounded outbound queue of one connection, drained by its own writer.
+
+    Each item is one whole message (a list of frames or a relayed message
+    object) with its size in bytes, so an overflow never drops half a
+    message. When `max_items` or `max_bytes` would be exceeded
+    the `policy` decides:
+
+    * drop-oldest:  drop queued messages from the head until the new fits
+    * latest-wins:  drop every queued message, only the new one is kept
+    * disconnect:   raise `QueueOverflow`, the caller closes the connection
+
+    Urgent items (small control frames: heartbeat acks, fetch requests,
+    history pages) go in their own lane ahead of the others, writers also
+    take them between the frames of a large message. The lane holds
+    `max_items` of them: past that the peer is not reading, the disconnect
+    policy raises `QueueOverflow`, the others drop the oldest urgent item
+    and count it like any dropped message.
+    """
+
+    def __init__(self, max_items=32, max_bytes=64 * 1024 * 1024,
+                 policy=OVERFLOW_DROP_OLDEST,
+                 on_ready: Callable[[], None] = None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"invalid overflow policy: {policy}, "
+                             f"choose from {OVERFLOW_POLICIES}")
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.on_ready = on_ready
+        self.is_closed = False
+        self._items: Deque[Tuple[Any, int]] = deque()
+        self._urgent: Deque[Tuple[Any, int]] = deque()
+        self._bytes = 0
+        self._ready = threading.Condition(threading.Lock())
+        # counters
+        self.max_depth = 0
+        self.sent = 0
+        self.dropped = 0
+        self.dropped_bytes = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._items) + len(self._urgent)
+
+    @property
+    def depth_bytes(self) -> int:
+        return self._bytes
+
+    def _is_full(self, size: int) -> bool:
+        return bool(self._items) and (
+            len(self._items) >= self.max_items
+            or self._bytes + size > self.max_bytes)
+
+    def _drop_head(self):
+        _, size = self._items.popleft()
+        self._bytes -= size
+        self.dropped += 1
+        self.dropped_bytes += size
+
+    def put(self, item, size: int, urgent=False) -> int:
+        """
+        :return: number of queued messages dropped to make room
+        """
+        with self._ready:
+            if self.is_closed:
+                return 0
+            if urgent:
+                dropped = self._put_urgent(item, size)
+            else:
+                dropped = self._put(item, size)
+        if self.on_ready is not None:
+            self.on_ready()
+        return dropped
+
+    def _put(self, item, size: int) -> int:
+        dropped = self.dropped
+        if self._is_full(size):
+            if self.policy == OVERFLOW_DISCONNECT:
+                raise QueueOverflow(f"send queue overflow: "
+                                    f"{len(self._items)} messages, "
+                                    f"{self._bytes} bytes")
+            if self.policy == OVERFLOW_LATEST_WINS:
+                while self._items:
+                    self._drop_head()
+            while self._is_full(size):
+                self._drop_head()
+        self._items.append((item, size))
+        self._bytes += size
+        self.max_depth = max(self.max_depth, len(self._items))
+        self._ready.notify()
+        return self.dropped - dropped
+
+    def _put_urgent(self, item, size: int) -> int:
+        dropped = 0
+        if len(self._urgent) >= self.max_items:
+            if self.policy == OVERFLOW_DISCONNECT:
+                raise QueueOverflow(f"send queue overflow: "
+                                    f"{len(self._urgent)} urgent messages")
+            _, dropped_size = self._urgent.popleft()
+            self.dropped += 1
+            self.dropped_bytes += dropped_size
+            dropped = 1
+        self._urgent.append((item, size))
+        self._ready.notify()
+        return dropped
+
+    def has_queued(self, cls: type) -> bool:
+        """
+        Whether a message of type `cls` waits in the queue
+        """
+        with self._ready:
+            return any(isinstance(item, cls) for item, _ in self._items)
+
+    def get_nowait(self):
+        with self._ready:
+            return self._pop()
+
+    def get_urgent_nowait(self):
+        """
+        The next urgent item, None if there is none
+        """
+        with self._ready:
+            if not self._urgent:
+                return None
+            self.sent += 1
+            return self._urgent.popleft()[0]
+
+    def get(self, timeout: float = None):
+        """
+        Block until a message is queued, None once closed or timed out
+        """
+        with self._ready:
+            if not self._items and not self._urgent and not self.is_closed:
+                self._ready.wait(timeout)
+            return self._pop()
+
+    def _pop(self):
+        if self._urgent:
+            self.sent += 1
+            return self._urgent.popleft()[0]
+        if not self._items:
+            return None
+        item, size = self._items.popleft()
+        self._bytes -= size
+        self.sent += 1
+        return item
+
+    def close(self):
+        with self._ready:
+            self.is_closed = True
+            self._items.clear()
+            self._urgent.clear()
+            self._bytes = 0
+            self._ready.notify_all()
+        if self.on_ready is not None:
+            self.on_ready()
+
+    def stats(self) -> dict:
+        return {"depth": self.depth, "depth_bytes": self._bytes,
+                "max_depth": self.max_depth, "sent": self.sent,
+                "dropped": self.dropped, "dropped_bytes": self.dropped_bytes}
@@ -0,0 +1,197 @@
+"""
+Sending side of a client connection: the frames of several messages are
+multiplexed by priority, so a heartbeat never waits for the end of a large
+image, only for the frame being written.
+
+Messages are queued at one of three priorities: control (heartbeats,
+fetches, history requests), small text, bulk payloads. Frames of the same
+priority keep their order, a message is sent whole before the next one of
+its priority starts. Frames of a binary connection carry their stream id,
+so the receiver reassembles interleaved messages.
+
+There is no writer thread: the threads sending take turns at writing, the
+one holding the turn writes the next frame of the most urgent message (its
+own or another thread's) until its own message is written.
+
+Messages sent with the same latest-wins key (clipboards) supersede each
+other: an older one not started yet is dropped, one half sent is abandoned
+with its cancel frame, if it has one, or else goes whole.
+
+Priorities only order what is still queued in the process, bytes handed to
+the kernel are sent first. `limit_unsent` keeps the kernel from taking
+megabytes ahead of a heartbeat.
+"""
+import socket
+import threading
+from collections import deque
+from typing import *
+
+PRIORITY_CONTROL = 0
+PRIORITY_TEXT = 1
+PRIORITY_BULK = 2
+PRIORITIES = (PRIORITY_CONTROL, PRIORITY_TEXT, PRIORITY_BULK)
+
+# unsent bytes a socket takes before writes wait
+UNSENT_LIMIT = 128 * 1024
+
+
+def limit_unsent(sock: socket.socket, size=UNSENT_LIMIT) -> bool:
+    """
+    Writes to `sock` wait while more than `size` bytes are not sent yet,
+    where the platform has TCP_NOTSENT_LOWAT (linux, macos)
+
+    :return: whether the limit is set
+    """
+    option = getattr(socket, "TCP_NOTSENT_LOWAT", None)
+    if option is None:
+        return False
+    sock.setsockopt(socket.IPPROTO_TCP, option, size)
+    return True
+
+
+class Transfer(object):
+    """
+    Frames of one message being sent, each a list of buffers written back to
+    back
+    """
+
+    def __init__(self, frames: Iterable[List[bytes]], priority: int,
+                 key=None, cancel_frame: List[bytes] = None):
+        self.priority = priority
+        self.key = key
+        # written in place of the rest when superseded half sent
+        self.cancel_frame = cancel_frame
+        self._frames = iter(frames)
+        # the first frame is built by the sending thread, outside its turn:
+        # compaction and compression run there
+        self.next_frame = next(self._frames, None)
+        self.error: Optional[Exception] = None
+        self.is_started = False
+        # a newer message of the key was sent while this one was written
+        self.is_stale = False
+        self.is_superseded = False
+
+    @property
+    def is_done(self) -> bool:
+        return (self.next_frame is None or self.error is not None
+                or self.is_superseded)
+
+    def advance(self):
+        self.is_started = True
+        self.next_frame = next(self._frames, None)
+
+
+class PrioritySender(object):
+    """
+    Frames of the queued messages of one connection, written by `write`
+    most urgent first
+    """
+
+    def __init__(self, write: Callable[[List[bytes]], None]):
+        self.write = write
+        self._levels: List[Deque[Transfer]] = [deque() for _ in PRIORITIES]
+        self._cond = threading.Condition(threading.Lock())
+        # the message a frame of is being written
+        self._writing: Optional[Transfer] = None
+        # latest-wins key -> its latest message
+        self._latest: Dict[Any, Transfer] = {}
+        # counters
+        self.frames = 0
+        # frames written ahead of less urgent messages
+        self.interleaved = 0
+        # messages dropped for a newer one, cancelled half sent
+        self.superseded = 0
+        self.cancelled = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(len(level) for level in self._levels)
+
+    def _supersede(self, transfer: Transfer):
+        if transfer.is_done:
+            return
+        if transfer is self._writing:
+            # dropped once its frame is written
+            transfer.is_stale = True
+            return
+        if transfer.is_started:
+            if transfer.cancel_frame is None:
+                # can not be abandoned, the receiver would keep half of it
+                return
+            self._levels[PRIORITY_CONTROL].append(
+                Transfer([transfer.cancel_frame], PRIORITY_CONTROL))
+            self.cancelled += 1
+        self._levels[transfer.priority].remove(transfer)
+        transfer.is_superseded = True
+        self.superseded += 1
+        self._cond.notify_all()
+
+    def _most_urgent(self) -> Transfer:
+        for level in self._levels:
+            if level:
+                return level[0]
+
+    def _is_preempting(self, transfer: Transfer) -> bool:
+        return any(self._levels[priority]
+                   for priority in range(transfer.priority + 1,
+                                         len(PRIORITIES)))
+
+    def _write_frame(self, transfer: Transfer):
+        try:
+            self.write(transfer.next_frame)
+            transfer.advance()
+        except Exception as exp:
+            transfer.error = exp
+
+    def send(self, frames: Iterable[List[bytes]], priority=PRIORITY_BULK,
+             key=None, cancel_frame: List[bytes] = None) -> bool:
+        """
+        Queue the frames of one message and block until they are written
+
+        :param key: latest-wins key, the message supersedes the previous
+            one of the key if that is not written yet
+        :param cancel_frame: written instead of the rest of the message if
+            it is superseded half sent
+        :return: False if the message was superseded
+        :raise: the error writing it
+        """
+        transfer = Transfer(frames, priority, key, cancel_frame)
+        if transfer.is_done:
+            return True
+        with self._cond:
+            if key is not None:
+                previous = self._latest.get(key)
+                if previous is not None:
+                    self._supersede(previous)
+                self._latest[key] = transfer
+            self._levels[priority].append(transfer)
+            while not transfer.is_done:
+                if self._writing is not None:
+                    self._cond.wait()
+                    continue
+                current = self._most_urgent()
+                self.frames += 1
+                if self._is_preempting(current):
+                    self.interleaved += 1
+                self._writing = current
+                self._cond.release()
+                try:
+                    self._write_frame(current)
+                finally:
+                    self._cond.acquire()
+                    self._writing = None
+                    if current.is_done:
+                        self._levels[current.priority].popleft()
+                    elif current.is_stale:
+                        self._supersede(current)
+                    self._cond.notify_all()
+            if self._latest.get(key) is transfer:
+                self._latest.pop(key)
+        if transfer.error is not None:
+            raise transfer.error
+        return not transfer.is_superseded
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "frames": self.frames,
+                "interleaved": self.interleaved,
+                "superseded": self.superseded, "cancelled": self.cancelled}
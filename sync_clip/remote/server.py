@@ -1,37 +1,89 @@
-import sys
 import time
-import pickle
 import socket
+import itertools
+import threading
+import functools
 import logging
 import traceback
 from queue import Queue
+from collections import deque, OrderedDict
 from socket import SOL_SOCKET, SO_REUSEADDR
+from typing import *
 
 from sync_clip.stuff.sync_signal import *
+from sync_clip.remote.protocol import *
+from sync_clip.remote.send_queue import *
+from sync_clip.remote.relay import RelayMessage, FileRelay
+from sync_clip.remote.blobs import *
+from sync_clip.remote.history import *
+from sync_clip.remote.liveness import *
+from sync_clip.remote.resume import UploadSpool, prune_uploads
+from sync_clip.remote.sender import limit_unsent
+from sync_clip.remote.versions import *
+from sync_clip.utils.util_path import (get_cache_data_dir,
+                                       get_cache_data_filepath)
 from sync_clip.utils.util_thread import new_thread
 
 logger = logging.getLogger("sync_clip")
 
 
-class ClientSet(object):
+class Peer(object):
+    """
+    One connected client: its socket (or stream writer), negotiated protocol
+    and outbound queue
+    """
 
-    def __init__(self):
-        self.set = {}
+    def __init__(self, conn, addr: tuple, send_queue: SendQueue):
+        self.conn = conn
+        self.addr = addr
+        self.protocol = PROTOCOL_LEGACY
+        # peers only sync with the peers of their channel
+        self.channel = DEFAULT_CHANNEL
+        # compression codecs the peer decompresses, optional features
+        self.codecs: List[int] = []
+        self.features: List[int] = []
+        # digests of the payloads the peer most likely has in its blob store
+        self.known: Deque[bytes] = deque(maxlen=CLIENT_BLOB_ENTRIES)
+        # whether the peer got the latest history entry after connecting
+        self.caught_up = False
+        self.send_queue = send_queue
+        self.is_closed = False
+        # receiving state: legacy chunk merging, binary streams being relayed
+        self.assembler = SignalAssembler()
+        self.relaying: Dict[int, RelayMessage] = {}
+        # stream id -> spool of a resumable upload being received
+        self.uploads: Dict[int, UploadSpool] = {}
+        # stream id -> version stamped on a stream not started yet
+        self.stamps: Dict[int, Version] = {}
+
+    def take_stamp(self, stream_id: int) -> Version:
+        return self.stamps.pop(stream_id, UNVERSIONED)
 
-    def update_client(self, addr: tuple):
-        self.set[addr] = time.time()
-        expired_clients = []
-        for addr, last_htime in self.set.items():
-            if time.time() - last_htime > 3:
-                expired_clients.append(addr)
-        for addr in expired_clients:
-            self.set.pop(addr)
+    def stats(self) -> dict:
+        return {"addr": self.addr, "protocol": self.protocol,
+                "channel": self.channel, "codecs": self.codecs,
+                "features": self.features,
+                **self.send_queue.stats()}
 
 
 class Server(object):
-    def __init__(self, host="0.0.0.0", port=12364):
+    MAX_MESSAGE_SIZE = 25 * 1024
+    # bytes of a large message written between two looks for urgent frames
+    WRITE_BATCH_SIZE = 64 * 1024
+    # offered formats being fetched from their senders
+    MAX_LAZY_FETCHES = 64
+
+    def __init__(self, host="0.0.0.0", port=12364, queue_size=32,
+                 queue_bytes=64 * 1024 * 1024,
+                 queue_policy=OVERFLOW_DROP_OLDEST,
+                 blob_cache_size=SERVER_BLOB_BYTES,
+                 history_size=HISTORY_BYTES, history_file: str = None,
+                 liveness_timeout=LIVENESS_TIMEOUT, tcp_keepalive=True):
         self.host = host
         self.port = port
+        self.queue_size = queue_size
+        self.queue_bytes = queue_bytes
+        self.queue_policy = queue_policy
         self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # prevent system keep address
         self.tcp_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
@@ -40,82 +92,868 @@ class Server(object):
         self.client_heartbeat_q = Queue()
         self.sending_msg_queue = Queue()
         self.is_closed = True
-        self.client_set = {}
-        self.conns = []
+        self.peers: Dict[tuple, Peer] = {}
+        # channel -> its peers by address, broadcasts only walk the members
+        # of the sender's channel
+        self.channels: Dict[str, Dict[tuple, Peer]] = {}
+        self._channels_lock = threading.Lock()
+        # payloads kept for announces, fetches and as delta bases
+        self.blobs = BlobStore(max_bytes=blob_cache_size)
+        # every synced payload, newly connected peers get the latest
+        self.history: Optional[HistoryRing] = None
+        if history_size:
+            self.history = HistoryRing(
+                history_file or get_cache_data_filepath(
+                    "server", f"history-{self.port}.ring"),
+                capacity=history_size)
+        self._stream_ids = itertools.count(1)
+        # channel -> clock and version of its latest clipboard, older ones
+        # are not relayed
+        self.versions: Dict[str, VersionClock] = {}
+        # channel -> sequence and version of its latest history entry
+        self._history_versions: Dict[str, Tuple[int, Version]] = {}
+        # channel -> its latest offer and the peer it came from
+        self._offers: Dict[str, Tuple[Peer, OfferSignal]] = {}
+        # digest -> mime type and the (peer, is clipboard) waiting for an
+        # offered format fetched from its sender
+        self._lazy_fetches: Dict[bytes, Tuple[str, list]] = OrderedDict()
+        self._lazy_lock = threading.Lock()
+        # the content of file lists being relayed and resumable uploads are
+        # spooled here
+        self.spool_dir = get_cache_data_dir("server")
+        prune_uploads(self.spool_dir)
+        # peers silent for `liveness_timeout` seconds are dropped, 0 keeps
+        # them until a send fails
+        self.liveness: Optional[LivenessTracker] = None
+        if liveness_timeout:
+            self.liveness = LivenessTracker(liveness_timeout)
+        self.tcp_keepalive = tcp_keepalive
 
-    def _update_client(self, addr: tuple):
-        self.client_set[addr] = time.time()
+    def _configure_conn(self, sock):
+        try:
+            # urgent frames do not queue behind megabytes in the kernel
+            limit_unsent(sock)
+        except OSError as exp:
+            logger.warning(f"unable to limit unsent bytes: {exp}")
+        if not self.tcp_keepalive:
+            return
+        try:
+            enable_keepalive(sock)
+        except OSError as exp:
+            logger.warning(f"tcp keepalive unavailable: {exp}")
+
+    def _evict_dead_peers(self):
+        for peer in self.liveness.expired():
+            logger.warning(f"client {peer.addr} silent for "
+                           f"{self.liveness.timeout} s, disconnecting")
+            self._drop_peer(peer)
 
     @new_thread
-    def _monitor_expired_clients(self):
+    def _keep_evicting(self):
         while not self.is_closed:
-            expired_clients = []
-            for addr, last_htime in self.client_set.items():
-                if time.time() - last_htime > 3:
-                    expired_clients.append(addr)
-            for addr in expired_clients:
-                self.client_set.pop(addr)
-            time.sleep(3)
-
-    def _broadcast_sync_data(self, sig: SyncData, this_addr: tuple):
-        logger.info(f"receiving data from {this_addr}: {sig.data[:20]}")
-        for conn, addr in self.conns:
-            if addr != this_addr:
-                self._send_sync_data(conn, addr, sig)
-
-    def _send_sync_data(self, conn: socket.socket, addr, sig: SyncSignal):
-        p_sig_data = pickle.dumps(sig)
+            time.sleep(self.liveness.wait_time(1.0))
+            self._evict_dead_peers()
+
+    def _new_send_queue(self) -> SendQueue:
+        return SendQueue(max_items=self.queue_size, max_bytes=self.queue_bytes,
+                         policy=self.queue_policy)
+
+    def _add_peer(self, conn, addr: tuple) -> Peer:
+        peer = Peer(conn, addr, self._new_send_queue())
+        self.peers[addr] = peer
+        self._join(peer, DEFAULT_CHANNEL)
+        if self.liveness is not None:
+            self.liveness.touch(peer)
+        self._keep_sending(peer)
+        logger.info(f"new connection from {addr}")
+        return peer
+
+    def _drop_peer(self, peer: Peer):
+        peer.is_closed = True
+        if self.peers.get(peer.addr) is peer:
+            self.peers.pop(peer.addr)
+            self._leave(peer)
+        if self.liveness is not None:
+            self.liveness.remove(peer)
+        peer.send_queue.close()
+        peer.conn.close()
+        # the receive thread may still be relaying a frame
+        for message in list(peer.relaying.values()):
+            message.abort()
+        peer.relaying.clear()
+        # kept for the upload to be resumed
+        for spool in list(peer.uploads.values()):
+            spool.close()
+        peer.uploads.clear()
+        if self._offers.get(peer.channel, (None,))[0] is peer:
+            # its formats can not be fetched anymore
+            self._offers.pop(peer.channel, None)
+
+    def _leave(self, peer: Peer):
+        with self._channels_lock:
+            members = self.channels.get(peer.channel)
+            if members is not None and members.get(peer.addr) is peer:
+                members.pop(peer.addr)
+                if not members:
+                    self.channels.pop(peer.channel)
+
+    def _join(self, peer: Peer, channel: str):
+        self._leave(peer)
+        with self._channels_lock:
+            peer.channel = channel
+            self.channels.setdefault(channel, {})[peer.addr] = peer
+
+    def channel_stats(self) -> Dict[str, int]:
+        return {channel: len(members)
+                for channel, members in list(self.channels.items())}
+
+    def queue_stats(self) -> List[dict]:
+        return [peer.stats() for peer in list(self.peers.values())]
+
+    def blob_stats(self) -> dict:
+        return self.blobs.stats()
+
+    def history_stats(self) -> dict:
+        return self.history.stats() if self.history is not None else {}
+
+    def _remember(self, message: RelayMessage, is_latest=True):
+        """
+        Store a complete payload in the history and, if large, in the blob
+        store, every connected peer has it now
+
+        :param is_latest: False for a payload overtaken by a newer one of
+            its sender, it is not the latest history entry then
+        """
+        payload = message.full_payload()
+        if payload is None:
+            return
+        digest = message.digest()
+        is_text = bool(message.flags & FLAG_TEXT)
+        if self.history is not None and is_latest:
+            entry = self.history.append(payload, is_text, digest,
+                                        message.channel)
+            if entry is not None:
+                self._history_versions[message.channel] = (entry.seq,
+                                                           message.version)
+        if len(payload) < self.blobs.min_size:
+            return
+        self.blobs.put(digest, payload, is_text)
+        for peer in list(self.channels.get(message.channel, {}).values()):
+            if digest not in peer.known:
+                peer.known.append(digest)
+
+    def _find_blob(self, digest: bytes, count=True) -> Optional[Blob]:
+        """
+        A payload by digest from the blob store, else from the history
+        """
+        blob = self.blobs.get(digest, count=False)
+        if blob is None and self.history is not None:
+            entry = self.history.find(digest)
+            payload = self.history.read(entry) if entry is not None else None
+            if payload is not None:
+                blob = Blob(digest, payload, entry.is_text)
+        if count:
+            self.blobs.record_lookup(blob)
+        return blob
+
+    def _find_base(self, digest: bytes) -> Optional[bytes]:
+        blob = self._find_blob(digest, count=False)
+        return blob.payload if blob is not None else None
+
+    def _relaying_latest(self, channel: str) -> Optional[RelayMessage]:
+        """
+        The latest clipboard of `channel` if it is still being received
+        """
+        latest = self._clock(channel).latest
+        if not latest[0]:
+            return None
+        for member in list(self.channels.get(channel, {}).values()):
+            for message in list(member.relaying.values()):
+                if message.version == latest and not message.is_done:
+                    return message
+        return None
+
+    def _catch_up(self, peer: Peer):
+        """
+        Send the latest history entry to a newly connected peer, announced
+        by digest if large and the peer takes announces: a reconnecting
+        client most likely has it already. The latest clipboard still being
+        received (e.g. an upload resumed after a restart) is relayed to it
+        instead.
+        """
+        peer.caught_up = True
+        message = self._relaying_latest(peer.channel)
+        if message is not None:
+            if isinstance(message, FileRelay):
+                if self._can_forward(peer, message):
+                    self._enqueue(peer, message, 0)
+            else:
+                self._enqueue(peer, message, message.total)
+            return
+        offer = self._offers.get(peer.channel)
+        if (offer is not None and FEATURE_LAZY in peer.features
+                and version_of(offer[1])
+                >= self._clock(peer.channel).latest):
+            self._send_offer(peer, offer[1])
+            return
+        entry = (self.history.latest(peer.channel)
+                 if self.history is not None else None)
+        if entry is None:
+            return
+        seq, version = self._history_versions.get(peer.channel,
+                                                  (0, UNVERSIONED))
+        if seq != entry.seq:
+            # an entry of an earlier run of the server
+            version = UNVERSIONED
+        stream_id = next(self._stream_ids)
+        if (FEATURE_ANNOUNCE in peer.features
+                and entry.size >= self.blobs.min_size):
+            self._send_frames(peer, self._stamp_frames(
+                peer, stream_id, version) + encode_signal(AnnounceSignal(
+                    entry.digest, entry.size, entry.is_text),
+                    stream_id=stream_id))
+            return
+        payload = self.history.read(entry)
+        if payload is None:
+            return
+        message = RelayMessage.from_payload(
+            payload, FLAG_TEXT if entry.is_text else 0, peer.addr,
+            stream_id=stream_id,
+            chunk_size=self.MAX_MESSAGE_SIZE, digest=entry.digest)
+        frames = self._complete_frames(peer, message)
+        if frames:
+            frames = self._stamp_frames(peer, stream_id, version) + frames
+            logger.info(f"catching up client {peer.addr} with history entry "
+                        f"{entry.seq}, total: {entry.size}")
+            self._send_frames(peer, frames)
+
+    def _send_history_page(self, peer: Peer, sig: HistorySignal):
+        page = (self.history.page(sig.before, sig.limit, peer.channel)
+                if self.history is not None else [])
+        reply = HistorySignal(sig.before, entries=[
+            (entry.seq, entry.digest, entry.size, entry.is_text, entry.time,
+             preview) for entry, preview in page])
+        if peer.protocol == PROTOCOL_LEGACY:
+            self._send_frames(peer, [encode_legacy(reply)], urgent=True)
+        else:
+            self._send_frames(peer, encode_signal(reply), urgent=True)
+
+    def _on_message_complete(self, peer: Peer, message: RelayMessage):
+        """
+        Store the payload, a delta whose base is missing here is fetched
+        from its sender in full. Runs before the last frame
+        is forwarded, so fetches of it never come too early.
+        """
+        if message.is_delta and message.full_payload() is None:
+            logger.info(f"delta base from {peer.addr} is missing, "
+                        f"fetching the full payload")
+            self._send_frames(peer, encode_signal(FetchSignal(
+                message.digest())), urgent=True)
+            return
+        self._remember(message, self._is_latest(message))
+
+    def _clock(self, channel: str) -> VersionClock:
+        clock = self.versions.get(channel)
+        if clock is None:
+            # the first writers of a channel may race here (one receive
+            # thread per peer), setdefault gives them the same clock
+            clock = self.versions.setdefault(channel,
+                                             VersionClock(SERVER_ORIGIN))
+        return clock
+
+    def _order(self, message: RelayMessage) -> bool:
+        """
+        Place `message` among the clipboards of its channel, stamping it if
+        its sender does not (released clients)
+
+        :return: False if it is older than the latest one
+        """
+        version = self._place(message.channel, message.version)
+        if version is None:
+            return False
+        message.version = version
+        return True
+
+    def _place(self, channel: str, version: Version) -> Optional[Version]:
+        """
+        :return: `version`, a new one if unstamped, None if older than the
+            latest clipboard of `channel`
+        """
+        clock = self._clock(channel)
+        if not version[0]:
+            return clock.tick()
+        return version if clock.accept(version) else None
+
+    def _is_latest(self, message: RelayMessage) -> bool:
+        """
+        False for a payload overtaken by a newer one, a small text sent
+        while a large payload was on its way completes first
+        """
+        return message.version >= self._clock(message.channel).latest
+
+    @staticmethod
+    def _stamp_frames(peer: Peer, stream_id: int,
+                      version: Version) -> List[bytes]:
+        """
+        The stamp written ahead of a clipboard, for peers taking them
+        """
+        if not version[0] or FEATURE_VERSION not in peer.features:
+            return []
+        return encode_signal(StampSignal(stream_id, *version))
+
+    def _broadcast_sync_data(self, message: RelayMessage):
+        """
+        Peers of the sender's channel get the message, those that had the
+        payload already only get its announce. A message older than the
+        latest clipboard of the channel is not relayed.
+        """
+        if not self._order(message):
+            logger.info(f"not relaying clipboard of version "
+                        f"{message.version} from {message.origin}, older "
+                        f"than {self._clock(message.channel).latest}")
+            return
+        digest = message.known_digest
+        for peer in list(self.channels.get(message.channel, {}).values()):
+            if peer.addr == message.origin:
+                continue
+            if isinstance(message, FileRelay):
+                if self._can_forward(peer, message):
+                    # spooled on disk, not counted in the queue's bytes
+                    self._enqueue(peer, message, 0)
+            elif (digest is not None and digest in peer.known
+                    and FEATURE_ANNOUNCE in peer.features):
+                self.blobs.record_saved(message.total)
+                announce = AnnounceSignal(digest, message.total,
+                                          bool(message.flags & FLAG_TEXT))
+                self._send_frames(peer, self._stamp_frames(
+                    peer, message.stream_id, message.version) + encode_signal(
+                    announce, stream_id=message.stream_id))
+            else:
+                self._enqueue(peer, message, message.total)
+
+    def _send_offer(self, peer: Peer, sig: OfferSignal):
+        stream_id = next(self._stream_ids)
+        self._send_frames(peer, self._stamp_frames(
+            peer, stream_id, version_of(sig)) + encode_signal(
+            sig, stream_id=stream_id))
+
+    def _relay_offer(self, peer: Peer, sig: OfferSignal):
+        """
+        Peers of the channel taking offers get the offer and fetch the
+        formats pasted, the others get the sender's preferred format,
+        fetched from it once. The server only has the formats fetched, the
+        preferred one becomes a history entry when it is.
+        """
+        version = self._place(peer.channel, version_of(sig))
+        if version is None:
+            logger.info(f"not relaying offer of version {version_of(sig)} "
+                        f"from {peer.addr}, older than "
+                        f"{self._clock(peer.channel).latest}")
+            return
+        stamp(sig, version)
+        self._offers[peer.channel] = (peer, sig)
+        eager = []
+        for other in list(self.channels.get(peer.channel, {}).values()):
+            if other is peer:
+                continue
+            if FEATURE_LAZY in other.features:
+                self._send_offer(other, sig)
+            else:
+                eager.append((other, True))
+        if eager and sig.formats:
+            mime, digest, _ = sig.formats[0]
+            self._fetch_offered(peer, mime, digest, eager)
+
+    def _find_offered(self, channel: str,
+                      digest: bytes) -> Optional[Tuple[Peer, str]]:
+        """
+        The peer offering the format of `digest` in the latest offer of
+        `channel`, and its mime type
+        """
+        offer = self._offers.get(channel)
+        if offer is None:
+            return None
+        for mime, offered, _ in offer[1].formats:
+            if offered == digest:
+                return offer[0], mime
+        return None
+
+    def _fetch_offered(self, sender: Peer, mime: str, digest: bytes,
+                       waiters: List[Tuple[Peer, bool]]):
+        """
+        Fetch an offered format from its `sender` for `waiters`, (peer,
+        whether it gets it as its clipboard) pairs, once for all
+        """
+        with self._lazy_lock:
+            pending = self._lazy_fetches.get(digest)
+            is_asked = pending is not None
+            if not is_asked:
+                pending = self._lazy_fetches[digest] = (mime, [])
+                while len(self._lazy_fetches) > self.MAX_LAZY_FETCHES:
+                    self._lazy_fetches.popitem(last=False)
+            pending[1].extend(waiters)
+        if not is_asked:
+            self._send_frames(sender, encode_signal(FetchSignal(digest)),
+                              urgent=True)
+
+    def _on_format_fetched(self, message: RelayMessage):
+        """
+        Send an offered format fetched from its sender to the peers waiting
+        for it, keep it for the next ones. Peers fetching it get it as an
+        answer, peers not taking offers as their clipboard.
+        """
+        payload = message.full_payload()
+        digest = message.digest()
+        with self._lazy_lock:
+            mime, waiters = self._lazy_fetches.pop(digest, (None, []))
+        if mime is None:
+            found = self._find_offered(message.channel, digest)
+            if found is None:
+                logger.info(f"client {message.origin} sent a format not "
+                            f"asked for")
+                return
+            mime = found[1]
+        flags = FLAG_TEXT if mime == MIME_TEXT else 0
+        clipboard = RelayMessage.from_payload(
+            payload, flags, message.origin, stream_id=next(self._stream_ids),
+            chunk_size=self.MAX_MESSAGE_SIZE, digest=digest,
+            channel=message.channel)
+        offer = self._offers.get(message.channel)
+        if (offer is not None and offer[1].formats
+                and offer[1].formats[0][1] == digest):
+            clipboard.version = version_of(offer[1])
+            self._remember(clipboard, self._is_latest(clipboard))
+        elif len(payload) >= self.blobs.min_size:
+            self.blobs.put(digest, payload, bool(flags))
+        answer = RelayMessage.from_payload(
+            payload, flags | FLAG_ACK, message.origin,
+            stream_id=next(self._stream_ids),
+            chunk_size=self.MAX_MESSAGE_SIZE, digest=digest)
+        for peer, is_clipboard in waiters:
+            if peer.is_closed:
+                continue
+            if not is_clipboard:
+                self._send_frames(peer, answer.buffers)
+            elif clipboard.version[0] and self._is_latest(clipboard):
+                frames = self._complete_frames(peer, clipboard)
+                if frames:
+                    self._send_frames(peer, self._stamp_frames(
+                        peer, clipboard.stream_id, clipboard.version)
+                        + frames)
+
+    def _on_frame(self, peer: Peer, header: Optional[FrameHeader],
+                  header_bytes: Optional[bytes], payload):
+        if peer.is_closed:
+            # dropped by its writer or evicted while the frame was read
+            return
+        if self.liveness is not None:
+            self.liveness.touch(peer)
+        if header is None:
+            sig = peer.assembler.feed_legacy(payload)
+            if sig is not None:
+                self._handle_signal(sig, peer)
+        elif header.type == FRAME_DATA:
+            self._relay_frame(peer, header, header_bytes, payload)
+        elif header.type in (FRAME_FILES, FRAME_FILE):
+            self._relay_files(peer, header, header_bytes, payload)
+        else:
+            sig = decode_signal(header, payload)
+            if header.type in (FRAME_ANNOUNCE, FRAME_OFFER):
+                stamp(sig, peer.take_stamp(header.stream_id))
+            self._handle_signal(sig, peer)
+
+    def _relay_frame(self, peer: Peer, header: FrameHeader,
+                     header_bytes: bytes, payload):
+        """
+        Cut-through relay: data frames are forwarded as received, only the
+        header is parsed
+        """
+        message = peer.relaying.get(header.stream_id)
+        if message is None:
+            if header.total > MAX_STREAM_SIZE:
+                raise ProtocolError(f"stream too large: {header.total}")
+            logger.info(f"receiving data from {peer.addr}: "
+                        f"{bytes(payload[:20])}, total: {header.total}")
+            # an offered format fetched, for the peers waiting for it
+            is_answer = bool(header.flags & FLAG_ACK)
+            message = RelayMessage(
+                peer.addr, header.total, header.flags,
+                find_base=self._find_base,
+                on_complete=self._on_format_fetched if is_answer
+                else functools.partial(self._on_message_complete, peer),
+                channel=peer.channel)
+            message.stream_id = header.stream_id
+            message.version = peer.take_stamp(header.stream_id)
+            peer.relaying[header.stream_id] = message
+            if not is_answer:
+                self._broadcast_sync_data(message)
+        message.append(header, header_bytes, payload)
+        spool = peer.uploads.get(header.stream_id)
+        if spool is not None:
+            spool.write(header_bytes, payload)
+        if message.is_complete:
+            # None once the peer was dropped meanwhile, by its writer or
+            # evicted, which aborted the message
+            peer.relaying.pop(header.stream_id, None)
+            spool = peer.uploads.pop(header.stream_id, None)
+            if spool is not None:
+                spool.remove()
+
+    def _resume_upload(self, peer: Peer, sig: ResumeSignal):
+        """
+        Spool the DATA stream of a resumable upload, the frames spooled
+        before the offset it goes on from are relayed again first, as frames
+        of its stream
+        """
+        spool = UploadSpool(self.spool_dir, sig.transfer_id)
+        frames = spool.open(sig.offset)
+        if frames:
+            logger.info(f"resuming upload from {peer.addr} at {sig.offset} "
+                        f"bytes")
+        previous = peer.uploads.pop(sig.stream_id, None)
+        if previous is not None:
+            previous.close()
+        for header_bytes, payload in frames:
+            header = unpack_header(header_bytes)._replace(
+                stream_id=sig.stream_id)
+            self._relay_frame(peer, header, pack_header(
+                header.type, header.flags, header.stream_id, header.length,
+                header.total), payload)
+        if peer.is_closed:
+            # dropped meanwhile, the spool is kept for the next resume
+            spool.close()
+            return
+        if frames and sig.stream_id not in peer.relaying:
+            # it had been received whole
+            spool.remove()
+            return
+        peer.uploads[sig.stream_id] = spool
+
+    def _relay_files(self, peer: Peer, header: FrameHeader,
+                     header_bytes: bytes, payload):
+        """
+        Cut-through relay of a file list, its content spooled on the way
+        """
+        message = peer.relaying.get(header.stream_id)
+        if header.type == FRAME_FILES:
+            if message is not None:
+                raise ProtocolError(f"stream {header.stream_id} is relayed "
+                                    f"already")
+            sig = decode_signal(header, payload)
+            message = FileRelay(peer.addr, sig, self.spool_dir,
+                                channel=peer.channel)
+            logger.info(f"receiving {len(sig.files)} files from "
+                        f"{peer.addr}, total: {message.total}")
+            message.version = peer.take_stamp(header.stream_id)
+            message.append(header, header_bytes, payload)
+            peer.relaying[header.stream_id] = message
+            self._broadcast_sync_data(message)
+            return
+        if not isinstance(message, FileRelay):
+            raise ProtocolError(f"file data of unknown stream "
+                                f"{header.stream_id}")
+        message.append(header, header_bytes, payload)
+        if message.is_complete:
+            # None once the peer was dropped meanwhile
+            peer.relaying.pop(header.stream_id, None)
+
+    def _handle_signal(self, sig: SyncSignal, peer: Peer):
+        assert isinstance(sig, SyncSignal)
+        if not peer.caught_up and not isinstance(sig, ConCheck):
+            # released clients never negotiate, they start with heartbeats,
+            # or with a clipboard newer than the history
+            if isinstance(sig, HeartbeatSignal):
+                self._catch_up(peer)
+            peer.caught_up = True
+        if isinstance(sig, SyncData):
+            logger.info(f"receiving data from {peer.addr}: {sig.data[:20]}")
+            message = RelayMessage.from_signal(
+                sig, peer.addr, stream_id=next(self._stream_ids),
+                chunk_size=self.MAX_MESSAGE_SIZE, channel=peer.channel)
+            message.version = version_of(sig)
+            self._broadcast_sync_data(message)
+            self._remember(message, self._is_latest(message))
+        elif isinstance(sig, AnnounceSignal):
+            blob = self._find_blob(sig.digest)
+            if blob is None:
+                # not seen yet, upload it
+                self._send_frames(peer, encode_signal(FetchSignal(
+                    sig.digest)), urgent=True)
+                return
+            logger.info(f"receiving known data from {peer.addr}: "
+                        f"{blob.payload[:20]}, total: {sig.size}")
+            message = RelayMessage.from_payload(
+                blob.payload, FLAG_TEXT if sig.is_text else 0, peer.addr,
+                stream_id=next(self._stream_ids),
+                chunk_size=self.MAX_MESSAGE_SIZE, digest=sig.digest,
+                channel=peer.channel)
+            message.version = version_of(sig)
+            self._broadcast_sync_data(message)
+            self._remember(message, self._is_latest(message))
+        elif isinstance(sig, OfferSignal):
+            self._relay_offer(peer, sig)
+        elif isinstance(sig, FetchSignal):
+            blob = self._find_blob(sig.digest, count=False)
+            if blob is None:
+                found = self._find_offered(peer.channel, sig.digest)
+                if found is not None:
+                    self._fetch_offered(found[0], found[1], sig.digest,
+                                        [(peer, False)])
+                    return
+                logger.info(f"client {peer.addr} fetches an unknown payload")
+                return
+            # a format of the latest offer fetched before
+            is_answer = (FEATURE_LAZY in peer.features
+                         and self._find_offered(peer.channel, sig.digest)
+                         is not None)
+            message = RelayMessage.from_payload(
+                blob.payload, (FLAG_TEXT if blob.is_text else 0)
+                | (FLAG_ACK if is_answer else 0), peer.addr,
+                stream_id=next(self._stream_ids),
+                chunk_size=self.MAX_MESSAGE_SIZE, digest=sig.digest)
+            frames = (message.buffers if is_answer
+                      else self._complete_frames(peer, message))
+            if frames:
+                self._send_frames(peer, frames)
+        elif isinstance(sig, StampSignal):
+            peer.stamps[sig.stream_id] = version_of(sig)
+            while len(peer.stamps) > MAX_STAMPS:
+                peer.stamps.pop(next(iter(peer.stamps)))
+        elif isinstance(sig, ResumeSignal):
+            if sig.stream_id:
+                self._resume_upload(peer, sig)
+                return
+            held = UploadSpool(self.spool_dir, sig.transfer_id).held()
+            self._send_frames(peer, encode_signal(ResumeSignal(
+                transfer_id=sig.transfer_id, offset=held, is_answer=True)),
+                urgent=True)
+        elif isinstance(sig, CancelSignal):
+            peer.stamps.pop(sig.stream_id, None)
+            spool = peer.uploads.pop(sig.stream_id, None)
+            if spool is not None:
+                spool.remove()
+            message = peer.relaying.pop(sig.stream_id, None)
+            if message is not None:
+                logger.info(f"client {peer.addr} cancelled its data, "
+                            f"{message.received}/{message.total} received")
+                message.abort()
+        elif isinstance(sig, HistorySignal):
+            self._send_history_page(peer, sig)
+        elif isinstance(sig, HeartbeatSignal):
+            if peer.protocol != PROTOCOL_LEGACY and not sig.is_ack:
+                # echoed so the client can measure the rtt
+                self._send_frames(peer, encode_signal(HeartbeatSignal(
+                    sent_at=sig.sent_at, is_ack=True)), urgent=True)
+        elif isinstance(sig, ConCheck):
+            protocol = choose_protocol(getattr(sig, "protocols", ()))
+            max_chunk_size = min(getattr(sig, "max_chunk_size", 0)
+                                 or self.MAX_MESSAGE_SIZE, MAX_FRAME_SIZE)
+            codecs = choose_codecs(getattr(sig, "codecs", ()))
+            features = choose_features(getattr(sig, "features", ()))
+            if self.history is None and FEATURE_HISTORY in features:
+                features.remove(FEATURE_HISTORY)
+            channel = getattr(sig, "channel", DEFAULT_CHANNEL)
+            if (not isinstance(channel, str)
+                    or len(channel.encode("utf-8")) > MAX_CHANNEL_SIZE):
+                raise ProtocolError(f"bad channel: {channel!r:.80}")
+            self._join(peer, channel)
+            reply = ConCheck(protocol=protocol, max_chunk_size=max_chunk_size,
+                             codecs=codecs, features=features,
+                             channel=channel)
+            # the client's copies are to be newer than the channel's latest
+            reply.clock = self._clock(channel).clock
+            # the answer is legacy framed, the client switches after reading it
+            self._send_frames(peer, [encode_legacy(reply)], urgent=True)
+            peer.protocol = protocol
+            peer.codecs = codecs
+            peer.features = features
+            logger.info(f"client {peer.addr} speaks protocol: {protocol}, "
+                        f"max chunk size: {max_chunk_size}, "
+                        f"codecs: {codecs}, features: {features}, "
+                        f"channel: {channel!r}")
+            self._catch_up(peer)
+
+    def _send_frames(self, peer: Peer, frames: List[bytes], urgent=False):
+        """
+        :param urgent: control frames, written ahead of queued messages and
+            between the frames of the message being written
+        """
+        self._enqueue(peer, frames, sum(len(frame) for frame in frames),
+                      urgent)
+
+    def _enqueue(self, peer: Peer, item, size: int, urgent=False):
+        """
+        Queue a list of frames or a `RelayMessage` on the peer's own writer,
+        a slow peer only ever stalls itself
+        """
         try:
-            data_length = len(p_sig_data)
-            header = f"{data_length}".zfill(10)
-            p_sig_data = header.encode() + p_sig_data
-            conn.send(p_sig_data)
-        except BrokenPipeError:
-            self.conns.remove((conn, addr))
-            conn.close()
-        except Exception as exp:
-            logger.error(f"sending sync data error: {exp} "
-                         f"\n{traceback.format_exc()}")
-
-    @classmethod
-    def _receive_data(cls, conn: socket.socket):
-        conn.settimeout(0.5)
-        header = conn.recv(10)
-        if not header:
-            raise ConnectionResetError()
-        data_size = int(header.decode())
-        response = conn.recv(data_size)
-        if not response:
-            raise ConnectionResetError()
-        while data_size - len(response) > 0:
-            response += conn.recv(data_size - len(response))
-        # print(f"head: {data_size}, true receive: {len(response)}")
-        return response
+            dropped = peer.send_queue.put(item, size, urgent)
+        except QueueOverflow as exp:
+            logger.warning(f"disconnect slow client {peer.addr}: {exp}")
+            self._drop_peer(peer)
+            return
+        if dropped:
+            logger.warning(f"client {peer.addr} is slow, dropped {dropped} "
+                           f"queued messages, total dropped: "
+                           f"{peer.send_queue.dropped}")
+
+    @staticmethod
+    def _can_forward(peer: Peer, message: RelayMessage) -> bool:
+        return (peer.protocol != PROTOCOL_LEGACY
+                and message.can_forward(peer.codecs, peer.features))
+
+    def _complete_frames(self, peer: Peer,
+                         message: RelayMessage) -> List[bytes]:
+        """
+        Full payload frames of a complete message, for peers that cannot
+        take its frames as received (legacy peers, binary peers lacking its
+        codec or delta support) and for fetches. Empty if a delta base is
+        missing, the sender is asked for the full payload then.
+        """
+        if peer.protocol == PROTOCOL_LEGACY:
+            frame = message.legacy_frame()
+            return [frame] if frame is not None else []
+        return message.plain_buffers(self.MAX_MESSAGE_SIZE) or []
+
+    def _iter_batches(self, peer: Peer,
+                      buffers: List[bytes]) -> Iterator[List[bytes]]:
+        """
+        `buffers` of a binary message (header, payload pairs) in batches of
+        whole frames, about `WRITE_BATCH_SIZE` bytes each. Larger frames
+        (of a sender on a fast link) are cut to that size.
+        """
+        if peer.protocol == PROTOCOL_LEGACY:
+            yield buffers
+            return
+        batch, size = [], 0
+        for index in range(0, len(buffers), 2):
+            for frame in split_frame(buffers[index], buffers[index + 1],
+                                     self.WRITE_BATCH_SIZE):
+                batch.extend(frame)
+                size += len(frame[0]) + len(frame[1])
+                if size >= self.WRITE_BATCH_SIZE:
+                    yield batch
+                    batch, size = [], 0
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _write_urgent(peer: Peer):
+        frames = peer.send_queue.get_urgent_nowait()
+        while frames is not None:
+            write_frames(peer.conn, frames)
+            frames = peer.send_queue.get_urgent_nowait()
+
+    @staticmethod
+    def _is_superseded(peer: Peer) -> bool:
+        """
+        Whether a newer clipboard is queued for the peer, latest wins
+        """
+        return peer.send_queue.has_queued(RelayMessage)
+
+    @staticmethod
+    def _cancel_frames(message: RelayMessage) -> List[bytes]:
+        return encode_signal(CancelSignal(message.stream_id))
+
+    def _write_batches(self, peer: Peer, buffers: List[bytes],
+                       can_stop=False, is_started=False) -> bool:
+        """
+        :param can_stop: stop between batches once the message is
+            superseded
+        :return: False if stopped, after writing part of the message
+        """
+        for batch in self._iter_batches(peer, buffers):
+            if can_stop and is_started and self._is_superseded(peer):
+                return False
+            write_frames(peer.conn, batch)
+            self._write_urgent(peer)
+            is_started = True
+        return True
+
+    def _write_message(self, peer: Peer, message: RelayMessage):
+        """
+        A message not started yet is skipped once superseded, peers taking
+        cancel frames have it abandoned half written too (and an aborted
+        one), ending with a cancel frame
+        """
+        can_stop = FEATURE_CANCEL in peer.features
+        # waits are short, urgent frames are written in between
+        if not self._can_forward(peer, message):
+            while not message.wait_done(timeout=0.05):
+                self._write_urgent(peer)
+                if peer.is_closed or self._is_superseded(peer):
+                    return
+            if message.is_complete and not self._is_superseded(peer):
+                frames = self._complete_frames(peer, message)
+                if frames and not self._write_batches(
+                        peer, self._stamp_frames(peer, message.stream_id,
+                                                 message.version) + frames,
+                        can_stop):
+                    write_frames(peer.conn, self._cancel_frames(message))
+            return
+        index, is_stopped = 0, False
+        while not peer.is_closed:
+            buffers, is_done = message.wait_buffers(index, timeout=0.05)
+            if ((buffers or not is_done) and (not index or can_stop)
+                    and self._is_superseded(peer)):
+                is_stopped = True
+                break
+            if buffers:
+                stamp_frames = [] if index else self._stamp_frames(
+                    peer, message.stream_id, message.version)
+                is_stopped = not self._write_batches(
+                    peer, stamp_frames + buffers, can_stop, index > 0)
+                index += len(buffers)
+                if is_stopped:
+                    break
+            else:
+                self._write_urgent(peer)
+            if is_done:
+                break
+        if index and can_stop and (is_stopped or message.is_aborted):
+            write_frames(peer.conn, self._cancel_frames(message))
 
     @new_thread
-    def _keep_receiving(self, conn: socket.socket, addr: tuple):
-        while not self.is_closed:
+    def _keep_sending(self, peer: Peer):
+        while not self.is_closed and not peer.send_queue.is_closed:
+            item = peer.send_queue.get()
+            if item is None:
+                continue
+            try:
+                if isinstance(item, RelayMessage):
+                    self._write_message(peer, item)
+                else:
+                    write_frames(peer.conn, item)
+            except OSError as exp:
+                logger.info(f"sending to {peer.addr} failed: {exp}")
+                self._drop_peer(peer)
+                break
+            except Exception as exp:
+                logger.error(f"sending sync data error: {exp} "
+                             f"\n{traceback.format_exc()}")
+
+    @new_thread
+    def _keep_receiving(self, peer: Peer):
+        reader = SignalReader(peer.conn)
+        peer.conn.settimeout(0.5)
+        while not self.is_closed and not peer.is_closed:
             try:
-                response = self._receive_data(conn)
-                sig: SyncSignal = pickle.loads(response)
-                assert isinstance(sig, SyncSignal)
-                if isinstance(sig, SyncData):
-                    self._broadcast_sync_data(sig, addr)
-                elif isinstance(sig, HeartbeatSignal):
-                    pass
+                self._on_frame(peer, *reader.read_frame())
             except socket.timeout:
                 continue
-            except ConnectionResetError:
-                self.conns.remove((conn, addr))
-                conn.close()
-                logger.info(f"client exit: {addr}")
+            except OSError:
+                # peers dropped by their writer or the send queue policy are
+                # already closed
+                if not peer.is_closed:
+                    self._drop_peer(peer)
+                    logger.info(f"client exit: {peer.addr}")
                 break
             except Exception as exp:
                 logger.error(f"exception: {exp}, \n"
                              f"{traceback.format_exc()}")
-                # print(f"debug: {exp}, {response}")
+                self._drop_peer(peer)
                 break
-        logger.info(f"client: {addr} listening thread end")
+        logger.info(f"client: {peer.addr} listening thread end")
 
     def _keep_accept_conn(self):
         try:
@@ -124,9 +962,8 @@ class Server(object):
                 try:
                     self.tcp_socket.settimeout(0.5)
                     conn, addr = self.tcp_socket.accept()
-                    self.conns.append((conn, addr))
-                    self._keep_receiving(conn, addr)
-                    logger.info(f"new connection from {addr}")
+                    self._configure_conn(conn)
+                    self._keep_receiving(self._add_peer(conn, addr))
                 except socket.timeout:
                     continue
                 except Exception as exp:
@@ -141,26 +978,39 @@ class Server(object):
         self.is_closed = False
         logger.info(f"\n\n\t[Server starting] listening on "
                     f"`{self.host}:{self.port}`")
+        if self.liveness is not None:
+            self._keep_evicting()
         self._keep_accept_conn()
 
     def close(self):
         self.tcp_socket.close()
-        if hasattr(self, "conns"):
-            for conn, addr in self.conns:
-                conn.close()
-            self.conns.clear()
+        if hasattr(self, "peers"):
+            for peer in list(self.peers.values()):
+                self._drop_peer(peer)
+        if getattr(self, "history", None) is not None:
+            self.history.close()
         self.is_closed = True
 
     def __del__(self):
         self.close()
 
 
-def server(port=8902):
+SERVER_MODES = ("aio", "thread")
+
+
+def server(port=8902, mode="aio", **options):
     from sync_clip.utils.util_log import set_scripts_logging
 
     set_scripts_logging(__file__, logger=logger, level=logging.DEBUG,
                         console_log=True, file_mode="a")
-    Server(port=port).start()
+    if mode == "aio":
+        from sync_clip.remote.aio_server import AioServer
+        AioServer(port=port, **options).start()
+    elif mode == "thread":
+        Server(port=port, **options).start()
+    else:
+        raise ValueError(f"invalid server mode: {mode}, "
+                         f"choose from {SERVER_MODES}")
 
 
 if __name__ == "__main__":
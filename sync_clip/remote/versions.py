@@ -0,0 +1,87 @@
+"""
+Origin-tagged versions of clipboard updates.
+
+Every clipboard is stamped with the id of the client it was copied on
+(``origin``) and a Lamport clock: a client copying ticks past every clock it
+has seen, so a copy made after receiving an update is always newer than it.
+Versions, ``(clock, origin)`` pairs, order the updates the same way on every
+peer. A peer drops an update older than the clipboard it holds (overtaken in
+flight, or copied concurrently and lost the tie) and a client drops its own
+updates coming back, no timing involved.
+
+Clock 0 marks an unstamped update (released peers), always taken, the
+server stamps those it relays.
+"""
+import random
+import threading
+from typing import *
+
+# (clock, origin)
+Version = Tuple[int, int]
+UNVERSIONED: Version = (0, 0)
+SERVER_ORIGIN = 0
+
+
+def new_origin() -> int:
+    return random.getrandbits(63) or 1
+
+
+def version_of(sig) -> Version:
+    # signals of released peers have no stamp
+    return getattr(sig, "clock", 0), getattr(sig, "origin", 0)
+
+
+def stamp(sig, version: Version):
+    sig.clock, sig.origin = version
+
+
+class VersionClock(object):
+    """
+    Lamport clock of one origin and the version of the latest clipboard it
+    holds
+    """
+
+    def __init__(self, origin: int = None):
+        self.origin = new_origin() if origin is None else origin
+        self.clock = 0
+        self.latest: Version = UNVERSIONED
+        self._lock = threading.Lock()
+        # counters
+        self.stale = 0
+        self.echoes = 0
+
+    def witness(self, clock: int):
+        with self._lock:
+            self.clock = max(self.clock, clock)
+
+    def tick(self) -> Version:
+        """
+        Version of a new local clipboard, newer than any seen
+        """
+        with self._lock:
+            self.clock += 1
+            self.latest = (self.clock, self.origin)
+            return self.latest
+
+    def accept(self, version: Version) -> bool:
+        """
+        Whether an update of `version` is to be taken: unstamped, or not
+        older than the clipboard held (a repeat of the latest one is taken
+        again), and not this origin's own. It is the one held from now on.
+        """
+        if not version[0]:
+            return True
+        with self._lock:
+            self.clock = max(self.clock, version[0])
+            if version[1] == self.origin and self.origin != SERVER_ORIGIN:
+                self.echoes += 1
+                return False
+            if version < self.latest:
+                self.stale += 1
+                return False
+            self.latest = version
+            return True
+
+    def stats(self) -> dict:
+        return {"clock": self.clock, "latest": self.latest,
+                "stale": self.stale, "echoes": self.echoes}
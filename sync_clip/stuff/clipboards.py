@@ -7,11 +7,14 @@ import logging
 import subprocess
 from abc import ABC, abstractmethod
 from io import BytesIO
-from typing import Union
+from pathlib import Path
+from urllib.parse import urlparse, unquote
+from typing import Union, Callable, Optional, Hashable, Dict, List
 
 from pip._internal.cli.main import main
 
-from sync_clip.utils.utiil_image import reduce_image_size
+from sync_clip.stuff.sync_signal import (MIME_TEXT, MIME_HTML, MIME_PNG,
+                                         MIME_URI_LIST)
 
 logger = logging.getLogger("sync_clip")
 
@@ -50,6 +53,42 @@ class ClipboardSetupException(Exception):
 
 _TIMEOUT = 0.05
 
+CLIPBOARD_BACKENDS = ("auto", "xlib", "xclip")
+
+# formats synced besides the one `Clipboard.read_clip` gives
+EXTRA_FORMATS = (MIME_HTML, MIME_URI_LIST)
+# files copied in GNOME file managers: "copy" or "cut", then the uris
+MIME_GNOME_FILES = "x-special/gnome-copied-files"
+
+
+def format_of(data: Union[str, bytes]) -> str:
+    """
+    Mime type of what `Clipboard.read_clip` gives
+    """
+    if isinstance(data, (bytes, bytearray)) and data[:4] == b"\x89PNG":
+        return MIME_PNG
+    return MIME_TEXT
+
+
+def uri_list_paths(data: bytes) -> List[str]:
+    """
+    Local paths of the file uris of a text/uri-list
+    """
+    paths = []
+    for line in bytes(data).decode("utf-8", errors="replace").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        uri = urlparse(line)
+        if uri.scheme == "file" and uri.netloc in ("", "localhost"):
+            paths.append(unquote(uri.path))
+    return paths
+
+
+def paths_uri_list(paths: List[str]) -> bytes:
+    return "".join(f"{Path(path).absolute().as_uri()}\r\n"
+                   for path in paths).encode()
+
 
 class XclipClipboard(object):
 
@@ -64,7 +103,8 @@ class XclipClipboard(object):
         """
         Copy data into the clipboard
 
-        :param data: the data to be copied to the clipboard. Can be str or bytes.
+        :param data: the data to be copied to the clipboard. Can be str or
+            bytes-like.
         :param encoding: same meaning as in ``subprocess.Popen``.
         :return: None
         """
@@ -73,7 +113,7 @@ class XclipClipboard(object):
             '-selection',
             'clipboard',
         ]
-        if isinstance(data, bytes):
+        if isinstance(data, (bytes, bytearray)):
             if encoding is not None:
                 warnings.warn(
                     "encoding specified with a bytes argument. "
@@ -158,6 +198,23 @@ class XclipClipboard(object):
             )
         return completed_proc.stdout
 
+    def timestamp(self) -> Optional[int]:
+        """
+        The TIMESTAMP target: when the owner took the clipboard, None if the
+        owner does not provide it
+        """
+        # noinspection PyBroadException
+        try:
+            completed_proc = subprocess.run(
+                [self.xclip, '-o', '-selection', 'clipboard', '-t',
+                 'TIMESTAMP'], stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, text=True, timeout=3)
+            if completed_proc.returncode != 0:
+                return None
+            return int(completed_proc.stdout.split()[0])
+        except Exception:
+            return None
+
     def clear(self):
         """
         Clear the clipboard contents
@@ -177,13 +234,76 @@ class Clipboard(ABC):
     def write_clip(self, byte_data):
         pass
 
+    def change_token(self) -> Optional[Hashable]:
+        """
+        A cheap value that changes whenever the clipboard content changes,
+        equal tokens let the caller skip reading the clipboard
+
+        :return: None if the backend cannot tell
+        """
+        return None
+
+    def watch_changes(self, callback: Callable[[], None]) -> bool:
+        """
+        Call `callback` whenever the clipboard content changes
+
+        :return: False if the backend has no change event source and must be
+            polled
+        """
+        return False
+
+    def extra_formats(self) -> Dict[str, bytes]:
+        """
+        The `EXTRA_FORMATS` the clipboard holds besides the content of
+        `read_clip`, e.g. the html of rich text, none if the backend only
+        reads one format
+        """
+        return {}
+
+    def offer_formats(self, sizes: Dict[str, int],
+                      provide: Callable[[str], Optional[bytes]]) -> bool:
+        """
+        Own the clipboard with formats of `sizes` (mime type -> size) read
+        on paste only: `provide` is called with the mime type pasted and
+        blocks until it has the content
+
+        :return: False if the backend can not serve formats on paste, the
+            caller writes one instead
+        """
+        return False
+
+    def copied_files(self) -> List[str]:
+        """
+        Local paths of the files copied, if the clipboard holds a file list
+        (files copied in a file manager), none otherwise
+        """
+        return []
+
+    def write_files(self, paths: List[str]) -> bool:
+        """
+        Own the clipboard with the file list of `paths`, pasted in a file
+        manager as copies of the files
+
+        :return: False if the backend can not hold file lists, the caller
+            writes the paths as text instead
+        """
+        return False
+
     @classmethod
-    def get_clipboard(cls):
+    def get_clipboard(cls, backend="auto"):
         if sys.platform == "win32":
             return WindowsClipboard()
         elif sys.platform == "darwin":
             pass
         elif sys.platform == "linux":
+            if backend in ("auto", "xlib"):
+                try:
+                    return X11Clipboard()
+                except ClipboardSetupException as exp:
+                    if backend == "xlib":
+                        raise
+                    logger.warning(f"in process X11 clipboard unavailable, "
+                                   f"fall back to xclip: {exp}")
             return LinuxClipboard()
 
 
@@ -201,7 +321,8 @@ class WindowsClipboard(Clipboard):
               f"length: {len(data)},\n"
               f"type: {type(data)}")
         try:
-            if isinstance(data, bytes) and data.startswith(b"\x89PNG"):
+            if (isinstance(data, (bytes, bytearray))
+                    and data.startswith(b"\x89PNG")):
                 # image
                 input_data = BytesIO(data)
                 image = Image.open(input_data)
@@ -217,13 +338,16 @@ class WindowsClipboard(Clipboard):
                     self._clip.EmptyClipboard()
                     if isinstance(data, str):
                         self._clip.SetClipboardText(data, 13)
-                    elif isinstance(data, bytes):
+                    elif isinstance(data, (bytes, bytearray)):
                         data = data.decode("utf-8")
                         self._clip.SetClipboardText(data, 13)
 
         finally:
             pass
 
+    def change_token(self):
+        return self._clip.GetClipboardSequenceNumber()
+
     def read_clip(self):
         # noinspection PyBroadException
         try:
@@ -285,6 +409,9 @@ class LinuxClipboard(Clipboard):
 
     def __init__(self):
         self._clip = XclipClipboard()
+        # clipboards written here, the timestamp of the next owner may be
+        # the one of the previous
+        self._copies = 0
         super().__init__()
 
     def read_clip(self):
@@ -298,5 +425,143 @@ class LinuxClipboard(Clipboard):
         return text
 
     def write_clip(self, byte_data):
-        byte_data, _ = reduce_image_size(byte_data)
         self._clip.copy(byte_data)
+        self._copies += 1
+
+    def change_token(self):
+        # one xclip process instead of two plus the whole content. xclip
+        # can not name the owner: owners answering CurrentTime (0) can not
+        # tell their copies apart, they are read whole
+        timestamp = self._clip.timestamp()
+        if not timestamp:
+            return None
+        return self._copies, timestamp
+
+
+class X11Clipboard(LinuxClipboard):
+    """
+    Linux clipboard over python-xlib, no xclip process per read or write and
+    change events through XFixes
+    """
+
+    def __init__(self):
+        try:
+            from sync_clip.stuff.xlib_selection import XlibSelection
+        except ImportError as exp:
+            raise ClipboardSetupException(f"python-xlib is not installed: "
+                                          f"{exp}")
+        self._clip = XlibSelection()
+        self._copies = 0
+
+    def change_token(self):
+        return self._clip.change_token()
+
+    def watch_changes(self, callback: Callable[[], None]) -> bool:
+        return self._clip.watch_changes(callback)
+
+    def extra_formats(self) -> Dict[str, bytes]:
+        return self._clip.paste_targets(EXTRA_FORMATS)
+
+    def offer_formats(self, sizes: Dict[str, int],
+                      provide: Callable[[str], Optional[bytes]]) -> bool:
+        self._clip.offer(sizes, provide)
+        return True
+
+    def copied_files(self) -> List[str]:
+        uris = self._clip.paste_targets([MIME_URI_LIST]).get(MIME_URI_LIST)
+        return uri_list_paths(uris) if uris else []
+
+    def write_files(self, paths: List[str]) -> bool:
+        uris = paths_uri_list(paths)
+        # text first, what `read_clip` gives
+        self._clip.copy_formats({
+            MIME_TEXT: "\n".join(paths).encode("utf-8"),
+            MIME_URI_LIST: uris,
+            MIME_GNOME_FILES:
+                b"copy\n" + uris.replace(b"\r\n", b"\n").rstrip()})
+        return True
+
+
+class FakeClipboard(Clipboard):
+    """
+    In memory clipboard for tests and benchmarks, `write_clip` also stands
+    in for another application copying something, `copy_formats` for one
+    copying several formats (a file manager copies text and a
+    text/uri-list). A `lazy` one takes offered formats, `paste`
+    reads one as an application pasting it would.
+    """
+
+    def __init__(self, data: Union[str, bytes] = b"", lazy=False):
+        self._data = data
+        self._extra: Dict[str, bytes] = {}
+        self.lazy = lazy
+        # mime type -> size of the formats offered, read by `_provide`
+        self._offered: Optional[Dict[str, int]] = None
+        self._provide: Optional[Callable[[str], Optional[bytes]]] = None
+        self._token = 0
+        self.reads = 0
+        self.writes = 0
+
+    def read_clip(self):
+        self.reads += 1
+        if self._offered is not None:
+            return self.paste(next(iter(self._offered)))
+        # a real read copies the content out of the owner
+        if isinstance(self._data, (bytes, bytearray)):
+            return bytes(bytearray(self._data))
+        return self._data
+
+    def write_clip(self, byte_data):
+        self._data = byte_data
+        self._extra = {}
+        self._offered = self._provide = None
+        self._token += 1
+        self.writes += 1
+
+    def copy_formats(self, formats: Dict[str, bytes]):
+        """
+        Copy several formats, the first is the content of `read_clip`
+        """
+        mimes = list(formats)
+        data = formats[mimes[0]]
+        self.write_clip(data.decode("utf-8") if mimes[0] == MIME_TEXT
+                        else data)
+        self._extra = {mime: formats[mime] for mime in mimes[1:]
+                       if mime in EXTRA_FORMATS}
+
+    def paste(self, mime: str) -> Optional[bytes]:
+        if self._offered is not None and mime in self._offered:
+            data = self._provide(mime)
+            if data is not None and mime == MIME_TEXT:
+                return data.decode("utf-8")
+            return data
+        if mime == format_of(self._data):
+            return self._data
+        return self._extra.get(mime)
+
+    def extra_formats(self) -> Dict[str, bytes]:
+        if self._offered is not None:
+            return {mime: self.paste(mime) for mime in self._offered
+                    if mime in EXTRA_FORMATS}
+        return dict(self._extra)
+
+    def offer_formats(self, sizes: Dict[str, int],
+                      provide: Callable[[str], Optional[bytes]]) -> bool:
+        if not self.lazy:
+            return False
+        self._offered, self._provide = dict(sizes), provide
+        self._token += 1
+        self.writes += 1
+        return True
+
+    def copied_files(self) -> List[str]:
+        uris = self.extra_formats().get(MIME_URI_LIST)
+        return uri_list_paths(uris) if uris else []
+
+    def write_files(self, paths: List[str]) -> bool:
+        self.copy_formats({MIME_TEXT: "\n".join(paths).encode("utf-8"),
+                           MIME_URI_LIST: paths_uri_list(paths)})
+        return True
+
+    def change_token(self):
+        return self._token
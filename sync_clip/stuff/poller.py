@@ -0,0 +1,54 @@
+import threading
+
+
+class PollScheduler(object):
+    """
+    When to read the local clipboard next.
+
+    Polls every `min_interval` right after a change (local or written from
+    remote) and backs off by `backoff` on every poll that finds nothing new,
+    up to `max_interval`. Backends with a change event source call `wake`
+    from it; the scheduler then only polls every `max_interval` as a safety
+    net and otherwise sleeps until woken.
+    """
+
+    def __init__(self, min_interval=0.05, max_interval=2.0, backoff=2.0):
+        if not 0 < min_interval <= max_interval:
+            raise ValueError(f"invalid poll intervals: {min_interval}, "
+                             f"{max_interval}")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.event_driven = False
+        self.wakeups = 0
+        self.woken = 0
+        self._wake = threading.Event()
+
+    def timeout(self) -> float:
+        return self.max_interval if self.event_driven else self.interval
+
+    def wait(self) -> bool:
+        """
+        Sleep until the next poll
+
+        :return: True if woken by `wake` before the timeout
+        """
+        woken = self._wake.wait(self.timeout())
+        self._wake.clear()
+        self.wakeups += 1
+        self.woken += woken
+        return woken
+
+    def wake(self):
+        """
+        Poll now, safe to call from any thread (e.g. a backend's event loop)
+        """
+        self.interval = self.min_interval
+        self._wake.set()
+
+    def on_change(self):
+        self.interval = self.min_interval
+
+    def on_idle(self):
+        self.interval = min(self.max_interval, self.interval * self.backoff)
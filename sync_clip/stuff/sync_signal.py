@@ -1,22 +1,168 @@
+# mime types of the formats of a clipboard, see `OfferSignal`
+MIME_TEXT = "text/plain"
+MIME_HTML = "text/html"
+MIME_PNG = "image/png"
+MIME_URI_LIST = "text/uri-list"
+
+
 class SyncSignal(object):
     def __init__(self, data=""):
         self.ip = ""
         self.port = 0
         self.data = data
         self.is_end = True
+        # version of a clipboard: Lamport clock and id of the client it was
+        # copied on, see `sync_clip.remote.versions`, 0 if unstamped
+        self.clock = 0
+        self.origin = 0
 
 
 class HeartbeatSignal(SyncSignal):
-    def __init__(self):
+    def __init__(self, sent_at=0.0, is_ack=False):
         super().__init__(data="Heartbeat")
+        # binary protocol peers echo heartbeats back to measure the rtt
+        self.sent_at = sent_at
+        self.is_ack = is_ack
 
 
 class ConCheck(SyncSignal):
-    def __init__(self):
+    def __init__(self, protocols=(), protocol=0, max_chunk_size=0,
+                 codecs=(), features=(), channel=""):
         super().__init__(data="ConCheck")
+        # protocols offered by the client, protocol chosen by the server
+        self.protocols = list(protocols)
+        self.protocol = protocol
+        # largest frame payload the peer accepts, agreed on by the server
+        self.max_chunk_size = max_chunk_size
+        # compression codecs offered by the client, accepted by the server
+        self.codecs = list(codecs)
+        # optional protocol features offered and accepted, e.g. deltas
+        self.features = list(features)
+        # channel joined, clipboards are only synced within a channel
+        self.channel = channel
 
 
 class SyncData(SyncSignal):
 
-    def __init__(self, data):
+    def __init__(self, data, is_answer=False):
+        super().__init__(data=data)
+        # the payload of a format fetched by digest (see `OfferSignal`), not
+        # a new clipboard
+        self.is_answer = is_answer
+
+
+class SyncDelta(SyncSignal):
+    """
+    A payload encoded as a delta against one the peers synced before, see
+    `sync_clip.remote.delta`
+    """
+
+    def __init__(self, data, is_text=False):
         super().__init__(data=data)
+        self.is_text = is_text
+
+
+class FetchSignal(SyncSignal):
+    """
+    Asks the peer to send the full payload of `digest` again, when a delta
+    base is missing
+    """
+
+    def __init__(self, digest=b""):
+        super().__init__(data="Fetch")
+        self.digest = digest
+
+
+class AnnounceSignal(SyncSignal):
+    """
+    A payload announced by digest, the peer fetches it only if it does not
+    have it already
+    """
+
+    def __init__(self, digest=b"", size=0, is_text=False):
+        super().__init__(data="Announce")
+        self.digest = digest
+        self.size = size
+        self.is_text = is_text
+
+
+class OfferSignal(SyncSignal):
+    """
+    A clipboard offered by its formats, (mime type, digest, size) tuples,
+    the sender's preferred first. Peers fetch a format by digest when it is
+    pasted.
+    """
+
+    def __init__(self, formats=()):
+        super().__init__(data="Offer")
+        self.formats = list(formats)
+
+
+class FilesSignal(SyncSignal):
+    """
+    A file list clipboard, (name, size, digest) tuples of its files, whose
+    content follows on the same stream. `paths` are where the files are on
+    this machine: the ones copied, or the received ones in the cache.
+    """
+
+    def __init__(self, files=(), paths=None):
+        super().__init__(data="Files")
+        self.files = list(files)
+        self.paths = paths
+
+
+class CancelSignal(SyncSignal):
+    """
+    Abandons the DATA (or file list) stream `stream_id` half sent,
+    superseded by a newer clipboard
+    """
+
+    def __init__(self, stream_id=0):
+        super().__init__(data="Cancel")
+        self.stream_id = stream_id
+
+
+class StampSignal(SyncSignal):
+    """
+    Version of the clipboard sent on stream `stream_id`, ahead of its
+    frames
+    """
+
+    def __init__(self, stream_id=0, clock=0, origin=0):
+        super().__init__(data="Stamp")
+        self.stream_id = stream_id
+        self.clock = clock
+        self.origin = origin
+
+
+class HistorySignal(SyncSignal):
+    """
+    Asks the server for a page of its clipboard history, the entries older
+    than sequence `before` (0 for the latest ones). The server answers with
+    the `entries`: (seq, digest, size, is_text, time, preview) tuples, newest
+    first.
+    """
+
+    def __init__(self, before=0, limit=10, entries=None):
+        super().__init__(data="History")
+        self.before = before
+        self.limit = limit
+        self.entries = entries
+
+
+class ResumeSignal(SyncSignal):
+    """
+    Resumable upload `transfer_id` of a large clipboard, see
+    `sync_clip.remote.resume`. Ahead of the frames of DATA stream
+    `stream_id`: they go on with the transfer from `offset` payload bytes.
+    Of no stream: asks the server how much of the transfer it holds, it
+    answers with the `offset` to go on from.
+    """
+
+    def __init__(self, stream_id=0, transfer_id=b"", offset=0,
+                 is_answer=False):
+        super().__init__(data="Resume")
+        self.stream_id = stream_id
+        self.transfer_id = transfer_id
+        self.offset = offset
+        self.is_answer = is_answer
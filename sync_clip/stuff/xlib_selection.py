@@ -0,0 +1,403 @@
+import os
+import time
+import select
+import logging
+import threading
+from typing import *
+
+import Xlib.threaded  # noqa: F401, makes python-xlib displays thread safe
+from Xlib import X, Xatom
+from Xlib.display import Display
+from Xlib.ext import xfixes
+from Xlib.protocol import event as xevent
+
+from sync_clip.utils.util_thread import new_thread_daemon
+from sync_clip.stuff.clipboards import (ClipboardException,
+                                        ClipboardSetupException)
+
+logger = logging.getLogger("sync_clip")
+
+# target name -> property type name
+TEXT_TARGETS = {"UTF8_STRING": "UTF8_STRING",
+                "text/plain;charset=utf-8": "text/plain;charset=utf-8",
+                "text/plain": "text/plain",
+                "STRING": "STRING",
+                "TEXT": "UTF8_STRING"}
+PNG_TARGETS = {"image/png": "image/png"}
+
+
+def mime_targets(mime: str) -> Dict[str, str]:
+    if mime == "text/plain":
+        return TEXT_TARGETS
+    if mime == "image/png":
+        return PNG_TARGETS
+    return {mime: mime}
+
+
+class LazyTarget(object):
+    """
+    Content of an offered format, asked from `provide` on the first request
+    """
+
+    def __init__(self, mime: str, provide: Callable[[str], Optional[bytes]]):
+        self.mime = mime
+        self.provide = provide
+        self._data: Optional[bytes] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[bytes]:
+        with self._lock:
+            if self._data is None:
+                data = self.provide(self.mime)
+                self._data = bytes(data) if data is not None else None
+            return self._data
+
+
+class XlibSelection(object):
+    """
+    The X11 CLIPBOARD selection read and owned in process, the same
+    `copy`/`paste` as `XclipClipboard` without forking xclip.
+
+    Two display connections: one owned by an event thread that serves
+    requests for data we copied (with INCR for large data) and reports
+    owner changes through XFixes, one for reads which block on their own
+    events. Data we copied is only served while this process lives, unlike
+    xclip which leaves a process behind.
+    """
+    READ_TIMEOUT = 3
+    # also the INCR threshold, well below the 256KB max request size
+    CHUNK_SIZE = 128 * 1024
+
+    def __init__(self, display_name: str = None):
+        try:
+            self._display = Display(display_name)
+            self._reader = Display(display_name)
+        except Exception as exp:
+            raise ClipboardSetupException(f"cannot open X display: {exp}")
+        self._atoms: Dict[str, int] = {}
+        self._atom_names: Dict[int, str] = {}
+        # interned up front, the event thread then only reads the cache
+        for name in ("CLIPBOARD", "TARGETS", "TIMESTAMP", "INCR",
+                     "SYNC_CLIP_SELECTION",
+                     *TEXT_TARGETS, *PNG_TARGETS):
+            self._atom(name)
+        self._clipboard = self._atom("CLIPBOARD")
+        self._window = self._create_window(self._display)
+        self._reader_window = self._create_window(self._reader)
+        self._reader_lock = threading.Lock()
+
+        # target atom -> (type atom, data or LazyTarget) of what we copied,
+        # None once lost
+        self._owned: Optional[Dict[int, Tuple[int, Any]]] = None
+        self._copies = 0
+        # (requestor id, property) -> [requestor, type, data, offset]
+        self._transfers: Dict[Tuple[int, int], list] = {}
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = os.pipe()
+        self.is_closed = False
+
+        self._owner_notify = None
+        if self._display.has_extension("XFIXES"):
+            self._display.xfixes_query_version()
+            self._display.xfixes_select_selection_input(
+                self._display.screen().root, self._clipboard,
+                xfixes.XFixesSetSelectionOwnerNotifyMask)
+            self._owner_notify = getattr(self._display.extension_event,
+                                         "SetSelectionOwnerNotify", None)
+        self._display.flush()
+        self._keep_handling_events()
+
+    @classmethod
+    def _create_window(cls, display: Display):
+        return display.screen().root.create_window(
+            0, 0, 1, 1, 0, X.CopyFromParent,
+            event_mask=X.PropertyChangeMask)
+
+    def _atom(self, name: str) -> int:
+        if name not in self._atoms:
+            atom = self._reader.intern_atom(name)
+            self._atoms[name] = atom
+            self._atom_names[atom] = name
+        return self._atoms[name]
+
+    def _atom_name(self, atom: int) -> str:
+        if atom not in self._atom_names:
+            name = self._reader.get_atom_name(atom)
+            self._atoms[name] = atom
+            self._atom_names[atom] = name
+        return self._atom_names[atom]
+
+    def watch_changes(self, callback: Callable[[], None]) -> bool:
+        if self._owner_notify is None:
+            return False
+        self._callbacks.append(callback)
+        return True
+
+    def copy(self, data: Union[str, bytes, bytearray]) -> None:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        data = bytes(data)
+        names = PNG_TARGETS if data.startswith(b"\x89PNG") else TEXT_TARGETS
+        self._own({self._atom(target): (self._atom(prop_type), data)
+                   for target, prop_type in names.items()})
+
+    def copy_formats(self, formats: Dict[str, bytes]) -> None:
+        """
+        Own the selection with several formats (mime type -> content), the
+        first one is what `paste` gives
+        """
+        self._own({self._atom(target): (self._atom(prop_type), bytes(data))
+                   for mime, data in formats.items()
+                   for target, prop_type in mime_targets(mime).items()})
+
+    def offer(self, sizes: Dict[str, int],
+              provide: Callable[[str], Optional[bytes]]) -> None:
+        """
+        Own the selection with the formats of `sizes` (mime type -> size),
+        the content of one is asked from `provide` when first requested,
+        off the event thread
+        """
+        owned = {}
+        for mime in sizes:
+            lazy = LazyTarget(mime, provide)
+            for target, prop_type in mime_targets(mime).items():
+                owned[self._atom(target)] = (self._atom(prop_type), lazy)
+        self._own(owned)
+
+    def _own(self, owned: Dict[int, Tuple[int, Any]]):
+        with self._lock:
+            self._owned = owned
+            self._copies += 1
+            self._window.set_selection_owner(self._clipboard, X.CurrentTime)
+            self._display.flush()
+        os.write(self._wake_w, b"\x00")
+
+    def paste(self) -> bytes:
+        owned = self._owned
+        if owned is not None:
+            # we own the selection, no round trip
+            data = next(iter(owned.values()))[1]
+            if isinstance(data, LazyTarget):
+                data = data.get()
+            return data if data is not None else b""
+        with self._reader_lock:
+            targets = self._convert(self._atom("TARGETS")) or []
+            # same choice as XclipClipboard.paste: mime types only,
+            # text/plain first
+            available = [name for name in map(self._atom_name, targets)
+                         if name.islower()]
+            if "text/plain" in available:
+                target = "text/plain"
+            elif available:
+                target = available[0]
+            else:
+                target = "UTF8_STRING"
+            data = self._convert(self._atom(target))
+            return bytes(data) if data is not None else b""
+
+    def paste_targets(self, mimes: Iterable[str]) -> Dict[str, bytes]:
+        """
+        The content of the formats of `mimes` the owner has
+        """
+        owned, found = self._owned, {}
+        if owned is not None:
+            for mime in mimes:
+                data = owned.get(self._atom(mime), (None, None))[1]
+                if isinstance(data, LazyTarget):
+                    data = data.get()
+                if data is not None:
+                    found[mime] = data
+            return found
+        with self._reader_lock:
+            targets = set(map(self._atom_name,
+                              self._convert(self._atom("TARGETS")) or []))
+            for mime in mimes:
+                if mime in targets:
+                    data = self._convert(self._atom(mime))
+                    if data is not None:
+                        found[mime] = bytes(data)
+        return found
+
+    def change_token(self) -> Optional[tuple]:
+        """
+        Selection owner and its TIMESTAMP, two small round trips whatever
+        the clipboard size
+        """
+        if self._owned is not None:
+            return self._window.id, self._copies
+        with self._reader_lock:
+            owner = self._reader.get_selection_owner(self._clipboard)
+            owner = getattr(owner, "id", owner)
+            if owner == X.NONE:
+                return X.NONE, 0
+            try:
+                timestamp = self._convert(self._atom("TIMESTAMP"))
+            except ClipboardException:
+                return None
+        if not timestamp:
+            return None
+        return owner, int(timestamp[0])
+
+    def _convert(self, target: int):
+        prop = self._atom("SYNC_CLIP_SELECTION")
+        window = self._reader_window
+        window.convert_selection(self._clipboard, target, prop, X.CurrentTime)
+        self._reader.flush()
+        deadline = time.monotonic() + self.READ_TIMEOUT
+        ev = self._wait_event(
+            lambda e: (e.type == X.SelectionNotify
+                       and e.requestor.id == window.id
+                       and e.target == target), deadline)
+        if ev.property == X.NONE:
+            return None
+
+        reply = window.get_full_property(prop, X.AnyPropertyType)
+        window.delete_property(prop)
+        self._reader.flush()
+        if reply is None:
+            return None
+        if reply.property_type != self._atom("INCR"):
+            return reply.value
+
+        # the owner sends chunks, each after we deleted the previous one
+        parts = []
+        while True:
+            deadline = time.monotonic() + self.READ_TIMEOUT
+            self._wait_event(
+                lambda e: (e.type == X.PropertyNotify
+                           and e.window.id == window.id and e.atom == prop
+                           and e.state == X.PropertyNewValue), deadline)
+            reply = window.get_full_property(prop, X.AnyPropertyType)
+            window.delete_property(prop)
+            self._reader.flush()
+            if reply is None or not len(reply.value):
+                return b"".join(parts)
+            parts.append(bytes(reply.value))
+
+    def _wait_event(self, match: Callable[[Any], bool], deadline: float):
+        while True:
+            while self._reader.pending_events():
+                ev = self._reader.next_event()
+                if match(ev):
+                    return ev
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ClipboardException("read clipboard timed out")
+            select.select([self._reader.fileno()], [], [], remaining)
+
+    @new_thread_daemon
+    def _keep_handling_events(self):
+        fds = [self._display.fileno(), self._wake_r]
+        while True:
+            with self._lock:
+                if self.is_closed:
+                    return
+                while self._display.pending_events():
+                    # noinspection PyBroadException
+                    try:
+                        self._handle_event(self._display.next_event())
+                    except Exception as exp:
+                        logger.error(f"handle X event failed, error: {exp}")
+                self._display.flush()
+            # events may be queued by requests made under the lock, hence the
+            # timeout
+            readable, _, _ = select.select(fds, [], [], 0.5)
+            if self._wake_r in readable:
+                os.read(self._wake_r, 512)
+
+    def _handle_event(self, ev):
+        if ev.type == X.SelectionRequest:
+            self._serve_request(ev)
+        elif ev.type == X.SelectionClear:
+            if ev.selection == self._clipboard:
+                self._owned = None
+        elif ev.type == X.PropertyNotify:
+            if ev.state == X.PropertyDelete:
+                self._continue_transfer(ev.window, ev.atom)
+        elif (self._owner_notify is not None
+              and (ev.type, getattr(ev, "sub_code", None))
+              == self._owner_notify):
+            for callback in self._callbacks:
+                callback()
+
+    def _serve_request(self, ev):
+        requestor, owned = ev.requestor, self._owned
+        # obsolete clients leave the property to us
+        prop = ev.property or ev.target
+        if owned is None or ev.selection != self._clipboard:
+            prop = X.NONE
+        elif ev.target == self._atom("TARGETS"):
+            requestor.change_property(prop, Xatom.ATOM, 32,
+                                      [self._atom("TARGETS"), *owned])
+        elif ev.target in owned:
+            prop_type, data = owned[ev.target]
+            if isinstance(data, LazyTarget):
+                self._serve_lazy(ev, prop, prop_type, data)
+                return
+            self._put_data(requestor, prop, prop_type, data)
+        else:
+            prop = X.NONE
+        self._notify_requestor(ev, prop)
+
+    @staticmethod
+    def _notify_requestor(ev, prop: int):
+        ev.requestor.send_event(xevent.SelectionNotify(
+            time=ev.time, requestor=ev.requestor, selection=ev.selection,
+            target=ev.target, property=prop))
+
+    def _put_data(self, requestor, prop: int, prop_type: int, data: bytes):
+        if len(data) > self.CHUNK_SIZE:
+            requestor.change_attributes(event_mask=X.PropertyChangeMask)
+            requestor.change_property(prop, self._atom("INCR"), 32,
+                                      [len(data)])
+            self._transfers[(requestor.id, prop)] = [requestor, prop_type,
+                                                     data, 0]
+        else:
+            requestor.change_property(prop, prop_type, 8, data)
+
+    @new_thread_daemon
+    def _serve_lazy(self, ev, prop: int, prop_type: int, lazy: LazyTarget):
+        """
+        Answer a request once the content is fetched, the event thread keeps
+        serving meanwhile
+        """
+        # noinspection PyBroadException
+        try:
+            data = lazy.get()
+        except Exception as exp:
+            logger.error(f"fetch offered {lazy.mime} failed, error: {exp}")
+            data = None
+        with self._lock:
+            if self.is_closed:
+                return
+            if data is None:
+                prop = X.NONE
+            else:
+                self._put_data(ev.requestor, prop, prop_type, data)
+            self._notify_requestor(ev, prop)
+            self._display.flush()
+        os.write(self._wake_w, b"\x00")
+
+    def _continue_transfer(self, window, prop: int):
+        transfer = self._transfers.get((window.id, prop))
+        if transfer is None:
+            return
+        requestor, prop_type, data, offset = transfer
+        chunk = data[offset:offset + self.CHUNK_SIZE]
+        # an empty chunk ends the transfer
+        requestor.change_property(prop, prop_type, 8, chunk)
+        if chunk:
+            transfer[3] = offset + len(chunk)
+        else:
+            del self._transfers[(window.id, prop)]
+
+    def close(self):
+        if self.is_closed:
+            return
+        self.is_closed = True
+        os.write(self._wake_w, b"\x00")
+        with self._lock:
+            self._display.close()
+        with self._reader_lock:
+            self._reader.close()
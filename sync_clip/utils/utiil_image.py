@@ -1,11 +1,24 @@
+import os
+import math
+import time
+import logging
+import threading
+import multiprocessing
+from hashlib import blake2b
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
 from PIL import Image
 from io import BytesIO
 from typing import *
 
+from sync_clip.utils.util_hash import hash_data, DIGEST_SIZE
 
-def get_output_data(im: Image.Image, image_format="png"):
+logger = logging.getLogger("sync_clip")
+
+
+def get_output_data(im: Image.Image, image_format="png", **params):
     output = BytesIO()
-    im.save(output, format=image_format)
+    im.save(output, format=image_format, **params)
     data = output.getvalue()
     return data
 
@@ -16,28 +29,258 @@ class Box(object):
         self.flag = flag
 
 
+class ImageReducer(object):
+    """
+    Shrinks an encoded image until it fits `limit_size`, landing within
+    `tolerance` under it.
+
+    The encoded size is modelled as `size = a * scale ** k`: the first scale
+    is predicted from the input's bytes per pixel (k = 2), every encode then
+    refits the model, so it usually lands in two or three encodes. The
+    search resizes with a bilinear filter and encodes with zlib level 1;
+    the result that lands is returned as is. Results are memoized by input
+    digest so the same image is never reduced twice.
+    """
+    MAX_ENCODES = 6
+    CACHE_SIZE = 16
+    FAST_PARAMS = {"png": {"compress_level": 1}}
+
+    def __init__(self, limit_size: int = 1024 * 1024, image_format="png",
+                 tolerance: int = 40000):
+        self.limit_size = limit_size
+        self.image_format = image_format
+        self.tolerance = tolerance
+        self.encodes = 0
+        self._cache: Dict[bytes, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key: bytes) -> Optional[bytes]:
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        return None
+
+    def _remember(self, key: bytes, data: bytes):
+        with self._lock:
+            self._cache[key] = data
+            while len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def _encode(self, im: Image.Image, scale: float) -> bytes:
+        width, height = im.size
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        self.encodes += 1
+        return get_output_data(
+            im.resize(size, Image.BILINEAR, reducing_gap=3.0),
+            image_format=self.image_format,
+            **self.FAST_PARAMS.get(self.image_format.lower(), {}))
+
+    def reduce(self, byte_datas: bytes) -> Tuple[bytes, bool]:
+        self.encodes = 0
+        if len(byte_datas) <= self.limit_size:
+            return byte_datas, False
+        key = hash_data(byte_datas)
+        output_data = self._cached(key)
+        if output_data is not None:
+            return output_data, True
+
+        im: Image.Image = Image.open(BytesIO(byte_datas))
+        im.load()
+        target = self.limit_size - self.tolerance / 2
+        # (scale, encoded size), the input counts as encoded at scale 1
+        last = (1.0, len(byte_datas))
+        k = 2.0
+        scale = math.sqrt(target / len(byte_datas))
+        best = None
+        while True:
+            output_data = self._encode(im, scale)
+            size = len(output_data)
+            logger.debug(f"scale: {scale:.3f}, size: {size}")
+            if size <= self.limit_size:
+                if best is None or size > len(best[1]):
+                    best = (scale, output_data)
+                if size > self.limit_size - self.tolerance:
+                    break
+            if self.encodes >= self.MAX_ENCODES and best is not None:
+                # stop searching, take the largest that fits
+                scale, output_data = best
+                break
+            if last[0] != scale and last[1] != size:
+                k = math.log(size / last[1]) / math.log(scale / last[0])
+                k = min(3.0, max(0.5, k))
+            last = (scale, size)
+            scale = scale * (target / size) ** (1 / k)
+            if self.encodes >= self.MAX_ENCODES:
+                # nothing fits yet, be conservative
+                scale *= 0.9
+
+        width, height = im.size
+        reduced = (int(width * scale), int(height * scale))
+        logger.debug(f"reduce size to {reduced}, "
+                     f"filesize: {len(output_data)}, "
+                     f"encodes: {self.encodes}")
+        self._remember(key, output_data)
+        return output_data, True
+
+
+_reducers: Dict[tuple, ImageReducer] = {}
+
+
 def reduce_image_size(byte_datas: bytes,
                       limit_size: int = 1024 * 1024,
                       image_format="png") -> Tuple[bytes, bool]:
-    if len(byte_datas) <= limit_size:
-        return byte_datas, False
-    input_data = BytesIO(byte_datas)
-    im: Image.Image = Image.open(input_data)
-    asa, sa = 0.5, 0.5
-    width, height = im.size
-    allow_max_diff = -40000
-    while True:
-        a_width, a_height = int(width * sa), int(height * sa)
-        new_im = im.resize((a_width, a_height))
-        output_data = get_output_data(new_im, image_format=image_format)
-        diff = len(output_data) - limit_size
-        print(f"sa: {sa}, diff: {diff}")
-        if allow_max_diff < diff < 0:
-            print(f"reduce size to {(a_width, a_height)},"
-                  f" filesize: {len(output_data)}")
-            return output_data, True
-        asa = asa / 2
-        if diff < allow_max_diff:
-            sa = sa + asa
-        else:
-            sa = sa - asa
+    key = (limit_size, image_format)
+    if key not in _reducers:
+        _reducers[key] = ImageReducer(limit_size, image_format)
+    return _reducers[key].reduce(byte_datas)
+
+
+def canonical_pixels(im: Image.Image) -> Image.Image:
+    """
+    `im` as RGB, or RGBA if it has transparency: a palette, grey or opaque
+    RGBA image has the pixels of its RGB encoding
+    """
+    has_alpha = im.mode in ("RGBA", "LA", "PA") or "transparency" in im.info
+    mode = "RGBA" if has_alpha else "RGB"
+    if im.mode != mode:
+        im = im.convert(mode)
+    if has_alpha and im.getchannel("A").getextrema() == (255, 255):
+        im = im.convert("RGB")
+    return im
+
+
+def pixel_digest(data: bytes) -> Optional[bytes]:
+    """
+    Digest of a decoded image: size, mode and raw pixels, the same for every
+    encoding of it (a clipboard round trip may re-encode it), None if
+    `data` is not an image PIL decodes
+    """
+    # noinspection PyBroadException
+    try:
+        im: Image.Image = Image.open(BytesIO(data))
+        im.load()
+    except Exception as exp:
+        logger.debug(f"not a decodable image: {exp}")
+        return None
+    im = canonical_pixels(im)
+    h = blake2b(f"{im.size} {im.mode}".encode(), digest_size=DIGEST_SIZE)
+    h.update(im.tobytes())
+    return h.digest()
+
+
+class PixelDigests(object):
+    """
+    `pixel_digest` of images, decoded in `pool` (in the calling thread
+    without one). Memoized by the digest of the encoded bytes, each encoding
+    is decoded once; the decodes still running are memoized too, so a
+    digest submitted early is found by its key.
+    """
+    CACHE_SIZE = 32
+
+    def __init__(self, pool: "ImagePool" = None):
+        self.pool = pool or ImagePool(max_workers=0)
+        self.decodes = 0
+        self._cache: Dict[bytes, Future] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, data: bytes, key: bytes = None) -> Future:
+        """
+        :param key: `hash_data(data)`, if already computed
+        """
+        key = hash_data(data) if key is None else key
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            self.decodes += 1
+            future = self._cache[key] = Future()
+            while len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+        def decoded(done: Future):
+            if done.exception() is None:
+                future.set_result(done.result())
+                return
+            # not memoized, the next submit tries again
+            with self._lock:
+                if self._cache.get(key) is future:
+                    del self._cache[key]
+            future.set_exception(done.exception())
+
+        self.pool.pixel_digest(data).add_done_callback(decoded)
+        return future
+
+    def submitted(self, key: bytes) -> Optional[Future]:
+        with self._lock:
+            return self._cache.get(key)
+
+    def digest(self, data: bytes, key: bytes = None) -> Optional[bytes]:
+        """
+        :return: None if `data` is not an image PIL decodes
+        """
+        return self.submit(data, key).result()
+
+
+def is_png_image(data) -> bool:
+    return (isinstance(data, (bytes, bytearray))
+            and data[:4] == b"\x89PNG")
+
+
+def _exit_with_parent(parent_pid: int):
+    """
+    Worker initializer, a killed client must not leave workers behind
+    """
+
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+class ImagePool(object):
+    """
+    Image decoding, resizing and encoding in worker processes, PIL holds
+    the GIL and would stall the network threads (and the monitor's compare
+    lock). `max_workers=0` runs the work in the calling thread instead.
+    """
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # forking a process with running threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_exit_with_parent, initargs=(os.getpid(),))
+            return self._executor
+
+    def _submit(self, fn: Callable, byte_datas: bytes, *args) -> Future:
+        if not self.max_workers:
+            future = Future()
+            try:
+                future.set_result(fn(byte_datas, *args))
+            except Exception as exp:
+                future.set_exception(exp)
+            return future
+        return self._get_executor().submit(fn, bytes(byte_datas), *args)
+
+    def reduce_image_size(self, byte_datas: bytes,
+                          limit_size: int = 1024 * 1024) -> Future:
+        return self._submit(reduce_image_size, byte_datas, limit_size)
+
+    def pixel_digest(self, byte_datas: bytes) -> Future:
+        return self._submit(pixel_digest, byte_datas)
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
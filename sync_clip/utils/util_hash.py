@@ -1,10 +1,120 @@
-from hashlib import blake2b, md5
+import struct
+from hashlib import blake2b
+from typing import *
 
+DIGEST_SIZE = 16
 
-def hash_data(data):
-    if not isinstance(data, bytes):
+
+def hash_data(data) -> bytes:
+    if isinstance(data, str):
         data = data.encode()
-    return md5(data).hexdigest()
+    return blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+def hash_file(path: str, block_size=1024 * 1024) -> bytes:
+    """
+    `hash_data` of the content of the file at `path`, read in blocks
+    """
+    h = blake2b(digest_size=DIGEST_SIZE)
+    block = memoryview(bytearray(block_size))
+    with open(path, "rb", buffering=0) as file:
+        size = file.readinto(block)
+        while size:
+            h.update(block[:size])
+            size = file.readinto(block)
+    return h.digest()
+
+
+def png_size(data) -> Optional[Tuple[int, int]]:
+    """
+    (width, height) of a PNG from its header, without decoding it
+    """
+    if len(data) < 24 or data[12:16] != b"IHDR":
+        return None
+    return struct.unpack("!II", data[16:24])
+
+
+class Fingerprint(object):
+    """
+    Identity of one clipboard content, cheap signals first.
+
+    Kind, length and a digest of samples (head, tail and a few blocks spread
+    over the middle) are computed on construction; payloads up to
+    `SAMPLE_LIMIT` are sampled whole, so for them the sample is exact and
+    doubles as the full digest. The full digest of larger payloads is only
+    computed when needed: the cheap signals only tell content apart, two
+    fingerprints are equal when they match and so do the full digests.
+
+    A PNG may also be given the digest of its decoded pixels (`pixels`, see
+    `utiil_image.PixelDigests`): two such fingerprints are equal when the
+    pixels are, whatever the encodings.
+    """
+    SAMPLE_LIMIT = 64 * 1024
+    SAMPLE_SIZE = 4 * 1024
+    SAMPLE_BLOCKS = 16
+    BLOCK_SIZE = 256
+
+    def __init__(self, data: Union[str, bytes, bytearray, memoryview]):
+        if isinstance(data, str):
+            data = data.encode()
+        self.kind = "png" if data[:4] == b"\x89PNG" else "data"
+        self.length = len(data)
+        self.sample = self._sample(memoryview(data))
+        self.image_size = png_size(data) if self.kind == "png" else None
+        self.pixels: Optional[bytes] = None
+        if self.is_exact:
+            self._data, self._digest = None, self.sample
+        else:
+            self._data, self._digest = data, None
+
+    @property
+    def is_exact(self) -> bool:
+        return self.length <= self.SAMPLE_LIMIT
+
+    @classmethod
+    def _sample(cls, view: memoryview) -> bytes:
+        if len(view) <= cls.SAMPLE_LIMIT:
+            return blake2b(view, digest_size=DIGEST_SIZE).digest()
+        h = blake2b(digest_size=DIGEST_SIZE)
+        h.update(view[:cls.SAMPLE_SIZE])
+        h.update(view[-cls.SAMPLE_SIZE:])
+        stride = len(view) // cls.SAMPLE_BLOCKS
+        for i in range(1, cls.SAMPLE_BLOCKS):
+            h.update(view[i * stride:i * stride + cls.BLOCK_SIZE])
+        return h.digest()
+
+    def digest(self) -> bytes:
+        if self._digest is None:
+            self._digest = hash_data(self._data)
+        # the payload is not needed anymore
+        self._data = None
+        return self._digest
+
+    def may_be_same_image(self, other: Optional["Fingerprint"]) -> bool:
+        """
+        Whether `other` may be this image encoded differently, and has the
+        pixel digest to tell
+        """
+        return (other is not None and other.pixels is not None
+                and self.image_size is not None
+                and self.image_size == other.image_size)
+
+    def __eq__(self, other):
+        if not isinstance(other, Fingerprint):
+            return NotImplemented
+        if self.pixels is not None and other.pixels is not None:
+            return self.pixels == other.pixels
+        if (self.kind, self.length, self.sample) != (
+                other.kind, other.length, other.sample):
+            return False
+        # an edit the samples miss keeps them the same
+        return self.digest() == other.digest()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return (f"Fingerprint({self.kind}, {self.length}, "
+                f"{self.sample.hex()[:8]})")
 
 
 if __name__ == "__main__":
@@ -12,10 +122,5 @@ if __name__ == "__main__":
                         self.this_clip.set_to_clip(clip_data.data)
                         self._last_hash_clip_data = h_data
                         sync_sample = clip_data.data[:1000]"""
-    print(hash_data(data))
-    data = b"""                    if h_data != self._last_hash_clip_data:
-                        self.this_clip.set_to_clip(clip_data.data)
-                        self._last_hash_clip_data = h_data
-                        sync_sample = clip_data.data[:1000]"""
-    print(hash_data(data))
-
+    print(hash_data(data).hex())
+    print(Fingerprint(data) == Fingerprint(data.encode()))
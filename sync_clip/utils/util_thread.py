@@ -1,5 +1,7 @@
 import functools
+from queue import Queue
 from threading import Thread
+from collections import deque
 
 
 def new_thread(func):
@@ -16,3 +18,19 @@ def new_thread_daemon(func):
         Thread(target=func, args=args, kwargs=kwargs, daemon=True).start()
 
     return wrapper
+
+
+class LatestQueue(Queue):
+    """
+    Queue keeping only the newest item, a put replaces the one not taken yet
+    """
+
+    def _init(self, maxsize):
+        self.queue = deque(maxlen=1)
+        # items replaced before they were taken
+        self.replaced = 0
+
+    def _put(self, item):
+        if self.queue:
+            self.replaced += 1
+        self.queue.append(item)
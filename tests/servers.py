@@ -0,0 +1,74 @@
+"""
+Servers for the tests, on a free port of the loopback
+"""
+import os
+import sys
+import time
+import socket
+import logging
+import threading
+import subprocess
+
+from sync_clip.remote.aio_server import AioServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER_CODE = """
+import sys, logging
+sys.path.insert(0, sys.argv[2])
+from sync_clip.remote.aio_server import AioServer
+logging.getLogger("sync_clip").setLevel(logging.CRITICAL)
+server = AioServer(host="127.0.0.1", port=int(sys.argv[1]))
+print("ready", flush=True)
+server.start()
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_listening(port: int, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def start_server(cls=AioServer, **options) -> AioServer:
+    """
+    A server of `cls` serving in a thread, close it when done
+    """
+    logging.getLogger("sync_clip").setLevel(logging.CRITICAL)
+    server = cls(host="127.0.0.1", port=free_port(), **options)
+    threading.Thread(target=server.start, daemon=True).start()
+    wait_listening(server.port)
+    return server
+
+
+def spawn_server(port: int, env: dict = None) -> subprocess.Popen:
+    """
+    A server in its own process, to be killed
+    """
+    server = subprocess.Popen(
+        [sys.executable, "-c", SERVER_CODE, str(port), ROOT],
+        stdout=subprocess.PIPE, text=True, env=env)
+    server.stdout.readline()
+    wait_listening(port)
+    return server
+
+
+def wait(condition, timeout=3.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return False
@@ -0,0 +1,42 @@
+import os
+import unittest
+import tracemalloc
+
+from sync_clip.remote.compression import *
+
+
+class DecompressorTest(unittest.TestCase):
+
+    def test_round_trip_by_chunks(self):
+        payload = os.urandom(64 * 1024) * 40
+        for codec_id in SUPPORTED_CODECS:
+            with self.subTest(codec=CODECS[codec_id].name):
+                compressed = CODECS[codec_id].compress(payload)
+                decompressor = Decompressor(codec_id, bytearray(),
+                                            len(payload))
+                for start in range(0, len(compressed), 7000):
+                    decompressor.feed(compressed[start:start + 7000])
+                self.assertEqual(decompressor.finish(), payload)
+
+    def test_over_expanding_frame(self):
+        # 32KB of 256MB of zeros compressed, announced as 2000 bytes
+        zeros = bytes(256 * 1024 * 1024)
+        chunks = {codec_id: CODECS[codec_id].compress(zeros)[:32 * 1024]
+                  for codec_id in SUPPORTED_CODECS}
+        del zeros
+        for codec_id, chunk in chunks.items():
+            with self.subTest(codec=CODECS[codec_id].name):
+                decompressor = Decompressor(codec_id, bytearray(2000))
+                tracemalloc.start()
+                try:
+                    with self.assertRaises(CompressionError):
+                        decompressor.feed(chunk)
+                    _, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                # the chunk was not decompressed whole
+                self.assertLess(peak, 1024 * 1024)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+
+from sync_clip.stuff.clipboards import Clipboard, FakeClipboard
+from sync_clip.stuff.sync_signal import SyncData
+from sync_clip.monitor import ClipboardMonitor
+
+from servers import start_server, wait
+
+COPIES = 40
+ROUNDS = 20
+
+
+class UserClipboard(FakeClipboard):
+    """
+    `copy` is the user copying, `write_clip` the monitor writing; a
+    `reencoding` one changes the bytes written and has no change token
+    """
+
+    def __init__(self, reencoding=False):
+        super().__init__()
+        self.reencoding = reencoding
+        self.copied = set()
+        self.echoes = 0
+
+    def copy(self, data: bytes):
+        self.copied.add(data)
+        FakeClipboard.write_clip(self, data)
+
+    def write_clip(self, data):
+        if self.reencoding:
+            data = bytes(data) + b"-reencoded"
+        FakeClipboard.write_clip(self, data)
+
+    def change_token(self):
+        return None if self.reencoding else super().change_token()
+
+    def held(self) -> bytes:
+        return bytes(self._data).replace(b"-reencoded", b"")
+
+
+def image(name: str) -> bytes:
+    return b"\x89PNG\r\n\x1a\n" + name.encode()
+
+
+class EchoTest(unittest.TestCase):
+    """
+    Three monitors on in-memory clipboards sharing a server: A and B copy
+    in turns, C only watches, then A and B copy at the same moment
+    """
+
+    def setUp(self):
+        self.server = start_server(history_size=0)
+        self.get_clipboard = Clipboard.__dict__["get_clipboard"]
+        self.clips = []
+        self.monitors = []
+
+    def tearDown(self):
+        for monitor in self.monitors:
+            monitor.close()
+        self.server.close()
+        Clipboard.get_clipboard = self.get_clipboard
+
+    def start_monitors(self, reencoding: bool):
+        def get_clipboard(cls, backend="auto"):
+            self.clips.append(UserClipboard(reencoding))
+            return self.clips[-1]
+
+        Clipboard.get_clipboard = classmethod(get_clipboard)
+        for _ in range(3):
+            monitor = ClipboardMonitor("127.0.0.1", self.server.port,
+                                       poll_max_interval=0.1)
+            self.monitors.append(monitor)
+            self.count_echoes(monitor)
+            monitor.start()
+        self.assertTrue(wait(lambda: all(monitor.rclip.is_connected
+                                         for monitor in self.monitors)))
+
+    @staticmethod
+    def count_echoes(monitor: ClipboardMonitor):
+        send_sync_data, clip = monitor.rclip.send_sync_data, monitor.tclip
+
+        def send(signal, *args, **kwargs):
+            # sent, but not copied on this clipboard
+            if isinstance(signal, SyncData) and signal.data not in clip.copied:
+                clip.echoes += 1
+            return send_sync_data(signal, *args, **kwargs)
+
+        monitor.rclip.send_sync_data = send
+
+    def check_no_echoes(self, reencoding: bool):
+        self.start_monitors(reencoding)
+        a, b, c = self.clips
+        lost = 0
+        for index in range(COPIES):
+            copier, other = (a, b) if index % 2 == 0 else (b, a)
+            data = image(f"copy {index}")
+            copier.copy(data)
+            if not wait(lambda: other.held() == data == c.held()):
+                lost += 1
+        diverged = 0
+        for index in range(ROUNDS):
+            a.copy(image(f"a {index}"))
+            b.copy(image(f"b {index}"))
+            if not wait(lambda: a.held() == b.held() == c.held()):
+                diverged += 1
+        # echoes of the last copies
+        wait(lambda: False, timeout=1.0)
+        self.assertEqual(sum(clip.echoes for clip in self.clips), 0)
+        self.assertEqual(lost, 0, f"{lost}/{COPIES} copies lost")
+        self.assertEqual(diverged, 0, f"{diverged}/{ROUNDS} rounds diverged")
+
+    def test_no_echoes(self):
+        self.check_no_echoes(reencoding=False)
+
+    def test_no_echoes_reencoding(self):
+        self.check_no_echoes(reencoding=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
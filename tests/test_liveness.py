@@ -0,0 +1,78 @@
+import time
+import socket
+import threading
+import unittest
+
+from sync_clip.stuff.sync_signal import *
+from sync_clip.remote.protocol import *
+from sync_clip.remote.server import Server
+from sync_clip.remote.aio_server import AioServer
+
+from servers import start_server
+
+TIMEOUT = 1.0
+# the evictions check wakes up at the next deadline
+SLACK = 0.5
+HEARTBEAT = encode_legacy(HeartbeatSignal())
+
+
+def closed_after(conn: socket.socket, limit: float) -> Optional[float]:
+    """
+    Seconds until the server closed `conn`, None if it did not in `limit`
+    """
+    start = time.monotonic()
+    conn.settimeout(0.05)
+    while time.monotonic() - start < limit:
+        try:
+            if not conn.recv(4096):
+                return time.monotonic() - start
+        except socket.timeout:
+            continue
+        except ConnectionError:
+            return time.monotonic() - start
+    return None
+
+
+class LivenessTest(unittest.TestCase):
+    """
+    A peer falling silent (its socket open, like a suspended laptop) is
+    evicted once its deadline passed, a beating one is kept
+    """
+
+    def check_eviction(self, cls):
+        server = start_server(cls, history_size=0, liveness_timeout=TIMEOUT)
+        silent = socket.create_connection(("127.0.0.1", server.port))
+        beating = socket.create_connection(("127.0.0.1", server.port))
+        is_beating = [True]
+
+        def beat():
+            while is_beating[0]:
+                beating.sendall(HEARTBEAT)
+                time.sleep(TIMEOUT / 5)
+
+        beater = threading.Thread(target=beat, daemon=True)
+        try:
+            beater.start()
+            silent.sendall(HEARTBEAT)
+            seconds = closed_after(silent, TIMEOUT + SLACK + 1)
+            self.assertIsNotNone(seconds, "the silent peer was not evicted")
+            self.assertGreaterEqual(seconds, TIMEOUT * 0.9)
+            self.assertLessEqual(seconds, TIMEOUT + SLACK)
+            self.assertIsNone(closed_after(beating, TIMEOUT),
+                              "a beating peer was evicted")
+        finally:
+            is_beating[0] = False
+            beater.join()
+            silent.close()
+            beating.close()
+            server.close()
+
+    def test_aio_server(self):
+        self.check_eviction(AioServer)
+
+    def test_threaded_server(self):
+        self.check_eviction(Server)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import time
+import threading
+import unittest
+
+from sync_clip.stuff.sync_signal import *
+from sync_clip.remote.client import Client
+
+from servers import start_server, wait
+
+SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+HEARTBEAT_INTERVAL = 0.02
+# a heartbeat waits for the chunk being written, 8 ms at `RATE`
+MAX_RTT = 0.1
+
+
+class LimitedClient(Client):
+    """
+    Writes `RATE` bytes per second, a link the image takes a second on
+    """
+    RATE = 8 * 1024 * 1024
+
+    def _write_frames(self, conn, buffers):
+        super()._write_frames(conn, buffers)
+        time.sleep(sum(len(buffer) for buffer in buffers) / self.RATE)
+
+
+class PriorityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = start_server(history_size=0)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.close()
+
+    def connect(self, cls=Client) -> Client:
+        # no announces nor deltas, the image goes in full
+        client = cls("127.0.0.1", self.server.port, features=())
+        client.start()
+        self.clients.append(client)
+        return client
+
+    def test_heartbeats_during_a_large_send(self):
+        receiver = self.connect()
+        sender = self.connect(LimitedClient)
+        sender.chunk_sizer.set_max_chunk_size(CHUNK_SIZE)
+        self.assertTrue(wait(lambda: receiver.is_connected
+                             and sender.is_connected))
+        # (sent at, round trip) of the heartbeats acked
+        rtts = []
+        record_rtt = sender.chunk_sizer.record_rtt
+
+        def on_ack(seconds: float):
+            rtts.append((time.monotonic() - seconds, seconds))
+            record_rtt(seconds)
+
+        sender.chunk_sizer.record_rtt = on_ack
+        is_beating = [True]
+
+        def beat():
+            while is_beating[0]:
+                sender.send_sync_data(HeartbeatSignal(
+                    sent_at=time.monotonic()))
+                time.sleep(HEARTBEAT_INTERVAL)
+
+        beater = threading.Thread(target=beat, daemon=True)
+        beater.start()
+        image = os.urandom(SIZE)
+        try:
+            start = time.monotonic()
+            sender.send_sync_data(SyncData(image))
+            self.assertEqual(receiver.recv_sync_sig.get(timeout=30).data,
+                             image)
+            end = time.monotonic()
+            # acks of the last heartbeats
+            time.sleep(0.2)
+        finally:
+            is_beating[0] = False
+            beater.join()
+        during = [seconds for at, seconds in rtts if start <= at <= end]
+        # heartbeats went in between the chunks of the image
+        self.assertGreater(len(during),
+                           (end - start) / HEARTBEAT_INTERVAL / 4)
+        self.assertLess(max(during), MAX_RTT)
+
+
+if __name__ == "__main__":
+    unittest.main()
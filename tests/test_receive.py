@@ -0,0 +1,52 @@
+import os
+import socket
+import threading
+import unittest
+import tracemalloc
+
+from sync_clip.stuff.sync_signal import *
+from sync_clip.remote.protocol import *
+
+CHUNK_SIZE = 25 * 1024
+
+
+class ReceiveTest(unittest.TestCase):
+    """
+    A payload of binary frames is received into one buffer of its size
+    """
+
+    def receive(self, data: bytes) -> Tuple[SyncSignal, int]:
+        """
+        The signal `data` is received as and the peak memory traced
+        """
+        frames = encode_signal(SyncData(data), stream_id=1,
+                               chunk_size=CHUNK_SIZE)
+        left, right = socket.socketpair()
+        sender = threading.Thread(
+            target=lambda: [left.sendall(frame) for frame in frames])
+        reader = SignalReader(right)
+        tracemalloc.start()
+        try:
+            sender.start()
+            sig = None
+            while sig is None:
+                sig = reader.read_signal()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            sender.join()
+            left.close()
+            right.close()
+        return sig, peak
+
+    def test_peak_memory(self):
+        for size in (1024 * 1024, 20 * 1024 * 1024):
+            with self.subTest(size=size):
+                data = os.urandom(size)
+                sig, peak = self.receive(data)
+                self.assertEqual(sig.data, data)
+                self.assertLess(peak, size * 1.1 + 256 * 1024)
+
+
+if __name__ == "__main__":
+    unittest.main()
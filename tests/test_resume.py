@@ -0,0 +1,90 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from sync_clip.remote.client import Client
+from sync_clip.stuff.sync_signal import SyncData
+from sync_clip.utils.util_hash import hash_data
+
+from servers import free_port, spawn_server, wait
+
+SIZE = 8 * 1024 * 1024
+FRAME_SIZE = 256 * 1024
+# handshakes, frame headers and heartbeats
+OVERHEAD = 64 * 1024
+
+
+class LimitedClient(Client):
+    """
+    Writes `RATE` bytes per second, counting them: the server reads them
+    as they are written, no socket buffer holds any
+    """
+    RATE = 16 * 1024 * 1024
+    # the constructor writes already
+    written = 0
+
+    def _write_frames(self, conn, buffers):
+        super()._write_frames(conn, buffers)
+        size = sum(len(buffer) for buffer in buffers)
+        self.written += size
+        time.sleep(size / self.RATE)
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        # the server spools uploads in its cache, kept across the restart
+        self.home = tempfile.mkdtemp(prefix="test_resume-")
+        self.env = dict(os.environ, HOME=self.home)
+        self.port = free_port()
+        self.server = spawn_server(self.port, self.env)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.kill()
+        self.server.wait()
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def connect(self, cls=Client) -> Client:
+        client = cls("127.0.0.1", self.port)
+        client.start()
+        self.clients.append(client)
+        return client
+
+    def test_server_killed_mid_upload(self):
+        receiver = self.connect()
+        sender = self.connect(LimitedClient)
+        sender.chunk_sizer.set_max_chunk_size(FRAME_SIZE)
+        self.assertTrue(wait(lambda: receiver.is_connected
+                             and sender.is_connected))
+        image = b"\x89PNG\r\n\x1a\n" + os.urandom(SIZE - 8)
+        threading.Thread(target=sender.send_sync_data,
+                         args=(SyncData(image),), daemon=True).start()
+        self.assertTrue(wait(lambda: sender.written >= SIZE // 2,
+                             timeout=10))
+        # killed holding half the upload in its spool
+        self.server.kill()
+        self.server.wait()
+        self.server = spawn_server(self.port, self.env)
+
+        deadline = time.monotonic() + 30
+        received = None
+        while received is None and time.monotonic() < deadline:
+            sig = receiver.recv_sync_sig.get(timeout=deadline
+                                             - time.monotonic())
+            if isinstance(sig, SyncData) and len(sig.data) == SIZE:
+                received = sig.data
+        self.assertIsNotNone(received)
+        self.assertEqual(hash_data(received), hash_data(image))
+        # resumed where the spool was cut, not sent again whole
+        sent_again = sender.written - SIZE
+        self.assertLessEqual(sent_again, FRAME_SIZE + OVERHEAD)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import os
+import unittest
+
+from sync_clip.utils.util_hash import *
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def test_small_payloads(self):
+        self.assertEqual(Fingerprint("copied"), Fingerprint(b"copied"))
+        self.assertNotEqual(Fingerprint("copied"), Fingerprint("copies"))
+
+    def test_edit_between_samples(self):
+        # 200KB: offset 51000 is in none of the sampled blocks
+        text = bytearray(os.urandom(100 * 1024).hex().encode())
+        fingerprint = Fingerprint(bytes(text))
+        text[51000] ^= 1
+        edited = Fingerprint(bytes(text))
+        self.assertEqual(fingerprint.sample, edited.sample)
+        self.assertNotEqual(fingerprint, edited)
+        self.assertEqual(edited, Fingerprint(bytes(text)))
+
+    def test_large_payloads(self):
+        data = os.urandom(200 * 1024)
+        fingerprint = Fingerprint(data)
+        fingerprint.digest()
+        self.assertEqual(fingerprint, Fingerprint(bytes(data)))
+        self.assertNotEqual(fingerprint, Fingerprint(data[:-1] + b"\0"))
+
+
+if __name__ == "__main__":
+    unittest.main()